@@ -0,0 +1,379 @@
+"""
+Замеры производительности сборщиков
+
+Генерирует архивы заданных масштабов, запускает на них режимы сборщика
+(каждый в отдельном процессе, чтобы пиковая память не смешивалась) и
+выводит результаты в JSON. С `--baseline` сравнивает результаты с
+сохраненными ранее и завершается с кодом 1 при замедлении.
+
+Режим `cli` запускает `collector.py` отдельным интерпретатором: на малом
+масштабе (`1x10`) его время — время холодного запуска сборщика.
+
+    cd src
+    python3 benchmark.py --scale 1x10 --scale 50x100 --scale 500x1000 \\
+        --output benchmark.json
+    python3 benchmark.py --scale 50x100 --baseline benchmark.json
+"""
+
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, NamedTuple, Sequence
+
+from collector import (
+    DEFAULT_READAHEAD, collect_documents_info_multiple_core,
+    collect_documents_info_resumable, collect_documents_info_single_core,
+    collect_documents_info_streaming, collect_documents_multiple_core,
+)
+from generator import (
+    DEFAULT_MAX_OBJECTS_QUANTITY, generate_zip_files_with_random_documents,
+)
+from instrumentation import Instrumentation
+from sinks import ColumnarSink
+from utils import filter_file_sizes
+
+
+DEFAULT_SCALES = ('1x10', '50x100')
+DEFAULT_REPEAT = 1
+DEFAULT_REGRESSION_THRESHOLD = 0.1
+# Как часто проверять, жив ли процесс замера, пока нет результата
+RESULT_POLL_INTERVAL = 1
+
+
+class Scale(NamedTuple):
+    zips_quantity: int
+    documents_per_zip: int
+    max_objects_quantity: int = DEFAULT_MAX_OBJECTS_QUANTITY
+
+    @classmethod
+    def parse(cls, value: str) -> 'Scale':
+        """ Разбирает масштаб вида `50x100` или `50x100x10` """
+        return cls(*map(int, value.split('x')))
+
+    def __str__(self):
+        return 'x'.join(map(str, self))
+
+
+def _collect_to_csv_files(collector: Callable, **options) -> Callable:
+    def collect(
+        dir_path: str, output_dir_path: str,
+        instrumentation: Instrumentation = None,
+    ) -> None:
+        with open(
+                 os.path.join(output_dir_path, 'documents.csv'), 'wt',
+                 encoding='utf-8', newline='',
+             ) as docs_fh, \
+             open(
+                 os.path.join(output_dir_path, 'objects.csv'), 'wt',
+                 encoding='utf-8', newline='',
+             ) as objs_fh:
+
+            collector(
+                dir_path, docs_fh, objs_fh, instrumentation=instrumentation,
+                **options,
+            )
+
+    return collect
+
+
+def _collect_to_columnar_files(collector: Callable, **options) -> Callable:
+    def collect(
+        dir_path: str, output_dir_path: str,
+        instrumentation: Instrumentation = None,
+    ) -> None:
+        with open(
+                 os.path.join(output_dir_path, 'documents.dcol'), 'wb',
+             ) as docs_fh, \
+             open(
+                 os.path.join(output_dir_path, 'objects.dcol'), 'wb',
+             ) as objs_fh, \
+             ColumnarSink(docs_fh, objs_fh) as sink:
+
+            collector(
+                dir_path, sink, instrumentation=instrumentation, **options,
+            )
+
+    return collect
+
+
+def _collect_resumable(
+    dir_path: str, output_dir_path: str,
+    instrumentation: Instrumentation = None,
+) -> None:
+    collect_documents_info_resumable(
+        dir_path,
+        os.path.join(output_dir_path, 'documents.csv'),
+        os.path.join(output_dir_path, 'objects.csv'),
+        verbose=False, instrumentation=instrumentation,
+    )
+
+
+def _collect_cli(
+    dir_path: str, output_dir_path: str,
+    instrumentation: Instrumentation = None,
+) -> None:
+    # Запуск интерпретатора, импорт модулей и выбор пула входят в замер;
+    # этапы в другом процессе не замеряются
+    subprocess.run(
+        [
+            sys.executable,
+            os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         'collector.py'),
+            '--dir', dir_path,
+        ],
+        cwd=output_dir_path, check=True,
+    )
+
+
+# Режимы сборщика: функция получает папку с архивами, папку для выходных
+# файлов и объект для замеров этапов
+MODES: Dict[str, Callable[[str, str, Instrumentation], None]] = {
+    'single_core': _collect_to_csv_files(collect_documents_info_single_core),
+    'multiple_core': _collect_to_csv_files(
+        collect_documents_info_multiple_core,
+    ),
+    'multiple_core_render_in_workers': _collect_to_csv_files(
+        collect_documents_info_multiple_core, render_in_workers=True,
+    ),
+    'multiple_core_prefetched': _collect_to_csv_files(
+        collect_documents_info_multiple_core, render_in_workers=True,
+        readahead=DEFAULT_READAHEAD,
+    ),
+    'streaming': _collect_to_csv_files(collect_documents_info_streaming),
+    'multiple_core_columnar': _collect_to_columnar_files(
+        collect_documents_multiple_core, render_in_workers=True,
+    ),
+    'resumable': _collect_resumable,
+    'cli': _collect_cli,
+}
+
+
+def _run_mode(
+    mode: str, dir_path: str, stages: bool,
+    results: multiprocessing.Queue,
+) -> None:
+    # Вывод сборщиков (и процессов их пулов) не нужен в результатах замеров
+    devnull_fd = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull_fd, sys.stdout.fileno())
+    instrumentation = Instrumentation() if stages else None
+    with tempfile.TemporaryDirectory() as output_dir_path:
+        started_at = time.perf_counter()
+        MODES[mode](dir_path, output_dir_path, instrumentation)
+        duration = time.perf_counter() - started_at
+        output_size = sum(
+            size for _, size in filter_file_sizes(output_dir_path)
+        )
+
+    # `ru_maxrss` в килобайтах (Linux). Для дочерних процессов берется
+    # максимум по всем завершенным процессам пула
+    results.put(
+        {
+            'duration': duration,
+            'output_size': output_size,
+            'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            'peak_children_rss_kb': (
+                resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+            ),
+            # Суммарное время этапов по всем процессам
+            'stages': {
+                stage: stats['total']
+                for stage, stats in instrumentation.report()['stages'].items()
+            } if instrumentation else {},
+        }
+    )
+
+
+def measure_mode(mode: str, dir_path: str, stages: bool = True) -> dict:
+    """
+    Запускает режим в отдельном процессе и возвращает замеры
+
+    При `stages` замеряется время этапов, что немного замедляет сбор.
+    Если процесс завершился без результата (например, упал), выбрасывается
+    `RuntimeError` с кодом завершения.
+    """
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    process = context.Process(
+        target=_run_mode, args=(mode, dir_path, stages, results),
+    )
+    process.start()
+    result = None
+    while result is None and process.is_alive():
+        try:
+            result = results.get(timeout=RESULT_POLL_INTERVAL)
+        except queue.Empty:
+            pass
+    if result is None:
+        # Результат мог быть отправлен перед самым завершением процесса
+        try:
+            result = results.get(timeout=RESULT_POLL_INTERVAL)
+        except queue.Empty:
+            pass
+    process.join()
+    if result is None:
+        raise RuntimeError(
+            f'Mode {mode} exited with code {process.exitcode} '
+            f'without a result',
+        )
+    return result
+
+
+def run_benchmark(
+    scales: Sequence[Scale], modes: Sequence[str] = tuple(MODES),
+    repeat: int = DEFAULT_REPEAT, verbose: bool = True, stages: bool = True,
+) -> dict:
+    results = []
+    for scale in scales:
+        with tempfile.TemporaryDirectory() as temp_dir_path:
+            dir_path = os.path.join(temp_dir_path, 'documents')
+            started_at = time.perf_counter()
+            generate_zip_files_with_random_documents(
+                dir_path, scale.zips_quantity, scale.documents_per_zip,
+                verbose=False, max_objects_quantity=scale.max_objects_quantity,
+            )
+            generate_duration = time.perf_counter() - started_at
+            input_size = sum(size for _, size in filter_file_sizes(dir_path))
+            documents_quantity = scale.zips_quantity * scale.documents_per_zip
+
+            for mode in modes:
+                # Из повторов берется самый быстрый
+                measurement = min(
+                    (
+                        measure_mode(mode, dir_path, stages)
+                        for _ in range(repeat)
+                    ),
+                    key=lambda measurement: measurement['duration'],
+                )
+                duration = measurement.pop('duration')
+                mode_stages = measurement.pop('stages')
+                result = {
+                    'scale': str(scale),
+                    'mode': mode,
+                    'documents': documents_quantity,
+                    'input_size': input_size,
+                    'duration': duration,
+                    'documents_per_second': documents_quantity / duration,
+                    'megabytes_per_second': input_size / duration / 2 ** 20,
+                    'stages': {
+                        'generate': generate_duration,
+                        'collect': duration,
+                        **mode_stages,
+                    },
+                }
+                result.update(measurement)
+                results.append(result)
+
+                if verbose:
+                    print(
+                        f'{scale} {mode}: {duration:.3f} s, '
+                        f'{result["documents_per_second"]:.0f} docs/s',
+                        file=sys.stderr,
+                    )
+
+    return {
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'processor': platform.processor() or platform.machine(),
+            'cpu_count': os.cpu_count(),
+        },
+        'results': results,
+    }
+
+
+def compare_with_baseline(
+    report: dict, baseline: dict,
+    threshold: float = DEFAULT_REGRESSION_THRESHOLD,
+) -> List[dict]:
+    """
+    Возвращает замеры, которые медленнее базовых больше, чем на `threshold`
+    """
+    baseline_durations = {
+        (result['scale'], result['mode']): result['duration']
+        for result in baseline['results']
+    }
+    regressions = []
+    for result in report['results']:
+        baseline_duration = baseline_durations.get(
+            (result['scale'], result['mode']),
+        )
+        if baseline_duration is None:
+            continue
+        ratio = result['duration'] / baseline_duration
+        if ratio > 1 + threshold:
+            regressions.append(
+                {
+                    'scale': result['scale'],
+                    'mode': result['mode'],
+                    'duration': result['duration'],
+                    'baseline_duration': baseline_duration,
+                    'ratio': ratio,
+                }
+            )
+    return regressions
+
+
+def parse_arguments(arguments: Sequence[str] = None) -> argparse.Namespace:
+    arguments_parser = argparse.ArgumentParser(
+        description='Замеры производительности сборщиков',
+    )
+    arguments_parser.add_argument(
+        '--scale', dest='scales', action='append', type=Scale.parse,
+        help='архивы x документы в архиве [x объекты в документе]',
+    )
+    arguments_parser.add_argument(
+        '--mode', dest='modes', action='append', choices=tuple(MODES),
+    )
+    arguments_parser.add_argument(
+        '--repeat', type=int, default=DEFAULT_REPEAT,
+    )
+    arguments_parser.add_argument(
+        '--no-stages', dest='stages', action='store_false',
+        help='не замерять время этапов сборщика',
+    )
+    arguments_parser.add_argument('--output', help='файл для результатов')
+    arguments_parser.add_argument(
+        '--baseline', help='результаты для сравнения',
+    )
+    arguments_parser.add_argument(
+        '--threshold', type=float, default=DEFAULT_REGRESSION_THRESHOLD,
+        help='допустимое замедление относительно базовых результатов',
+    )
+    return arguments_parser.parse_args(arguments)
+
+
+def main(arguments: Sequence[str] = None) -> int:
+    arguments = parse_arguments(arguments)
+    report = run_benchmark(
+        arguments.scales or list(map(Scale.parse, DEFAULT_SCALES)),
+        arguments.modes or tuple(MODES), arguments.repeat,
+        stages=arguments.stages,
+    )
+
+    if arguments.baseline:
+        with open(arguments.baseline, 'rt', encoding='utf-8') as fh:
+            report['regressions'] = compare_with_baseline(
+                report, json.load(fh), arguments.threshold,
+            )
+
+    if arguments.output:
+        with open(arguments.output, 'wt', encoding='utf-8') as fh:
+            json.dump(report, fh, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    return 1 if report.get('regressions') else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,61 @@
+import json
+import os
+from typing import List, Sequence, Set
+
+
+CHECKPOINT_FILE_SUFFIX = '.checkpoint.json'
+
+
+class Checkpoint:
+    """
+    Состояние долгого сбора информации о документах
+
+    Хранит план задач, уже записанные в выходные файлы задачи и размеры
+    выходных файлов на момент сохранения. При возобновлении файлы
+    обрезаются до этих размеров, а записанные задачи пропускаются, поэтому
+    повторно выполняется не больше одного интервала между сохранениями.
+    """
+    def __init__(
+        self, path: str, tasks: Sequence[Sequence] = (),
+        completed: Set[int] = None, offsets: Sequence[int] = (),
+    ) -> None:
+        self.path = path
+        self.tasks = [tuple(task) for task in tasks]
+        self.completed = completed if completed is not None else set()
+        self.offsets = list(offsets)
+
+    @classmethod
+    def load(cls, path: str) -> 'Checkpoint':
+        with open(path, 'rt', encoding='utf-8') as checkpoint_file:
+            state = json.load(checkpoint_file)
+        return cls(
+            path, state['tasks'], set(state['completed']), state['offsets'],
+        )
+
+    def save(self) -> None:
+        temp_path = f'{self.path}.tmp'
+        with open(temp_path, 'wt', encoding='utf-8') as checkpoint_file:
+            json.dump(
+                {
+                    'tasks': self.tasks,
+                    'completed': sorted(self.completed),
+                    'offsets': self.offsets,
+                },
+                checkpoint_file,
+            )
+            checkpoint_file.flush()
+            os.fsync(checkpoint_file.fileno())
+        os.replace(temp_path, self.path)
+
+    def remove(self) -> None:
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    @property
+    def pending(self) -> List[int]:
+        return [
+            task_num for task_num in range(len(self.tasks))
+            if task_num not in self.completed
+        ]
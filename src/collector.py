@@ -1,33 +1,107 @@
 """
-|================|===============|===================|======================|
-| COLLECTOR TYPE | ZIPS QUANTITY | DOCUMENTS PER ZIP | DURATION (SEC)       |
-|================|===============|===================|======================|
-|  single core   |   50          |   100             |   0.95585036277771   |
-|  multiple core |   50          |   100             |   0.8466031551361084 |
-|----------------|---------------|-------------------|----------------------|
-|  single core   |   500         |   1000            |   91.20046877861023  |
-|  multiple core |   500         |   1000            |   54.7540442943573   |
-|----------------|---------------|-------------------|----------------------|
-|  single core   |   500         |   10000           |   938.2648339271545  |
-|  multiple core |   500         |   10000           |   571.2564518451691  |
-|----------------|---------------|-------------------|----------------------|
+Сбор информации о документах из zip-архивов в documents.csv и objects.csv
+
+Формат выходных файлов задается приемником (`sinks.py`), по умолчанию —
+CSV. Замеры производительности режимов сборщика — `benchmark.py`.
 """
 
 
-import csv
+import argparse
 import itertools
 import multiprocessing
+import os
+import queue
+import signal
+import sys
+import threading
+import time
+import zipfile
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from functools import partial
+from operator import attrgetter, itemgetter
 from io import TextIOWrapper
-from typing import List, Iterable
-from zipfile import ZipFile
+from typing import (
+    Any, Callable, Container, Dict, Iterable, Iterator, List, NamedTuple,
+    Optional, Sequence, Set, Tuple, Type, Union,
+)
+from zipfile import ZipFile, ZipInfo
 
 from lxml import etree
 
-from entities import Document, DocumentObject
-from utils import filter_file_paths
+from checkpoint import CHECKPOINT_FILE_SUFFIX, Checkpoint
+from dedup import DEDUP_INDEX_FILE_SUFFIX, IdIndex
+from entities import Document, DocumentBatch, DocumentObject
+from faults import (
+    ERROR_REPORT_FILE_SUFFIX, DEFAULT_MAX_ATTEMPTS, FaultTolerance,
+    TaskOutcome, call_isolated, describe_error, get_member_errors,
+    is_transient,
+)
+from instrumentation import (
+    COUNTER_BYTES, COUNTER_CACHED, COUNTER_DOCUMENTS, COUNTER_OBJECTS,
+    NULL_INSTRUMENTATION,
+    STAGE_BACKPRESSURE, STAGE_DECODE, STAGE_DECOMPRESS, STAGE_OPEN,
+    IO_WORKER, STAGE_PARSE, STAGE_READ, STAGE_WRITE, Instrumentation,
+    call_instrumented, get_instrumentation, set_instrumentation,
+)
+from manifest import MANIFEST_FILE_SUFFIX, ArchiveManifest, member_key
+from parse_cache import (
+    DEFAULT_MAX_ENTRIES, ParseCache, call_cached, get_parse_cache,
+    set_parse_cache,
+)
+from sinks import (
+    COMPRESSION_EXTENSIONS, DEFAULT_SINK, SINKS, CsvSink, DeduplicatingSink,
+    PartitionedSink, Sink, format_sink,
+)
+from utils import (
+    InProcessPool, batched, filter_file_paths, plan_chunksize, pool_or_new,
+)
+from watcher import (
+    DEFAULT_INCOMPLETE_TIMEOUT, DEFAULT_POLL_INTERVAL, ReadyFiles,
+    create_watcher,
+)
+from zip_reader import (
+    MmapZipReader, ZipBufferReader, read_zip_members_range,
+)
+
+
+# Контрольные точки
+DEFAULT_CHECKPOINT_INTERVAL = 30
+
+# Потоковая обработка
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_MAX_IN_FLIGHT_BATCHES = 16
+
+# Отслеживание папки: как часто проверяется `stop` и ожидающие архивы
+WATCH_TIMEOUT = 0.5
+
+# Чтение архивов в отдельных потоках
+DEFAULT_READAHEAD = 8
+DEFAULT_IO_THREADS = 4
 
+# Разбиение архивов на задачи
+DEFAULT_SHARDS_PER_PROCESS = 4
+DEFAULT_MIN_SHARD_SIZE = 1024 * 1024
+# Задач на процесс в работе при изоляции ошибок без срока задачи
+ISOLATED_TASKS_PER_PROCESS = 2
+# Меньшие входные данные (около 0,1 с разбора на одном ядре) собираются
+# без пула процессов: его запуск дольше разбора
+MIN_POOL_INPUT_SIZE = 1024 * 1024
 
-def document_from_xml(xml: str) -> Document:
+# Режимы командной строки: полный сбор с контрольными точками, только
+# новые и измененные архивы, отслеживание папки
+MODE_FULL = 'full'
+MODE_INCREMENTAL = 'incremental'
+MODE_WATCH = 'watch'
+MODES = (MODE_FULL, MODE_INCREMENTAL, MODE_WATCH)
+
+# Разбор XML-документов
+XML_PARSER_XPATH = 'xpath'
+XML_PARSER_STREAM = 'stream'
+DEFAULT_XML_PARSER = XML_PARSER_STREAM
+
+
+def document_from_xml_xpath(xml: str) -> Document:
     xml_tree = etree.fromstring(xml)
 
     id_element = (xml_tree.xpath('(/root/var[@name="id"])[1]') or (None, ))[0]
@@ -46,78 +120,1951 @@ def document_from_xml(xml: str) -> Document:
     )
 
 
+class DocumentXmlTarget:
+    """
+    SAX-подобная цель для `lxml.etree.XMLParser`
+
+    Дерево не строится: за один проход выбираются те же значения, что и
+    XPath-выражения в `document_from_xml_xpath`. Цель (вместе с парсером)
+    переиспользуется между документами, поэтому состояние сбрасывается
+    в `reset`.
+    """
+    __slots__ = ('_path', '_id', '_level', '_objects')
+
+    def __init__(self) -> None:
+        self.reset()
+
+    def reset(self) -> None:
+        self._path = []
+        self._id = self._level = None
+        self._objects = []
+
+    def start(self, tag: str, attrib) -> None:
+        path = self._path
+        if len(path) == 1 and path[0] == 'root':
+            if tag == 'var':
+                # Как и в XPath, берется первый подходящий элемент
+                name = attrib.get('name')
+                if name == 'id' and self._id is None:
+                    self._id = (attrib.get('value'), )
+                elif name == 'level' and self._level is None:
+                    self._level = (attrib.get('value'), )
+        elif len(path) == 2 and path[1] == 'objects' and path[0] == 'root':
+            if tag == 'object':
+                self._objects.append(attrib.get('name'))
+        path.append(tag)
+
+    def end(self, tag: str) -> None:
+        self._path.pop()
+
+    def close(self) -> Document:
+        return Document(
+            id_=self._id[0] if self._id is not None else None,
+            level=self._level[0] if self._level is not None else None,
+            objects=[DocumentObject(name=name) for name in self._objects],
+        )
+
+
+class DocumentBatchXmlTarget(DocumentXmlTarget):
+    """ Цель, которая дописывает документ в пачку `batch` """
+    __slots__ = ('batch', )
+
+    def close(self) -> None:
+        self.batch.append(
+            self._id[0] if self._id is not None else None,
+            self._level[0] if self._level is not None else None,
+            self._objects,
+        )
+
+
+_stream_parsers = threading.local()
+
+
+def _get_stream_parser(
+    target_class: Type[DocumentXmlTarget] = DocumentXmlTarget,
+) -> Tuple[etree.XMLParser, DocumentXmlTarget]:
+    # Создание парсера занимает больше времени, чем разбор небольшого
+    # документа, поэтому парсер кэшируется (парсеры lxml нельзя разделять
+    # между потоками)
+    parsers = _stream_parsers.__dict__
+    try:
+        parser, target = parsers[target_class]
+    except KeyError:
+        target = target_class()
+        parser = etree.XMLParser(target=target)
+        parsers[target_class] = parser, target
+    target.reset()
+    return parser, target
+
+
+def document_from_xml_stream(xml) -> Document:
+    parser, _ = _get_stream_parser()
+    return etree.fromstring(xml, parser)
+
+
+def document_from_xml_buffer_stream(xml) -> Document:
+    # Старые версии lxml разбирают только str и bytes
+    if not _LXML_PARSES_BUFFERS and isinstance(xml, memoryview):
+        xml = xml.tobytes()
+    return document_from_xml_stream(xml)
+
+
+def document_from_xml_buffer_xpath(xml) -> Document:
+    return document_from_xml_xpath(str(xml, 'utf-8'))
+
+
+def append_xml_buffer_stream(batch: DocumentBatch, xml) -> None:
+    """ Разбирает документ сразу в пачку, без `Document` """
+    if not _LXML_PARSES_BUFFERS and isinstance(xml, memoryview):
+        xml = xml.tobytes()
+    parser, target = _get_stream_parser(DocumentBatchXmlTarget)
+    target.batch = batch
+    try:
+        etree.fromstring(xml, parser)
+    finally:
+        target.batch = None
+
+
+def append_xml_buffer_xpath(batch: DocumentBatch, xml) -> None:
+    batch.append_document(document_from_xml_buffer_xpath(xml))
+
+
+def _lxml_parses_buffers() -> bool:
+    try:
+        etree.fromstring(memoryview(b'<root/>'))
+    except (TypeError, ValueError):
+        return False
+    return True
+
+
+_LXML_PARSES_BUFFERS = _lxml_parses_buffers()
+
+XML_PARSERS = {
+    XML_PARSER_XPATH: document_from_xml_xpath,
+    XML_PARSER_STREAM: document_from_xml_stream,
+}
+# Разбор данных файла архива (`bytes` или `memoryview`) без
+# промежуточной строки
+XML_BUFFER_PARSERS = {
+    XML_PARSER_XPATH: document_from_xml_buffer_xpath,
+    XML_PARSER_STREAM: document_from_xml_buffer_stream,
+}
+# Разбор данных файла архива с дописыванием в `DocumentBatch`
+XML_BATCH_PARSERS = {
+    XML_PARSER_XPATH: append_xml_buffer_xpath,
+    XML_PARSER_STREAM: append_xml_buffer_stream,
+}
+
+
+def document_from_xml(xml: str, parser: str = DEFAULT_XML_PARSER) -> Document:
+    return XML_PARSERS[parser](xml)
+
+
+class ZipFileShard(NamedTuple):
+    """ Диапазон XML-файлов архива `[start, stop)` для одной задачи пула """
+    zip_file_path: str
+    start: int
+    stop: int
+    compressed_size: int
+
+
+def zipped_xml_files(
+    zip_file: Union[ZipFile, MmapZipReader],
+) -> List[ZipInfo]:
+    return [
+        zip_info for zip_info in zip_file.infolist()
+        if zip_info.filename.endswith('.xml')
+    ]
+
+
+def split_zip_file(
+    zip_file_path: str, shard_size: int, known_members: Container[str] = (),
+) -> List[ZipFileShard]:
+    """
+    Делит XML-файлы архива на непрерывные диапазоны по `shard_size` байт
+
+    Читается только центральный каталог архива. Размер диапазона
+    считается по сжатым данным, поэтому может превышать `shard_size`
+    не больше, чем на размер одного файла. Файлы с ключами
+    (`manifest.member_key`) из `known_members` в диапазоны не входят.
+    """
+    with ZipFile(zip_file_path, 'r') as zip_file:
+        zip_infos = zipped_xml_files(zip_file)
+
+    shards = []
+    start = compressed_size = 0
+    for zip_info_num, zip_info in enumerate(zip_infos):
+        if known_members and member_key(zip_info) in known_members:
+            if zip_info_num > start:
+                shards.append(
+                    ZipFileShard(
+                        zip_file_path, start, zip_info_num, compressed_size,
+                    )
+                )
+            start, compressed_size = zip_info_num + 1, 0
+            continue
+        compressed_size += zip_info.compress_size
+        if compressed_size >= shard_size or zip_info_num + 1 == len(
+            zip_infos,
+        ):
+            shards.append(
+                ZipFileShard(
+                    zip_file_path, start, zip_info_num + 1, compressed_size,
+                )
+            )
+            start, compressed_size = zip_info_num + 1, 0
+
+    return shards
+
+
+def plan_zip_file_shards(
+    zip_file_paths: Iterable[str], processes: int = None,
+    shards_per_process: int = DEFAULT_SHARDS_PER_PROCESS,
+    min_shard_size: int = DEFAULT_MIN_SHARD_SIZE,
+    fault_tolerance: FaultTolerance = None,
+    known_members: Dict[str, Set[str]] = None,
+) -> List[ZipFileShard]:
+    """
+    Планирует задачи пула так, чтобы были заняты все ядра
+
+    Размер диапазона выбирается из общего сжатого размера всех архивов:
+    на каждый процесс приходится около `shards_per_process` задач, поэтому
+    один большой архив или архивов меньше, чем ядер, не оставляют пул
+    простаивать. Задачи упорядочены от больших к меньшим (LPT), чтобы в
+    конце не оставалось одной большой задачи при свободных процессах.
+
+    С `fault_tolerance` архивы, центральный каталог которых не читается,
+    записываются в отчет об ошибках и пропускаются.
+
+    `known_members` — ключи уже собранных файлов по пути архива (см.
+    `split_zip_file`).
+    """
+    known_members = known_members or {}
+    readable_zip_file_paths = []
+    compressed_sizes = []
+    for zip_file_path in zip_file_paths:
+        zip_file_known_members = known_members.get(zip_file_path, ())
+        try:
+            with ZipFile(zip_file_path, 'r') as zip_file:
+                compressed_sizes.append(
+                    sum(
+                        zip_info.compress_size
+                        for zip_info in zipped_xml_files(zip_file)
+                        if member_key(zip_info) not in zip_file_known_members
+                    )
+                )
+        except (OSError, zipfile.BadZipFile) as error:
+            if fault_tolerance is None:
+                raise
+            fault_tolerance.add(zip_file_path, None, describe_error(error))
+            continue
+        readable_zip_file_paths.append(zip_file_path)
+
+    shards_quantity = (processes or os.cpu_count() or 1) * shards_per_process
+    shard_size = max(min_shard_size, sum(compressed_sizes) // shards_quantity)
+
+    shards = [
+        shard
+        for zip_file_path in readable_zip_file_paths
+        for shard in split_zip_file(
+            zip_file_path, shard_size, known_members.get(zip_file_path, ()),
+        )
+    ]
+    shards.sort(key=attrgetter('compressed_size'), reverse=True)
+    return shards
+
+
+def plan_shards_chunksize(
+    shards: Sequence[ZipFileShard], processes: int = None,
+    min_shard_size: int = DEFAULT_MIN_SHARD_SIZE,
+) -> int:
+    """ Мелкие диапазоны (небольшие архивы) передаются в пул пачками """
+    return plan_chunksize(
+        [shard.compressed_size for shard in shards], processes, min_shard_size,
+    )
+
+
+def _iter_documents_from_zip_reader_instrumented(
+    zip_reader: ZipBufferReader, zip_infos: Sequence[ZipInfo], parser: str,
+) -> Iterator[Document]:
+    instrumentation = get_instrumentation()
+    document_from_xml_buffer = XML_BUFFER_PARSERS[parser]
+    if parser == XML_PARSER_XPATH:
+        # Декодирование замеряется отдельно от разбора
+        document_from_xml_buffer = document_from_xml_xpath
+
+    xml_buffers = zip_reader.iter_read(zip_infos)
+    while True:
+        with instrumentation.stage(STAGE_DECOMPRESS):
+            xml = next(xml_buffers, None)
+        if xml is None:
+            break
+        instrumentation.count(COUNTER_BYTES, len(xml))
+        if parser == XML_PARSER_XPATH:
+            with instrumentation.stage(STAGE_DECODE):
+                xml = str(xml, 'utf-8')
+        with instrumentation.stage(STAGE_PARSE):
+            document = document_from_xml_buffer(xml)
+        instrumentation.count(COUNTER_DOCUMENTS)
+        instrumentation.count(COUNTER_OBJECTS, len(document.objects))
+        yield document
+
+
+def _iter_documents_from_zip_reader(
+    zip_reader: ZipBufferReader, zip_infos: Sequence[ZipInfo], parser: str,
+) -> Iterator[Document]:
+    if get_parse_cache() is not None:
+        return iter(
+            _fill_document_batch_members(
+                DocumentBatch(), zip_reader, zip_infos, parser,
+            )
+        )
+    if get_instrumentation() is not NULL_INSTRUMENTATION:
+        return _iter_documents_from_zip_reader_instrumented(
+            zip_reader, zip_infos, parser,
+        )
+    return map(XML_BUFFER_PARSERS[parser], zip_reader.iter_read(zip_infos))
+
+
+def _fill_document_batch(
+    batch: DocumentBatch, zip_reader: ZipBufferReader,
+    zip_infos: Sequence[ZipInfo], parser: str,
+) -> DocumentBatch:
+    member_errors = get_member_errors()
+    if member_errors is None:
+        return _fill_document_batch_members(
+            batch, zip_reader, zip_infos, parser,
+        )
+
+    # Задача выполняется с изоляцией ошибок (`faults.call_isolated`).
+    # Ошибки редки, поэтому файлы разбираются по одному, только если
+    # разбор всех файлов сразу не удался. Документы файла с ошибкой
+    # отбрасываются, если парсер успел дописать их в пачку
+    length = len(batch)
+    try:
+        return _fill_document_batch_members(
+            batch, zip_reader, zip_infos, parser,
+        )
+    except Exception:
+        batch.truncate(length)
+    for zip_info in zip_infos:
+        length = len(batch)
+        try:
+            _fill_document_batch_members(
+                batch, zip_reader, (zip_info, ), parser,
+            )
+        except Exception as error:
+            batch.truncate(length)
+            member_errors.append((zip_info.filename, describe_error(error)))
+    return batch
+
+
+def _fill_document_batch_members(
+    batch: DocumentBatch, zip_reader: ZipBufferReader,
+    zip_infos: Sequence[ZipInfo], parser: str,
+) -> DocumentBatch:
+    parse_cache = get_parse_cache()
+    if parse_cache is None:
+        return _parse_document_batch_members(
+            batch, zip_reader, zip_infos, parser,
+        )
+
+    # Файлы из кэша (`parse_cache`) не распаковываются и не разбираются.
+    # Остальные разбираются подряд идущими группами, чтобы документы
+    # остались в порядке файлов архива
+    instrumentation = get_instrumentation()
+    missed_zip_infos = []
+    for zip_info, document in zip(
+        zip_infos, parse_cache.get_many(zip_infos),
+    ):
+        if document is None:
+            missed_zip_infos.append(zip_info)
+            continue
+        if missed_zip_infos:
+            _parse_document_batch_members_cached(
+                batch, zip_reader, missed_zip_infos, parser, parse_cache,
+            )
+            missed_zip_infos = []
+        batch.append(*document)
+        instrumentation.count(COUNTER_CACHED)
+        instrumentation.count(COUNTER_DOCUMENTS)
+        instrumentation.count(COUNTER_OBJECTS, len(document[2]))
+    if missed_zip_infos:
+        _parse_document_batch_members_cached(
+            batch, zip_reader, missed_zip_infos, parser, parse_cache,
+        )
+    return batch
+
+
+def _parse_document_batch_members_cached(
+    batch: DocumentBatch, zip_reader: ZipBufferReader,
+    zip_infos: Sequence[ZipInfo], parser: str, parse_cache: ParseCache,
+) -> None:
+    # Каждый файл дописывает в пачку ровно один документ
+    start = len(batch)
+    _parse_document_batch_members(batch, zip_reader, zip_infos, parser)
+    parse_cache.put_batch(zip_infos, batch, start)
+
+
+def _parse_document_batch_members(
+    batch: DocumentBatch, zip_reader: ZipBufferReader,
+    zip_infos: Sequence[ZipInfo], parser: str,
+) -> DocumentBatch:
+    if get_instrumentation() is not NULL_INSTRUMENTATION:
+        # Замеры этапов ведутся по документам
+        for document in _iter_documents_from_zip_reader_instrumented(
+            zip_reader, zip_infos, parser,
+        ):
+            batch.append_document(document)
+        return batch
+
+    append_xml_buffer = XML_BATCH_PARSERS[parser]
+    for xml in zip_reader.iter_read(zip_infos):
+        append_xml_buffer(batch, xml)
+    return batch
+
+
+def iter_documents_from_zip_file(
+    zip_file_path: str, parser: str = DEFAULT_XML_PARSER,
+    start: int = 0, stop: int = None,
+) -> Iterator[Document]:
+    """
+    Разбирает XML-файлы архива с `start` по `stop`
+
+    Архив читается через mmap (`zip_reader.MmapZipReader`): данные файлов
+    передаются парсеру как есть, без декодирования в строку.
+    """
+    with get_instrumentation().stage(STAGE_OPEN):
+        zip_reader = MmapZipReader(zip_file_path)
+    with zip_reader:
+        yield from _iter_documents_from_zip_reader(
+            zip_reader, zipped_xml_files(zip_reader)[start:stop], parser,
+        )
+
+
 def documents_from_zip_file(
     zip_file_path: str, verbose: bool = True,
+    parser: str = DEFAULT_XML_PARSER,
 ) -> List[Document]:
-    documents = []
-    with ZipFile(zip_file_path, 'r') as zip_file:
-        for zipped_file_name in zip_file.namelist():
-            if not zipped_file_name.endswith('.xml'):
-                continue
+    documents = list(iter_documents_from_zip_file(zip_file_path, parser))
+
+    if verbose:
+        print(f'Documents from {zip_file_path} loaded')
+
+    return documents
 
-            with zip_file.open(zipped_file_name) as zipped_file:
-                documents.append(
-                    document_from_xml(zipped_file.read().decode('utf-8'))
-                )
+
+def document_batch_from_zip_file(
+    zip_file_path: str, verbose: bool = True,
+    parser: str = DEFAULT_XML_PARSER,
+) -> DocumentBatch:
+    """ Как `documents_from_zip_file`, но документы собираются в пачку """
+    with get_instrumentation().stage(STAGE_OPEN):
+        zip_reader = MmapZipReader(zip_file_path)
+    with zip_reader:
+        batch = _fill_document_batch(
+            DocumentBatch(), zip_reader, zipped_xml_files(zip_reader), parser,
+        )
 
     if verbose:
         print(f'Documents from {zip_file_path} loaded')
 
+    return batch
+
+
+def iter_documents_from_zip_file_shard(
+    shard: Union[ZipFileShard, 'PrefetchedShard'],
+    parser: str = DEFAULT_XML_PARSER,
+) -> Iterator[Document]:
+    if isinstance(shard, PrefetchedShard):
+        return iter_documents_from_prefetched_shard(shard, parser)
+    return iter_documents_from_zip_file(
+        shard.zip_file_path, parser, shard.start, shard.stop,
+    )
+
+
+def documents_from_zip_file_shard(
+    shard: Union[ZipFileShard, 'PrefetchedShard'], verbose: bool = True,
+    parser: str = DEFAULT_XML_PARSER,
+) -> List[Document]:
+    documents = list(iter_documents_from_zip_file_shard(shard, parser))
+
+    if verbose:
+        print(
+            f'Documents from {shard.zip_file_path}'
+            f'[{shard.start}:{shard.stop}] loaded'
+        )
+
     return documents
 
 
-def documents_to_csv_files(
-    documents: Iterable, documents_file: TextIOWrapper,
-    objects_file: TextIOWrapper, write_headers: bool = True,
+@contextmanager
+def _open_zip_file_shard(
+    shard: Union[ZipFileShard, 'PrefetchedShard'],
+) -> Iterator[Tuple[ZipBufferReader, List[ZipInfo]]]:
+    if isinstance(shard, PrefetchedShard):
+        with ZipBufferReader(
+            shard.zip_file_path, shard.data, shard.offset,
+        ) as zip_reader:
+            yield zip_reader, shard.zip_infos
+        return
+
+    with get_instrumentation().stage(STAGE_OPEN):
+        zip_reader = MmapZipReader(shard.zip_file_path)
+    with zip_reader:
+        yield zip_reader, zipped_xml_files(zip_reader)[shard.start:shard.stop]
+
+
+def iter_document_batches_from_zip_file_shard(
+    shard: Union[ZipFileShard, 'PrefetchedShard'],
+    parser: str = DEFAULT_XML_PARSER, batch_size: int = None,
+) -> Iterator[DocumentBatch]:
+    """ Разбирает часть архива в пачки по `batch_size` документов """
+    with _open_zip_file_shard(shard) as (zip_reader, zip_infos):
+        batch_size = batch_size or len(zip_infos)
+        for zip_infos_batch in batched(zip_infos, batch_size):
+            yield _fill_document_batch(
+                DocumentBatch(), zip_reader, zip_infos_batch, parser,
+            )
+
+
+def document_batch_from_zip_file_shard(
+    shard: Union[ZipFileShard, 'PrefetchedShard'], verbose: bool = True,
+    parser: str = DEFAULT_XML_PARSER,
+) -> DocumentBatch:
+    """
+    Разбирает часть архива в одну пачку
+
+    Пачка передается из процесса пула несколькими буферами, а не
+    объектом на каждый документ и объект документа.
+    """
+    with _open_zip_file_shard(shard) as (zip_reader, zip_infos):
+        batch = _fill_document_batch(
+            DocumentBatch(), zip_reader, zip_infos, parser,
+        )
+
+    if verbose:
+        print(
+            f'Documents from {shard.zip_file_path}'
+            f'[{shard.start}:{shard.stop}] loaded'
+        )
+
+    return batch
+
+
+def fragments_from_zip_file_shard(
+    shard: Union[ZipFileShard, 'PrefetchedShard'],
+    render: Callable[[Iterable[Document]], tuple], verbose: bool = True,
+    parser: str = DEFAULT_XML_PARSER,
+) -> tuple:
+    """ Разбирает часть архива и формирует фрагменты выходных файлов """
+    return render(document_batch_from_zip_file_shard(shard, verbose, parser))
+
+
+class PrefetchedShard(NamedTuple):
+    """
+    Диапазон файлов архива вместе с байтами архива
+
+    Байты читаются заранее в потоках родительского процесса
+    (`prefetch_zip_file_shard`), и процесс пула не обращается к
+    хранилищу, если файлы сжаты deflate или не сжаты.
+    """
+    zip_file_path: str
+    start: int
+    stop: int
+    compressed_size: int
+    zip_infos: List[ZipInfo]
+    offset: int
+    data: bytes
+
+
+def prefetch_zip_file_shard(shard: ZipFileShard) -> PrefetchedShard:
+    with ZipFile(shard.zip_file_path, 'r') as zip_file:
+        zip_infos = zipped_xml_files(zip_file)[shard.start:shard.stop]
+        offset, data = read_zip_members_range(zip_file, zip_infos)
+    return PrefetchedShard(*shard, zip_infos, offset, data)
+
+
+def _prefetch_indexed_zip_file_shard(
+    indexed_shard: Tuple[int, ZipFileShard],
+) -> Tuple[int, PrefetchedShard]:
+    shard_num, shard = indexed_shard
+    return shard_num, prefetch_zip_file_shard(shard)
+
+
+def _read_timed(
+    read: Callable, instrumentation: Instrumentation, argument,
+):
+    # Выполняется в потоке чтения
+    started_at = time.perf_counter()
+    result = read(argument)
+    instrumentation.record(
+        STAGE_READ, time.perf_counter() - started_at, IO_WORKER,
+    )
+    return result
+
+
+def iter_documents_from_prefetched_shard(
+    shard: PrefetchedShard, parser: str = DEFAULT_XML_PARSER,
+) -> Iterator[Document]:
+    with ZipBufferReader(
+        shard.zip_file_path, shard.data, shard.offset,
+    ) as zip_reader:
+        yield from _iter_documents_from_zip_reader(
+            zip_reader, shard.zip_infos, parser,
+        )
+
+
+def _imap_prefetched(
+    pool: multiprocessing.Pool, task: Callable,
+    shards: Iterable[ZipFileShard], instrumentation: Instrumentation,
+    readahead: int = DEFAULT_READAHEAD, io_threads: int = DEFAULT_IO_THREADS,
+    read: Callable = prefetch_zip_file_shard,
+) -> Iterator:
+    """
+    Читает диапазоны архивов в потоках и передает их в пул процессов
+
+    Чтение следующих диапазонов идет, пока пул разбирает предыдущие, так
+    задержки медленного хранилища перекрываются разбором. Прочитанных, но
+    еще не обработанных диапазонов не больше `readahead`. Результаты
+    возвращаются по мере готовности. `read` — чтение аргумента задачи,
+    по умолчанию `prefetch_zip_file_shard`.
+    """
+    if instrumentation is NULL_INSTRUMENTATION:
+        return _iter_prefetched_results(
+            pool, task, shards, instrumentation, readahead, io_threads, read,
+        )
+    return _merge_snapshots(
+        _iter_prefetched_results(
+            pool, partial(call_instrumented, task), shards, instrumentation,
+            readahead, io_threads, read,
+        ),
+        instrumentation,
+    )
+
+
+def _iter_prefetched_results(
+    pool: multiprocessing.Pool, task: Callable,
+    shards: Iterable[ZipFileShard], instrumentation: Instrumentation,
+    readahead: int, io_threads: int, read: Callable,
+) -> Iterator:
+    # concurrent.futures импортирует logging; он нужен только здесь
+    from concurrent.futures import Future, ThreadPoolExecutor
+
+    results = queue.Queue()
+    prefetch = partial(_read_timed, read, instrumentation)
+
+    def apply_async(prefetch_future: Future) -> None:
+        # Выполняется в потоке чтения
+        try:
+            prefetched_shard = prefetch_future.result()
+        except BaseException as error:
+            results.put((None, error))
+            return
+        pool.apply_async(
+            task, (prefetched_shard, ),
+            callback=lambda result: results.put((result, None)),
+            error_callback=lambda error: results.put((None, error)),
+        )
+
+    shards = iter(shards)
+    in_flight = 0
+    with ThreadPoolExecutor(io_threads) as executor:
+        while True:
+            for shard in itertools.islice(shards, readahead - in_flight):
+                executor.submit(prefetch, shard).add_done_callback(
+                    apply_async,
+                )
+                in_flight += 1
+            instrumentation.gauge('readahead', in_flight)
+            if not in_flight:
+                break
+
+            result, error = results.get()
+            in_flight -= 1
+            if error is not None:
+                raise error
+            yield result
+
+
+def _imap_unordered(
+    pool: multiprocessing.Pool, task: Callable, iterable: Iterable,
+    instrumentation: Instrumentation, chunksize: int = 1,
+) -> Iterator:
+    """ `Pool.imap_unordered` с замерами в процессах пула """
+    if instrumentation is NULL_INSTRUMENTATION:
+        return pool.imap_unordered(task, iterable, chunksize)
+    return _merge_snapshots(
+        pool.imap_unordered(
+            partial(call_instrumented, task), iterable, chunksize,
+        ),
+        instrumentation,
+    )
+
+
+def _imap_isolated(
+    pool: multiprocessing.Pool, task: Callable, iterable: Iterable,
+    instrumentation: Instrumentation, fault_tolerance: FaultTolerance,
+    processes: int = None,
+    get_shard: Callable[..., ZipFileShard] = lambda shard: shard,
+    readahead: int = None, io_threads: int = DEFAULT_IO_THREADS,
+    read: Callable = prefetch_zip_file_shard,
+) -> Iterator:
+    """
+    Выполняет задачи пула с изоляцией ошибок (`faults`)
+
+    Задачи передаются в пул по одной. С `task_timeout` в работе их не
+    больше, чем процессов: так время задачи отсчитывается с ее начала,
+    а не с постановки в очередь пула. Результаты
+    возвращаются по мере готовности, задачи с ошибками повторяются или
+    записываются в `fault_tolerance` и пропускаются. `get_shard` — часть
+    архива задачи по ее аргументу.
+
+    При `readahead` аргументы задач читаются заранее (`read`) в
+    `io_threads` потоках, как в `_imap_prefetched`; ошибка чтения —
+    ошибка задачи. Срок задачи отсчитывается после чтения.
+    """
+    if instrumentation is not NULL_INSTRUMENTATION:
+        task = partial(call_instrumented, task)
+    max_running = processes or os.cpu_count() or 1
+    if fault_tolerance.task_timeout is None:
+        # Без срока задачи могут ждать в очереди пула, пока процессы
+        # передают результаты
+        max_running *= ISOLATED_TASKS_PER_PROCESS
+    outcomes = _iter_isolated_outcomes(
+        pool, partial(call_isolated, task), iterable, fault_tolerance,
+        max_running, get_shard,
+        partial(_read_timed, read, instrumentation) if readahead else None,
+        readahead, io_threads,
+    )
+    if instrumentation is NULL_INSTRUMENTATION:
+        return outcomes
+    return _merge_snapshots(outcomes, instrumentation)
+
+
+def _iter_isolated_outcomes(
+    pool: multiprocessing.Pool, task: Callable, iterable: Iterable,
+    fault_tolerance: FaultTolerance, max_running: int,
+    get_shard: Callable[..., ZipFileShard], read: Callable = None,
+    readahead: int = None, io_threads: int = DEFAULT_IO_THREADS,
+) -> Iterator:
+    # Сообщения: (номер отправки, результат задачи) или (None, аргумент,
+    # попытка и future чтения)
+    results = queue.Queue()
+    submission_nums = itertools.count()
+    # Номер отправки -> аргумент, попытка, срок
+    running = {}
+    retries = []
+    # Задачи, время которых истекло, но которые могут занимать процессы
+    stuck = 0
+    # Прочитанные, но еще не отправленные в пул задачи: аргумент, попытка,
+    # прочитанный аргумент задачи
+    ready = deque()
+    reading = 0
+
+    def start_read(argument, attempt: int) -> None:
+        executor.submit(read, argument).add_done_callback(
+            lambda future: results.put((None, (argument, attempt, future))),
+        )
+
+    def submit(argument, attempt: int, task_argument) -> None:
+        submission_num = next(submission_nums)
+        deadline = (
+            time.monotonic() + fault_tolerance.task_timeout
+            if fault_tolerance.task_timeout is not None else None
+        )
+        running[submission_num] = (argument, attempt, deadline)
+        pool.apply_async(
+            task, (task_argument, ),
+            callback=lambda outcome: results.put((submission_num, outcome)),
+            error_callback=lambda error: results.put(
+                (
+                    submission_num,
+                    TaskOutcome(None, [], describe_error(error), False),
+                ),
+            ),
+        )
+
+    def retry_or_report(argument, attempt: int, outcome: TaskOutcome):
+        if outcome.error is not None and outcome.transient and (
+            attempt < fault_tolerance.max_attempts
+        ):
+            retries.append((argument, attempt + 1))
+            return
+        # Ошибки файлов записываются только для последней попытки
+        zip_file_path = get_shard(argument).zip_file_path
+        for member, error in outcome.member_errors:
+            fault_tolerance.add(zip_file_path, member, error, attempt)
+        if outcome.error is not None:
+            fault_tolerance.add(zip_file_path, None, outcome.error, attempt)
+
+    arguments = iter(iterable)
+    arguments_left = True
+
+    def next_argument() -> Optional[tuple]:
+        nonlocal arguments_left
+        if retries:
+            return retries.pop()
+        if arguments_left:
+            try:
+                return next(arguments), 1
+            except StopIteration:
+                arguments_left = False
+        return None
+
+    if read is not None:
+        # concurrent.futures импортирует logging; он нужен только здесь
+        from concurrent.futures import ThreadPoolExecutor
+        executor_context = ThreadPoolExecutor(io_threads)
+    else:
+        executor_context = nullcontext()
+    with executor_context as executor:
+        while True:
+            if read is not None:
+                while reading + len(ready) < readahead:
+                    pending = next_argument()
+                    if pending is None:
+                        break
+                    start_read(*pending)
+                    reading += 1
+            while len(running) < max(1, max_running - stuck):
+                if read is not None:
+                    if not ready:
+                        break
+                    submit(*ready.popleft())
+                    continue
+                pending = next_argument()
+                if pending is None:
+                    break
+                submit(*pending, pending[0])
+            if not running and not reading:
+                return
+
+            deadlines = [
+                deadline for _, _, deadline in running.values()
+                if deadline is not None
+            ]
+            try:
+                submission_num, outcome = results.get(
+                    timeout=(
+                        max(0.0, min(deadlines) - time.monotonic())
+                        if deadlines else None
+                    ),
+                )
+            except queue.Empty:
+                now = time.monotonic()
+                for submission_num, (argument, attempt, deadline) in list(
+                    running.items(),
+                ):
+                    if deadline is not None and deadline <= now:
+                        del running[submission_num]
+                        stuck += 1
+                        fault_tolerance.timeouts += 1
+                        retry_or_report(
+                            argument, attempt,
+                            TaskOutcome(
+                                None, [],
+                                f'TimeoutError: task took more than '
+                                f'{fault_tolerance.task_timeout} s',
+                                True,
+                            ),
+                        )
+                continue
+
+            if submission_num is None:
+                reading -= 1
+                argument, attempt, future = outcome
+                try:
+                    ready.append((argument, attempt, future.result()))
+                except Exception as error:
+                    retry_or_report(
+                        argument, attempt,
+                        TaskOutcome(
+                            None, [], describe_error(error),
+                            is_transient(error),
+                        ),
+                    )
+                continue
+            if submission_num not in running:
+                # Задача, время которой истекло, все-таки завершилась; ее
+                # результат уже не нужен
+                stuck -= 1
+                continue
+            argument, attempt, _ = running.pop(submission_num)
+            retry_or_report(argument, attempt, outcome)
+            if outcome.error is None:
+                yield outcome.result
+
+
+def _merge_snapshots(
+    instrumented_results: Iterable[tuple], instrumentation: Instrumentation,
+) -> Iterator:
+    for result, snapshot in instrumentation.timed(instrumented_results):
+        instrumentation.merge(snapshot)
+        yield result
+
+
+def _cached(task: Callable, parse_cache: ParseCache = None) -> Callable:
+    """ Задача пула с кэшем разбора, если он задан """
+    if parse_cache is None:
+        return task
+    return partial(call_cached, parse_cache, task)
+
+
+def _call_indexed(
+    task: Callable, indexed_argument: Tuple[int, Any],
+) -> Tuple[int, Any]:
+    """ Задача пула, которая возвращает результат с номером аргумента """
+    argument_num, argument = indexed_argument
+    return argument_num, task(argument)
+
+
+@contextmanager
+def _fault_tolerant_pool(
+    pool: multiprocessing.Pool, processes: int,
+    fault_tolerance: FaultTolerance = None, input_size: int = None,
+) -> Iterator[multiprocessing.Pool]:
+    """
+    `pool_or_new` с заменой процессов после `max_tasks_per_child` задач
+
+    Если задачи не уложились в срок, новый пул завершается
+    принудительно: их процессы могут быть заняты бесконечно.
+
+    Если сжатый размер входных данных `input_size` меньше
+    `MIN_POOL_INPUT_SIZE` или задан один процесс, задачи выполняются в
+    текущем процессе (`utils.InProcessPool`), кроме случаев, когда
+    процессы нужны `fault_tolerance` для срока задач и их замены.
+    """
+    if pool is None and input_size is not None and (
+        input_size < MIN_POOL_INPUT_SIZE or processes == 1
+    ) and (
+        fault_tolerance is None or (
+            fault_tolerance.task_timeout is None
+            and fault_tolerance.max_tasks_per_child is None
+        )
+    ):
+        yield InProcessPool()
+        return
+
+    if fault_tolerance is None:
+        with pool_or_new(pool, processes) as pool:
+            yield pool
+        return
+
+    timeouts = fault_tolerance.timeouts
+    new_pool = pool is None
+    with pool_or_new(
+        pool, processes, fault_tolerance.max_tasks_per_child,
+    ) as pool:
+        yield pool
+        if new_pool and fault_tolerance.timeouts > timeouts:
+            pool.terminate()
+
+
+def collect_documents_single_core(
+    dir_path: str, sink: Sink, parser: str = DEFAULT_XML_PARSER,
+    instrumentation: Instrumentation = None, recursive: bool = False,
+    parse_cache: ParseCache = None,
 ) -> None:
-    # Используется однопоточная реализация
-    # Для ускорения можно было бы попробовать разделить запись в два файла на
-    # разные процессы (или потоки), чтобы каждый файл наполнялся отдельно,
-    # но нужно измерить накладные расходы на общение между процессами
-    # (переключение потоков)
-    documents_writer = csv.writer(documents_file)
-    objects_writer = csv.writer(objects_file)
-    if write_headers:
-        documents_writer.writerow(('id', 'level'))
-        objects_writer.writerow(('id', 'name'))
-    for document in documents:
-        documents_writer.writerow((document.id, document.level))
-        for object_ in document.objects:
-            objects_writer.writerow((document.id, object_.name))
+    instrumentation = instrumentation or NULL_INSTRUMENTATION
+    # Архивы разбираются по мере чтения папки
+    document_batches = map(
+        partial(document_batch_from_zip_file, parser=parser),
+        filter_file_paths(dir_path, 'zip', recursive),
+    )
+    set_instrumentation(instrumentation)
+    set_parse_cache(parse_cache)
+    try:
+        with instrumentation.stage_excluding(STAGE_WRITE):
+            for document_batch in instrumentation.timed(document_batches):
+                sink.write_documents(document_batch)
+            sink.flush()
+    finally:
+        set_instrumentation(None)
+        set_parse_cache(None)
+        if parse_cache is not None:
+            parse_cache.flush()
+    instrumentation.finish()
 
 
 def collect_documents_info_single_core(
     dir_path: str, documents_file: TextIOWrapper, objects_file: TextIOWrapper,
-    write_headers: bool = True,
+    write_headers: bool = True, parser: str = DEFAULT_XML_PARSER,
+    threaded_writers: bool = False, instrumentation: Instrumentation = None,
+    parse_cache: ParseCache = None,
+) -> None:
+    with CsvSink(
+        documents_file, objects_file, write_headers, threaded_writers,
+    ) as sink:
+        collect_documents_single_core(
+            dir_path, sink, parser, instrumentation,
+            parse_cache=parse_cache,
+        )
+
+
+def collect_zip_files_multiple_core(
+    zip_file_paths: Iterable[str], sink: Sink,
+    parser: str = DEFAULT_XML_PARSER, processes: int = None,
+    render_in_workers: bool = False, instrumentation: Instrumentation = None,
+    pool: multiprocessing.Pool = None, readahead: int = None,
+    io_threads: int = DEFAULT_IO_THREADS,
+    fault_tolerance: FaultTolerance = None, parse_cache: ParseCache = None,
+    known_members: Dict[str, Set[str]] = None,
+    on_shard_done: Callable[[ZipFileShard], None] = None,
 ) -> None:
-    documents = itertools.chain.from_iterable(
-        map(documents_from_zip_file, filter_file_paths(dir_path, 'zip'))
+    """
+    Собирает информацию о документах архивов в пуле процессов
+
+    При `render_in_workers` фрагменты выходных файлов формируются в
+    процессах-обработчиках (`sink.render`), и вместо объектов `Document`
+    родительскому процессу передаются готовые фрагменты. Так
+    форматирование масштабируется по ядрам.
+
+    При `readahead` архивы читаются заранее в `io_threads` потоках
+    родительского процесса (`_imap_prefetched`): для медленного или
+    сетевого хранилища.
+
+    С `fault_tolerance` ошибки архивов не прерывают сбор (`faults`).
+
+    С `parse_cache` файлы, которые уже разбирались, берутся из кэша
+    (`parse_cache`).
+
+    Архивы меньше `MIN_POOL_INPUT_SIZE` (сжатых XML-файлов) собираются
+    без пула, в текущем процессе.
+
+    Файлы архивов с ключами из `known_members` (по пути архива) не
+    собираются. В `on_shard_done` передается каждый диапазон, строки
+    которого переданы в `sink`.
+
+    Переданный `pool` (например, `utils.shared_pool()`) не закрывается.
+    """
+    instrumentation = instrumentation or NULL_INSTRUMENTATION
+    shards = plan_zip_file_shards(
+        zip_file_paths, processes, fault_tolerance=fault_tolerance,
+        known_members=known_members,
     )
-    documents_to_csv_files(
-        documents, documents_file, objects_file, write_headers,
+    with _fault_tolerant_pool(
+             pool, processes, fault_tolerance,
+             sum(shard.compressed_size for shard in shards),
+         ) as pool, \
+         instrumentation.stage_excluding(STAGE_WRITE):
+
+        # В текущем процессе чтение заранее не нужно
+        readahead = readahead if not isinstance(pool, InProcessPool) else None
+        # С `on_shard_done` результаты задач возвращаются с номерами
+        # диапазонов
+        indexed_options = (
+            {'read': _prefetch_indexed_zip_file_shard}
+            if on_shard_done is not None else {}
+        )
+        if fault_tolerance is not None:
+            if on_shard_done is not None:
+                indexed_options['get_shard'] = itemgetter(1)
+            imap = partial(
+                _imap_isolated, fault_tolerance=fault_tolerance,
+                processes=processes, readahead=readahead,
+                io_threads=io_threads, **indexed_options,
+            )
+        elif readahead:
+            imap = partial(
+                _imap_prefetched, readahead=readahead, io_threads=io_threads,
+                **indexed_options,
+            )
+        else:
+            imap = partial(
+                _imap_unordered,
+                chunksize=plan_shards_chunksize(shards, processes),
+            )
+
+        if render_in_workers:
+            task = partial(
+                fragments_from_zip_file_shard, render=sink.render,
+                parser=parser,
+            )
+            write = sink.write_fragment
+        else:
+            task = partial(document_batch_from_zip_file_shard, parser=parser)
+            write = sink.write_documents
+        task = _cached(task, parse_cache)
+
+        if on_shard_done is None:
+            for result in imap(pool, task, shards, instrumentation):
+                write(result)
+        else:
+            indexed_results = imap(
+                pool, partial(_call_indexed, task), list(enumerate(shards)),
+                instrumentation,
+            )
+            for shard_num, result in indexed_results:
+                write(result)
+                on_shard_done(shards[shard_num])
+        sink.flush()
+    instrumentation.finish()
+
+
+def collect_documents_multiple_core(
+    dir_path: str, sink: Sink, parser: str = DEFAULT_XML_PARSER,
+    processes: int = None, render_in_workers: bool = False,
+    instrumentation: Instrumentation = None,
+    pool: multiprocessing.Pool = None, readahead: int = None,
+    io_threads: int = DEFAULT_IO_THREADS, recursive: bool = False,
+    fault_tolerance: FaultTolerance = None, parse_cache: ParseCache = None,
+) -> None:
+    collect_zip_files_multiple_core(
+        filter_file_paths(dir_path, 'zip', recursive), sink, parser, processes,
+        render_in_workers, instrumentation, pool, readahead, io_threads,
+        fault_tolerance, parse_cache,
     )
 
 
 def collect_documents_info_multiple_core(
     dir_path: str, documents_file: TextIOWrapper, objects_file: TextIOWrapper,
-    write_headers: bool = True,
+    write_headers: bool = True, parser: str = DEFAULT_XML_PARSER,
+    processes: int = None, render_in_workers: bool = False,
+    threaded_writers: bool = False, instrumentation: Instrumentation = None,
+    pool: multiprocessing.Pool = None, readahead: int = None,
+    io_threads: int = DEFAULT_IO_THREADS, parse_cache: ParseCache = None,
 ) -> None:
-    with multiprocessing.Pool() as pool:
-        documents = itertools.chain.from_iterable(
-            pool.imap_unordered(
-                documents_from_zip_file, filter_file_paths(dir_path, 'zip'),
+    with CsvSink(
+        documents_file, objects_file, write_headers, threaded_writers,
+    ) as sink:
+        collect_documents_multiple_core(
+            dir_path, sink, parser, processes, render_in_workers,
+            instrumentation, pool, readahead, io_threads,
+            parse_cache=parse_cache,
+        )
+
+
+def _xml_member_keys(zip_file_path: str) -> List[str]:
+    with ZipFile(zip_file_path, 'r') as zip_file:
+        return [
+            member_key(zip_info) for zip_info in zipped_xml_files(zip_file)
+        ]
+
+
+def collect_zip_files_incremental(
+    dir_path: str, zip_file_paths: Iterable[str], documents_file_path: str,
+    objects_file_path: str, manifest: ArchiveManifest,
+    parser: str = DEFAULT_XML_PARSER, processes: int = None,
+    render_in_workers: bool = True, threaded_writers: bool = False,
+    instrumentation: Instrumentation = None,
+    pool: multiprocessing.Pool = None, sink_class: Type[Sink] = CsvSink,
+    fault_tolerance: FaultTolerance = None, parse_cache: ParseCache = None,
+    readahead: int = None, io_threads: int = DEFAULT_IO_THREADS,
+) -> List[str]:
+    """
+    Дописывает в выходные файлы архивы папки `dir_path`, которые
+    изменились с последней записи в манифест `manifest`
+
+    Из измененного архива собираются только файлы, которых не было в
+    нем при записи в манифест (по имени и CRC-32), поэтому строки
+    документов не повторяются. В манифест записываются ключи файлов из
+    выполненных задач и состояние архива до сбора: файлы, добавленные во
+    время сбора, будут собраны в следующий раз. Возвращает пути
+    полностью обработанных архивов. Архивы, часть задач которых не
+    выполнена (`fault_tolerance`), записываются в манифест как собранные
+    не полностью, и в следующий раз собираются только их оставшиеся
+    файлы.
+    """
+    zip_file_paths = [
+        zip_file_path for zip_file_path in zip_file_paths
+        if manifest.is_changed(dir_path, zip_file_path)
+    ]
+    known_members = {
+        zip_file_path: manifest.members(dir_path, zip_file_path)
+        for zip_file_path in zip_file_paths
+    }
+    if not zip_file_paths:
+        # Манифест мог обновиться, если у архивов поменялось только время
+        manifest.save()
+        return zip_file_paths
+
+    # Состояние архивов до сбора: файлы, добавленные позже, в следующий
+    # раз будут найдены как изменения
+    snapshots = {}
+    snapshot_member_keys = {}
+    for zip_file_path in zip_file_paths:
+        try:
+            snapshot = ArchiveManifest.snapshot(zip_file_path)
+            snapshot_member_keys[zip_file_path] = _xml_member_keys(
+                zip_file_path,
             )
+        except (OSError, zipfile.BadZipFile):
+            # Ошибку архива запишет в отчет или выбросит планирование задач
+            continue
+        snapshots[zip_file_path] = snapshot
+
+    # Ключи файлов в порядке номеров диапазонов. Читаются после
+    # планирования задач, поэтому включают и файлы, дописанные до него
+    planned_member_keys = {}
+    collected_members = {
+        zip_file_path: set() for zip_file_path in zip_file_paths
+    }
+
+    def on_shard_done(shard: ZipFileShard) -> None:
+        zip_file_path = shard.zip_file_path
+        if zip_file_path not in planned_member_keys:
+            planned_member_keys[zip_file_path] = _xml_member_keys(
+                zip_file_path,
+            )
+        collected_members[zip_file_path].update(
+            planned_member_keys[zip_file_path][shard.start:shard.stop],
+        )
+
+    # `fault_tolerance` может быть общим для нескольких сборов (режим
+    # отслеживания папки): учитываются только ошибки этого сбора
+    errors_quantity = (
+        len(fault_tolerance.errors) if fault_tolerance is not None else 0
+    )
+    sink_options = {'threaded_writers': True} if threaded_writers else {}
+    with open(documents_file_path, 'ab') as documents_file, \
+         open(objects_file_path, 'ab') as objects_file, \
+         sink_class(
+             documents_file, objects_file,
+             # Заголовки нужны только в новых (пустых) файлах
+             not documents_file.tell(), **sink_options,
+         ) as sink:
+
+        collect_zip_files_multiple_core(
+            zip_file_paths, sink, parser, processes, render_in_workers,
+            instrumentation, pool, readahead, io_threads, fault_tolerance,
+            parse_cache, known_members, on_shard_done,
+        )
+
+    failed_zip_file_paths = (
+        fault_tolerance.failed_zip_file_paths_since(errors_quantity)
+        if fault_tolerance is not None else set()
+    )
+    # Манифест сохраняется после того, как строки записаны: при сбое архивы
+    # будут обработаны повторно, но не потеряны
+    collected_zip_file_paths = []
+    for zip_file_path in zip_file_paths:
+        if zip_file_path not in snapshots:
+            continue
+        zip_file_member_keys = set(snapshot_member_keys[zip_file_path])
+        members = (
+            known_members[zip_file_path] & zip_file_member_keys
+            | collected_members[zip_file_path]
+        )
+        complete = (
+            zip_file_path not in failed_zip_file_paths
+            and zip_file_member_keys <= members
+        )
+        if complete or collected_members[zip_file_path]:
+            manifest.add(
+                dir_path, zip_file_path, snapshots[zip_file_path], members,
+                complete,
+            )
+        if complete:
+            collected_zip_file_paths.append(zip_file_path)
+    manifest.save()
+
+    return collected_zip_file_paths
+
+
+def collect_documents_info_incremental(
+    dir_path: str, documents_file_path: str, objects_file_path: str,
+    manifest_path: str = None, parser: str = DEFAULT_XML_PARSER,
+    processes: int = None, render_in_workers: bool = True,
+    threaded_writers: bool = False, instrumentation: Instrumentation = None,
+    pool: multiprocessing.Pool = None, sink_class: Type[Sink] = CsvSink,
+    recursive: bool = False, fault_tolerance: FaultTolerance = None,
+    parse_cache: ParseCache = None, readahead: int = None,
+    io_threads: int = DEFAULT_IO_THREADS,
+) -> List[str]:
+    """
+    Дописывает в выходные файлы только новые и измененные архивы
+
+    Обработанные архивы записываются в манифест (по умолчанию рядом с
+    файлом документов). Из измененного архива дописываются строки только
+    новых файлов, старые строки не удаляются. Возвращает пути
+    обработанных архивов.
+    """
+    if manifest_path is None:
+        manifest_path = f'{documents_file_path}{MANIFEST_FILE_SUFFIX}'
+    return collect_zip_files_incremental(
+        dir_path, filter_file_paths(dir_path, 'zip', recursive),
+        documents_file_path, objects_file_path,
+        ArchiveManifest.load(manifest_path), parser,
+        processes, render_in_workers, threaded_writers, instrumentation, pool,
+        sink_class, fault_tolerance, parse_cache, readahead, io_threads,
+    )
+
+
+def watch_documents_info(
+    dir_path: str, documents_file_path: str, objects_file_path: str,
+    manifest_path: str = None, parser: str = DEFAULT_XML_PARSER,
+    processes: int = None, render_in_workers: bool = True,
+    threaded_writers: bool = False, instrumentation: Instrumentation = None,
+    pool: multiprocessing.Pool = None, sink_class: Type[Sink] = CsvSink,
+    poll_interval: float = DEFAULT_POLL_INTERVAL, settle_time: float = None,
+    stop: threading.Event = None,
+    on_collected: Callable[[List[str]], None] = None,
+    fault_tolerance: FaultTolerance = None, parse_cache: ParseCache = None,
+    readahead: int = None, io_threads: int = DEFAULT_IO_THREADS,
+    incomplete_timeout: float = DEFAULT_INCOMPLETE_TIMEOUT,
+) -> None:
+    """
+    Следит за папкой и дописывает в выходные файлы новые архивы
+
+    Работает, пока не установлен `stop`. Новые архивы находит inotify
+    или, где его нет, опрос папки раз в `poll_interval` секунд
+    (`watcher.create_watcher`). Архив обрабатывается, когда его размер не
+    меняется `settle_time` секунд (по умолчанию 0 для inotify и
+    `poll_interval` для опроса) и у него есть центральный каталог. Архив
+    без центрального каталога, который не меняется `incomplete_timeout`
+    секунд, считается испорченным: он записывается в отчет об ошибках
+    `fault_tolerance` (без него выбрасывается `zipfile.BadZipFile`) и
+    больше не ожидается, пока не изменится. Пул
+    процессов и манифест остаются в памяти между архивами, поэтому строки
+    появляются в выходных файлах вскоре после архива. Архивы, которые уже
+    были в папке и отсутствуют в манифесте, обрабатываются при запуске.
+
+    После каждой обработки в `on_collected` передаются пути архивов.
+
+    Если задачи не уложились в срок (`fault_tolerance.task_timeout`),
+    их процессы могут быть заняты бесконечно, поэтому пул, созданный
+    здесь, после такой обработки завершается и создается заново.
+    Переданный `pool` не пересоздается.
+    """
+    if manifest_path is None:
+        manifest_path = f'{documents_file_path}{MANIFEST_FILE_SUFFIX}'
+    manifest = ArchiveManifest.load(manifest_path)
+    stop = stop if stop is not None else threading.Event()
+
+    with create_watcher(dir_path, 'zip', poll_interval) as watcher:
+        ready_files = ReadyFiles(
+            watcher.settle_time if settle_time is None else settle_time,
+            zipfile.is_zipfile, incomplete_timeout,
         )
-        documents_to_csv_files(
-            documents, documents_file, objects_file, write_headers,
+        ready_files.add(filter_file_paths(dir_path, 'zip'))
+        while not stop.is_set():
+            with _fault_tolerant_pool(
+                     pool, processes, fault_tolerance,
+                 ) as watch_pool:
+
+                timeouts = (
+                    fault_tolerance.timeouts
+                    if fault_tolerance is not None else 0
+                )
+                while not stop.is_set():
+                    zip_file_paths = ready_files.pop_ready()
+                    _report_incomplete_zip_files(
+                        ready_files.pop_failed(), incomplete_timeout,
+                        fault_tolerance,
+                    )
+                    if zip_file_paths:
+                        zip_file_paths = collect_zip_files_incremental(
+                            dir_path, zip_file_paths, documents_file_path,
+                            objects_file_path, manifest, parser, processes,
+                            render_in_workers, threaded_writers,
+                            instrumentation, watch_pool, sink_class,
+                            fault_tolerance, parse_cache, readahead,
+                            io_threads,
+                        )
+                        if zip_file_paths and on_collected is not None:
+                            on_collected(zip_file_paths)
+                        if (
+                            pool is None and fault_tolerance is not None
+                            and fault_tolerance.timeouts > timeouts
+                        ):
+                            # Пул с занятыми процессами завершается при
+                            # выходе из `_fault_tolerant_pool`
+                            break
+                    ready_files.add(watcher.wait(WATCH_TIMEOUT))
+
+
+def _report_incomplete_zip_files(
+    zip_file_paths: Iterable[str], incomplete_timeout: float,
+    fault_tolerance: FaultTolerance = None,
+) -> None:
+    for zip_file_path in zip_file_paths:
+        error = zipfile.BadZipFile(
+            f'File is not a zip file after {incomplete_timeout} s '
+            f'without changes',
         )
+        if fault_tolerance is None:
+            raise error
+        fault_tolerance.add(zip_file_path, None, describe_error(error))
+
+
+# Очередь пачек документов в процессе-обработчике. Задается при запуске
+# процесса в `_init_streaming_worker`
+_document_batches_queue = None
+
+
+def _init_streaming_worker(
+    document_batches_queue: multiprocessing.Queue,
+) -> None:
+    global _document_batches_queue
+    _document_batches_queue = document_batches_queue
+
+
+def _put_document_batches(
+    shard: ZipFileShard, batch_size: int, verbose: bool, parser: str,
+) -> None:
+    try:
+        for documents_batch in iter_document_batches_from_zip_file_shard(
+            shard, parser, batch_size,
+        ):
+            # Блокируется, пока в очереди нет места: так обработчики не
+            # опережают запись больше, чем на `max_in_flight_batches` пачек
+            with get_instrumentation().stage(STAGE_BACKPRESSURE):
+                _document_batches_queue.put(documents_batch)
+    finally:
+        # Признак завершения задачи отправляется и при ошибке, чтобы
+        # родительский процесс не ждал его бесконечно. Сама ошибка будет
+        # выброшена из результата `map_async`
+        _document_batches_queue.put(None)
+
+    if verbose:
+        print(
+            f'Documents from {shard.zip_file_path}'
+            f'[{shard.start}:{shard.stop}] loaded'
+        )
+
+
+def _queue_size(queue: multiprocessing.Queue) -> int:
+    try:
+        return queue.qsize()
+    except NotImplementedError:
+        # macOS
+        return -1
+
+
+def iter_document_batches_streaming(
+    shards: Iterable[ZipFileShard], batch_size: int = DEFAULT_BATCH_SIZE,
+    max_in_flight_batches: int = DEFAULT_MAX_IN_FLIGHT_BATCHES,
+    processes: int = None, verbose: bool = True,
+    parser: str = DEFAULT_XML_PARSER, instrumentation: Instrumentation = None,
+) -> Iterator[DocumentBatch]:
+    """
+    Разбирает архивы в пуле процессов и отдает документы пачками
+
+    Обработчики передают пачки через ограниченную очередь, поэтому
+    одновременно в памяти родительского процесса находится не больше
+    `max_in_flight_batches` пачек по `batch_size` документов независимо
+    от размера архивов.
+    """
+    instrumentation = instrumentation or NULL_INSTRUMENTATION
+    shards = list(shards)
+    put_document_batches = partial(
+        _put_document_batches, batch_size=batch_size, verbose=verbose,
+        parser=parser,
+    )
+    if instrumentation is not NULL_INSTRUMENTATION:
+        put_document_batches = partial(call_instrumented, put_document_batches)
+
+    document_batches_queue = multiprocessing.Queue(max_in_flight_batches)
+    with multiprocessing.Pool(
+        processes, _init_streaming_worker, (document_batches_queue, ),
+    ) as pool:
+        result = pool.map_async(put_document_batches, shards, chunksize=1)
+        pending_shards_quantity = len(shards)
+        while pending_shards_quantity:
+            instrumentation.gauge('queue', _queue_size(document_batches_queue))
+            documents_batch = document_batches_queue.get()
+            if documents_batch is None:
+                pending_shards_quantity -= 1
+            else:
+                yield documents_batch
+        results = result.get()
+        if instrumentation is not NULL_INSTRUMENTATION:
+            for _, snapshot in results:
+                instrumentation.merge(snapshot)
         pool.close()
         pool.join()
 
 
-if __name__ == '__main__':
-    # https://docs.python.org/3/library/csv.html#id3
-    with open('documents.csv', 'wt', encoding='utf-8', newline='') as docs_fh,\
-         open('objects.csv', 'wt', encoding='utf-8', newline='') as objs_fh:
+def collect_documents_streaming(
+    dir_path: str, sink: Sink, parser: str = DEFAULT_XML_PARSER,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    max_in_flight_batches: int = DEFAULT_MAX_IN_FLIGHT_BATCHES,
+    processes: int = None, instrumentation: Instrumentation = None,
+    recursive: bool = False,
+) -> None:
+    instrumentation = instrumentation or NULL_INSTRUMENTATION
+    document_batches = instrumentation.timed(
+        iter_document_batches_streaming(
+            plan_zip_file_shards(
+                filter_file_paths(dir_path, 'zip', recursive), processes,
+            ),
+            batch_size, max_in_flight_batches, processes, parser=parser,
+            instrumentation=instrumentation,
+        )
+    )
+    with instrumentation.stage_excluding(STAGE_WRITE):
+        for document_batch in document_batches:
+            sink.write_documents(document_batch)
+        sink.flush()
+    instrumentation.finish()
+
+
+def collect_documents_info_streaming(
+    dir_path: str, documents_file: TextIOWrapper, objects_file: TextIOWrapper,
+    write_headers: bool = True, parser: str = DEFAULT_XML_PARSER,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    max_in_flight_batches: int = DEFAULT_MAX_IN_FLIGHT_BATCHES,
+    processes: int = None, threaded_writers: bool = False,
+    instrumentation: Instrumentation = None,
+) -> None:
+    with CsvSink(
+        documents_file, objects_file, write_headers, threaded_writers,
+    ) as sink:
+        collect_documents_streaming(
+            dir_path, sink, parser, batch_size, max_in_flight_batches,
+            processes, instrumentation,
+        )
+
+
+def _indexed_fragments_from_zip_file_shard(
+    indexed_shard: Tuple[int, Union[ZipFileShard, PrefetchedShard]],
+    render: Callable[[Iterable[Document]], tuple], verbose: bool,
+    parser: str,
+) -> Tuple[int, tuple]:
+    shard_num, shard = indexed_shard
+    return shard_num, fragments_from_zip_file_shard(
+        shard, render, verbose, parser,
+    )
+
+
+def collect_documents_info_resumable(
+    dir_path: str, documents_file_path: str, objects_file_path: str,
+    checkpoint_path: str = None, resume: bool = False,
+    checkpoint_interval: float = DEFAULT_CHECKPOINT_INTERVAL,
+    parser: str = DEFAULT_XML_PARSER, processes: int = None,
+    verbose: bool = True, instrumentation: Instrumentation = None,
+    pool: multiprocessing.Pool = None, sink_class: Type[Sink] = CsvSink,
+    recursive: bool = False, fault_tolerance: FaultTolerance = None,
+    parse_cache: ParseCache = None, readahead: int = None,
+    io_threads: int = DEFAULT_IO_THREADS,
+    on_checkpoint: Callable[[], None] = None,
+) -> None:
+    """
+    Собирает информацию о документах с периодическим сохранением состояния
+
+    Раз в `checkpoint_interval` секунд выходные файлы сбрасываются на диск,
+    и в контрольную точку записываются готовые задачи (диапазоны файлов
+    архивов) и размеры выходных файлов. При `resume` сбор продолжается с
+    последней контрольной точки. После успешного завершения контрольная
+    точка удаляется.
+
+    Если с `fault_tolerance` часть задач не выполнена, контрольная точка
+    остается: с `resume` будут повторены только эти задачи.
+
+    `readahead` и `io_threads` — как в `collect_zip_files_multiple_core`.
+    `on_checkpoint` вызывается после записи каждой контрольной точки и
+    после завершения сбора (например, чтобы сохранить индекс повторов).
+    """
+    instrumentation = instrumentation or NULL_INSTRUMENTATION
+    if checkpoint_path is None:
+        checkpoint_path = f'{documents_file_path}{CHECKPOINT_FILE_SUFFIX}'
+
+    if resume and os.path.exists(checkpoint_path):
+        checkpoint = Checkpoint.load(checkpoint_path)
+        files_mode = 'r+b'
+    else:
+        shards = plan_zip_file_shards(
+            filter_file_paths(dir_path, 'zip', recursive), processes,
+            fault_tolerance=fault_tolerance,
+        )
+        checkpoint = Checkpoint(checkpoint_path, shards)
+        files_mode = 'wb'
+
+    shards = [ZipFileShard(*task) for task in checkpoint.tasks]
+
+    with open(documents_file_path, files_mode) as documents_file, \
+         open(objects_file_path, files_mode) as objects_file:
+
+        output_files = (documents_file, objects_file)
+        # Отбрасываются строки, записанные после контрольной точки
+        for output_file, offset in zip(output_files, checkpoint.offsets):
+            output_file.truncate(offset)
+            output_file.seek(offset)
+
+        with sink_class(
+            documents_file, objects_file, not checkpoint.offsets,
+        ) as sink:
 
-        collect_documents_info_multiple_core('documents', docs_fh, objs_fh)
+            def save_checkpoint() -> None:
+                sink.flush()
+                for output_file in output_files:
+                    output_file.flush()
+                    os.fsync(output_file.fileno())
+                checkpoint.offsets = [
+                    output_file.tell() for output_file in output_files
+                ]
+                checkpoint.save()
+                if on_checkpoint is not None:
+                    on_checkpoint()
+
+            save_checkpoint()
+            checkpoint_time = time.monotonic()
+            pending_shards = [
+                shards[shard_num] for shard_num in checkpoint.pending
+            ]
+            failed_tasks = (
+                fault_tolerance.failed_tasks if fault_tolerance else 0
+            )
+            with _fault_tolerant_pool(
+                     pool, processes, fault_tolerance,
+                     sum(shard.compressed_size for shard in pending_shards),
+                 ) as pool, \
+                 instrumentation.stage_excluding(STAGE_WRITE):
+
+                if isinstance(pool, InProcessPool):
+                    readahead = None
+                if fault_tolerance is not None:
+                    imap = partial(
+                        _imap_isolated, fault_tolerance=fault_tolerance,
+                        processes=processes, get_shard=itemgetter(1),
+                        readahead=readahead, io_threads=io_threads,
+                        read=_prefetch_indexed_zip_file_shard,
+                    )
+                elif readahead:
+                    imap = partial(
+                        _imap_prefetched, readahead=readahead,
+                        io_threads=io_threads,
+                        read=_prefetch_indexed_zip_file_shard,
+                    )
+                else:
+                    imap = partial(
+                        _imap_unordered,
+                        chunksize=plan_shards_chunksize(
+                            pending_shards, processes,
+                        ),
+                    )
+                indexed_fragments = imap(
+                    pool,
+                    _cached(
+                        partial(
+                            _indexed_fragments_from_zip_file_shard,
+                            render=sink.render, verbose=verbose,
+                            parser=parser,
+                        ),
+                        parse_cache,
+                    ),
+                    zip(checkpoint.pending, pending_shards),
+                    instrumentation,
+                )
+                for shard_num, fragment in indexed_fragments:
+                    sink.write_fragment(fragment)
+                    checkpoint.completed.add(shard_num)
+
+                    if (
+                        time.monotonic() - checkpoint_time
+                        >= checkpoint_interval
+                    ):
+                        save_checkpoint()
+                        checkpoint_time = time.monotonic()
+
+            if (
+                fault_tolerance is not None
+                and fault_tolerance.failed_tasks > failed_tasks
+            ):
+                save_checkpoint()
+                instrumentation.finish()
+                return
+
+    if on_checkpoint is not None:
+        on_checkpoint()
+    checkpoint.remove()
+    instrumentation.finish()
+
+
+def parse_arguments(arguments: Sequence[str] = None) -> argparse.Namespace:
+    arguments_parser = argparse.ArgumentParser(
+        description='Собирает информацию о документах из zip-архивов',
+    )
+    arguments_parser.add_argument(
+        '--dir', default='documents', help='папка с архивами',
+    )
+    arguments_parser.add_argument(
+        '--documents-file', metavar='PATH',
+        help='файл документов (по умолчанию documents.csv с расширением '
+             'формата и сжатия)',
+    )
+    arguments_parser.add_argument(
+        '--objects-file', metavar='PATH',
+        help='файл объектов (по умолчанию objects.csv с расширением '
+             'формата и сжатия)',
+    )
+    arguments_parser.add_argument(
+        '--mode', choices=MODES, default=MODE_FULL,
+        help='full — все архивы, incremental — только новые и измененные '
+             'с прошлого запуска, watch — дописывать новые архивы по мере '
+             'появления в папке',
+    )
+    arguments_parser.add_argument(
+        '--processes', type=int,
+        help='количество процессов пула (по умолчанию по числу ядер; '
+             'небольшие архивы собираются без пула)',
+    )
+    arguments_parser.add_argument(
+        '--readahead', type=int, metavar='N',
+        help='читать до N частей архивов заранее в потоках, пока пул '
+             'разбирает предыдущие (для медленного или сетевого хранилища)',
+    )
+    arguments_parser.add_argument(
+        '--resume', action='store_true',
+        help='продолжить сбор с последней контрольной точки',
+    )
+    arguments_parser.add_argument(
+        '--progress', type=float, metavar='SECONDS',
+        help='выводить прогресс и скорость сбора раз в SECONDS секунд',
+    )
+    arguments_parser.add_argument(
+        '--format', choices=tuple(SINKS), default=DEFAULT_SINK,
+        help='формат выходных файлов',
+    )
+    arguments_parser.add_argument(
+        '--compression', choices=tuple(COMPRESSION_EXTENSIONS),
+        help='сжатие выходных файлов',
+    )
+    arguments_parser.add_argument(
+        '--max-part-size', type=int, metavar='BYTES',
+        help='разбивать выходные файлы на части не больше BYTES байт',
+    )
+    arguments_parser.add_argument(
+        '--max-part-rows', type=int, metavar='ROWS',
+        help='разбивать выходные файлы на части не больше ROWS строк',
+    )
+    arguments_parser.add_argument(
+        '--recursive', action='store_true',
+        help='искать архивы и во вложенных папках',
+    )
+    arguments_parser.add_argument(
+        '--dedup', action='store_true',
+        help='пропускать документы с уже записанными id',
+    )
+    arguments_parser.add_argument(
+        '--dedup-spill-dir', metavar='DIR',
+        help='папка для временных файлов индекса id (--dedup)',
+    )
+    arguments_parser.add_argument(
+        '--parse-cache', metavar='PATH',
+        help='кэш разобранных файлов архивов (база SQLite): файлы, '
+             'которые уже разбирались, не распаковываются',
+    )
+    arguments_parser.add_argument(
+        '--parse-cache-entries', type=int, default=DEFAULT_MAX_ENTRIES,
+        metavar='ENTRIES',
+        help='сколько записей хранить в кэше разбора',
+    )
+    arguments_parser.add_argument(
+        '--watch', dest='mode', action='store_const', const=MODE_WATCH,
+        help='то же, что --mode watch',
+    )
+    arguments_parser.add_argument(
+        '--poll-interval', type=float, default=DEFAULT_POLL_INTERVAL,
+        metavar='SECONDS',
+        help='как часто проверять папку, если inotify недоступен',
+    )
+    arguments_parser.add_argument(
+        '--fail-fast', action='store_true',
+        help='прерывать сбор при первой ошибке в архиве',
+    )
+    arguments_parser.add_argument(
+        '--error-report', metavar='PATH',
+        help='отчет об ошибках в архивах (по умолчанию рядом с '
+             'файлом документов)',
+    )
+    arguments_parser.add_argument(
+        '--quarantine-dir', metavar='DIR',
+        help='копировать архивы с ошибками в DIR',
+    )
+    arguments_parser.add_argument(
+        '--max-attempts', type=int, default=DEFAULT_MAX_ATTEMPTS,
+        help='сколько раз выполнять задачу при ошибках ввода-вывода и '
+             'истечении времени',
+    )
+    arguments_parser.add_argument(
+        '--task-timeout', type=float, metavar='SECONDS',
+        help='время на задачу пула, после которого она повторяется',
+    )
+    arguments_parser.add_argument(
+        '--max-tasks-per-child', type=int, metavar='TASKS',
+        help='заменять процесс пула новым после TASKS задач',
+    )
+    arguments = arguments_parser.parse_args(arguments)
+    parts = (
+        arguments.max_part_size is not None
+        or arguments.max_part_rows is not None
+    )
+    if arguments.resume and parts:
+        arguments_parser.error(
+            '--resume is not supported with --max-part-size/--max-part-rows',
+        )
+    if arguments.mode == MODE_WATCH and (
+        arguments.resume or arguments.recursive or parts
+    ):
+        arguments_parser.error(
+            '--watch is not supported with --resume, --recursive, '
+            '--max-part-size and --max-part-rows',
+        )
+    if arguments.mode == MODE_INCREMENTAL and (arguments.resume or parts):
+        arguments_parser.error(
+            '--mode incremental is not supported with --resume, '
+            '--max-part-size and --max-part-rows',
+        )
+
+    _, extension = format_sink(arguments.format, arguments.compression)
+    if arguments.documents_file is None:
+        arguments.documents_file = f'documents.{extension}'
+    if arguments.objects_file is None:
+        arguments.objects_file = f'objects.{extension}'
+    return arguments
+
+
+def _collect(
+    arguments: argparse.Namespace, instrumentation: Instrumentation,
+    index: IdIndex = None,
+) -> None:
+    sink_class, _ = format_sink(arguments.format, arguments.compression)
+    with (
+        ParseCache(arguments.parse_cache, arguments.parse_cache_entries)
+        if arguments.parse_cache is not None else nullcontext()
+    ) as parse_cache:
+        if arguments.fail_fast:
+            _collect_documents(
+                arguments, sink_class, instrumentation, index,
+                parse_cache=parse_cache,
+            )
+            return
+        _collect_fault_tolerant(
+            arguments, sink_class, instrumentation, index, parse_cache,
+        )
+
+
+def _collect_fault_tolerant(
+    arguments: argparse.Namespace, sink_class: Callable[..., Sink],
+    instrumentation: Instrumentation, index: IdIndex = None,
+    parse_cache: ParseCache = None,
+) -> None:
+    with FaultTolerance(
+        arguments.error_report
+        or f'{arguments.documents_file}{ERROR_REPORT_FILE_SUFFIX}',
+        arguments.quarantine_dir, arguments.max_attempts,
+        arguments.task_timeout, arguments.max_tasks_per_child,
+    ) as fault_tolerance:
+        try:
+            _collect_documents(
+                arguments, sink_class, instrumentation, index,
+                fault_tolerance, parse_cache,
+            )
+        finally:
+            if fault_tolerance.errors:
+                print(
+                    f'Errors: {len(fault_tolerance.errors)} '
+                    f'(failed tasks: {fault_tolerance.failed_tasks}), '
+                    f'see {fault_tolerance.report_path}',
+                    file=sys.stderr,
+                )
+
+
+def _collect_documents(
+    arguments: argparse.Namespace, sink_class: Callable[..., Sink],
+    instrumentation: Instrumentation, index: IdIndex = None,
+    fault_tolerance: FaultTolerance = None, parse_cache: ParseCache = None,
+) -> None:
+    if arguments.max_part_size is None and arguments.max_part_rows is None:
+        save_index = None
+        if index is not None:
+            sink_class = partial(
+                DeduplicatingSink.create, sink_class, index=index,
+            )
+            save_index = partial(
+                index.save,
+                f'{arguments.documents_file}{DEDUP_INDEX_FILE_SUFFIX}',
+            )
+        if arguments.mode == MODE_WATCH:
+            stop = threading.Event()
+            signal.signal(signal.SIGTERM, lambda *_: stop.set())
+            try:
+                watch_documents_info(
+                    arguments.dir, arguments.documents_file,
+                    arguments.objects_file, processes=arguments.processes,
+                    sink_class=sink_class, instrumentation=instrumentation,
+                    poll_interval=arguments.poll_interval, stop=stop,
+                    fault_tolerance=fault_tolerance, parse_cache=parse_cache,
+                    readahead=arguments.readahead,
+                    on_collected=(
+                        (lambda _: save_index())
+                        if save_index is not None else None
+                    ),
+                )
+            except KeyboardInterrupt:
+                pass
+            return
+        if arguments.mode == MODE_INCREMENTAL:
+            collect_documents_info_incremental(
+                arguments.dir, arguments.documents_file,
+                arguments.objects_file, processes=arguments.processes,
+                sink_class=sink_class, instrumentation=instrumentation,
+                recursive=arguments.recursive,
+                fault_tolerance=fault_tolerance, parse_cache=parse_cache,
+                readahead=arguments.readahead,
+            )
+            # Как и манифест, индекс сохраняется после записи строк
+            if save_index is not None:
+                save_index()
+            return
+        collect_documents_info_resumable(
+            arguments.dir, arguments.documents_file, arguments.objects_file,
+            resume=arguments.resume, processes=arguments.processes,
+            sink_class=sink_class, instrumentation=instrumentation,
+            recursive=arguments.recursive, fault_tolerance=fault_tolerance,
+            parse_cache=parse_cache, readahead=arguments.readahead,
+            on_checkpoint=save_index,
+        )
+        return
+
+    # Части пишутся без контрольных точек
+    with PartitionedSink(
+        arguments.documents_file, arguments.objects_file,
+        SINKS[arguments.format], arguments.compression,
+        max_part_size=arguments.max_part_size,
+        max_part_rows=arguments.max_part_rows,
+    ) as sink:
+        if index is not None:
+            sink = DeduplicatingSink(sink, index)
+        collect_documents_multiple_core(
+            arguments.dir, sink, processes=arguments.processes,
+            render_in_workers=True, instrumentation=instrumentation,
+            readahead=arguments.readahead, recursive=arguments.recursive,
+            fault_tolerance=fault_tolerance, parse_cache=parse_cache,
+        )
+
+
+def main(arguments: Sequence[str] = None) -> None:
+    arguments = parse_arguments(arguments)
+    instrumentation = (
+        Instrumentation(progress_interval=arguments.progress)
+        if arguments.progress is not None else None
+    )
+    if not arguments.dedup:
+        _collect(arguments, instrumentation)
+        return
+
+    # Индекс прошлого запуска нужен, если выходные файлы дописываются
+    if arguments.mode != MODE_FULL or (
+        arguments.resume
+        and os.path.exists(
+            f'{arguments.documents_file}{CHECKPOINT_FILE_SUFFIX}',
+        )
+    ):
+        index = IdIndex.load(
+            f'{arguments.documents_file}{DEDUP_INDEX_FILE_SUFFIX}',
+            spill_dir=arguments.dedup_spill_dir,
+        )
+    else:
+        index = IdIndex(spill_dir=arguments.dedup_spill_dir)
+    with index:
+        try:
+            _collect(arguments, instrumentation, index)
+        finally:
+            print(f'Duplicate documents dropped: {index.duplicates}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,306 @@
+"""
+Индекс идентификаторов документов для удаления повторов
+
+Идентификатор упаковывается в 16 байт: UUID — своими байтами, остальные
+строки — хешем BLAKE2b той же длины. Последние идентификаторы хранятся в
+множестве (`IdIndex.max_memory_ids`), а при его заполнении сортируются и
+переносятся в отсортированный «прогон» из упакованных записей по 16 байт,
+в памяти или во временном файле (`spill_dir`, читается через mmap).
+Прогоны близкого размера сливаются, поэтому их число растет как логарифм
+числа идентификаторов.
+
+Перед поиском в прогонах проверяется фильтр Блума: новый идентификатор
+почти никогда не требует двоичного поиска.
+
+Индекс сохраняется в файл (`IdIndex.save`) отсортированными упакованными
+записями и загружается (`IdIndex.load`) одним прогоном, поэтому повторы
+отбираются и между запусками сбора.
+"""
+
+
+import hashlib
+import heapq
+import math
+import mmap
+import os
+import tempfile
+from functools import partial
+from typing import (
+    BinaryIO, Iterable, Iterator, List, Optional, Tuple, Union,
+)
+
+from utils import batched
+
+
+ID_SIZE = 16
+
+DEDUP_INDEX_FILE_SUFFIX = '.dedup-index'
+
+# Около 100 МБ на множество последних идентификаторов
+DEFAULT_MAX_MEMORY_IDS = 1000 * 1000
+# Фильтр Блума на 10 млн идентификаторов с 1 % ложных срабатываний
+# занимает около 12 МБ
+DEFAULT_EXPECTED_IDS = 10 * 1000 * 1000
+DEFAULT_BLOOM_ERROR_RATE = 0.01
+
+_MERGE_BUFFER_IDS = 64 * 1024
+# 64 бита хеша на номера битов в слове по 6 бит
+_BLOOM_MAX_HASHES = 10
+
+
+def pack_id(id_: Optional[str]) -> Optional[bytes]:
+    """ 16 байт идентификатора или None, если идентификатора нет """
+    if id_ is None:
+        return None
+    # Только канонический вид UUID: другая запись того же UUID (например,
+    # в верхнем регистре) — другой идентификатор. Разбор без `uuid.UUID`
+    # в несколько раз быстрее
+    if (
+        len(id_) == 36
+        and id_[8] == id_[13] == id_[18] == id_[23] == '-'
+        and id_ == id_.lower()
+    ):
+        hex_id = id_.replace('-', '')
+        if len(hex_id) == 32:
+            try:
+                return bytes.fromhex(hex_id)
+            except ValueError:
+                pass
+    return hashlib.blake2b(id_.encode('utf-8'), digest_size=ID_SIZE).digest()
+
+
+class BloomFilter:
+    """
+    Блочный фильтр Блума для упакованных идентификаторов
+
+    Все биты ключа лежат в одном 64-битном слове, поэтому проверка и
+    добавление — одно чтение и одна запись слова. Размер и число хешей
+    рассчитаны на `capacity` элементов с долей ложных срабатываний
+    `error_rate` (у блочного фильтра она немного выше расчетной); при
+    большем числе элементов доля растет, но добавленный элемент
+    по-прежнему находится.
+    """
+    def __init__(
+        self, capacity: int, error_rate: float = DEFAULT_BLOOM_ERROR_RATE,
+    ) -> None:
+        size = -max(1, capacity) * math.log(error_rate) / math.log(2) ** 2
+        self.hashes_quantity = min(
+            _BLOOM_MAX_HASHES,
+            max(1, round(size / max(1, capacity) * math.log(2))),
+        )
+        self._words = memoryview(
+            bytearray(max(1, math.ceil(size / 64)) * 8),
+        ).cast('Q')
+
+    def _locate(self, key: bytes) -> Tuple[int, int]:
+        digest = hashlib.blake2b(key, digest_size=16).digest()
+        word_num = int.from_bytes(digest[:8], 'little') % len(self._words)
+        bit_numbers = int.from_bytes(digest[8:], 'little')
+        mask = 0
+        for _ in range(self.hashes_quantity):
+            mask |= 1 << (bit_numbers & 63)
+            bit_numbers >>= 6
+        return word_num, mask
+
+    def add(self, key: bytes) -> bool:
+        """ Добавляет ключ; True, если ключ, возможно, уже был добавлен """
+        word_num, mask = self._locate(key)
+        word = self._words[word_num]
+        if word & mask == mask:
+            return True
+        self._words[word_num] = word | mask
+        return False
+
+    def __contains__(self, key: bytes) -> bool:
+        word_num, mask = self._locate(key)
+        return self._words[word_num] & mask == mask
+
+
+Run = Union[bytes, mmap.mmap]
+
+
+def _run_contains(run: Run, key: bytes) -> bool:
+    low, high = 0, len(run) // ID_SIZE
+    while low < high:
+        middle = (low + high) // 2
+        offset = middle * ID_SIZE
+        record = run[offset:offset + ID_SIZE]
+        if record < key:
+            low = middle + 1
+        elif record > key:
+            high = middle
+        else:
+            return True
+    return False
+
+
+def _iter_chunks(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    for chunk in chunks:
+        for offset in range(0, len(chunk), ID_SIZE):
+            yield chunk[offset:offset + ID_SIZE]
+
+
+def _iter_run(run: Run) -> Iterator[bytes]:
+    chunk_size = _MERGE_BUFFER_IDS * ID_SIZE
+    return _iter_chunks(
+        run[chunk_offset:chunk_offset + chunk_size]
+        for chunk_offset in range(0, len(run), chunk_size)
+    )
+
+
+class IdIndex:
+    """
+    Множество упакованных идентификаторов в ограниченной памяти
+
+    `add` возвращает False для уже добавленного идентификатора. Без
+    `spill_dir` прогоны хранятся в памяти по 16 байт на идентификатор,
+    со `spill_dir` — во временных файлах, которые удаляются в `close`.
+    `expected_ids` задает размер фильтра Блума (0 — без фильтра).
+    `duplicates` — сколько раз `add` получил уже добавленный id.
+    """
+    def __init__(
+        self, max_memory_ids: int = DEFAULT_MAX_MEMORY_IDS,
+        spill_dir: str = None, expected_ids: int = DEFAULT_EXPECTED_IDS,
+        bloom_error_rate: float = DEFAULT_BLOOM_ERROR_RATE,
+    ) -> None:
+        self.max_memory_ids = max_memory_ids
+        self.spill_dir = spill_dir
+        self.bloom_filter = (
+            BloomFilter(expected_ids, bloom_error_rate)
+            if expected_ids else None
+        )
+        self.size = self.duplicates = 0
+        self._recent = set()
+        # Прогоны и их временные файлы (None для прогонов в памяти)
+        self._runs: List[Tuple[Run, Optional[BinaryIO]]] = []
+
+    @classmethod
+    def load(cls, path: str, **kwargs) -> 'IdIndex':
+        """
+        Индекс с идентификаторами, сохраненными в файл `path`
+
+        Если файла нет, индекс пустой. `kwargs` — как в `IdIndex`.
+        """
+        index = cls(**kwargs)
+        try:
+            index_file = open(path, 'rb')
+        except FileNotFoundError:
+            return index
+
+        def iter_keys() -> Iterator[bytes]:
+            read = partial(index_file.read, _MERGE_BUFFER_IDS * ID_SIZE)
+            for key in _iter_chunks(iter(read, b'')):
+                if index.bloom_filter is not None:
+                    index.bloom_filter.add(key)
+                index.size += 1
+                yield key
+
+        with index_file:
+            # Пустой прогон не нужен (и пустой файл не отображается в mmap)
+            if os.fstat(index_file.fileno()).st_size:
+                index._runs.append(index._write_run(iter_keys()))
+        return index
+
+    def save(self, path: str) -> None:
+        """ Записывает идентификаторы индекса в файл `path` по порядку """
+        # Запись через временный файл, чтобы сбой не испортил индекс
+        temp_path = f'{path}.tmp'
+        with open(temp_path, 'wb') as index_file:
+            for records_batch in batched(
+                heapq.merge(
+                    sorted(self._recent),
+                    *(_iter_run(run) for run, _ in self._runs),
+                ),
+                _MERGE_BUFFER_IDS,
+            ):
+                index_file.write(b''.join(records_batch))
+            index_file.flush()
+            os.fsync(index_file.fileno())
+        os.replace(temp_path, path)
+
+    def _in_runs(self, key: bytes) -> bool:
+        return any(_run_contains(run, key) for run, _ in self._runs)
+
+    def __contains__(self, key: bytes) -> bool:
+        if key in self._recent:
+            return True
+        if self.bloom_filter is not None and key not in self.bloom_filter:
+            return False
+        return self._in_runs(key)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def add(self, key: bytes) -> bool:
+        """ Добавляет упакованный идентификатор; False, если он уже есть """
+        if key in self._recent:
+            self.duplicates += 1
+            return False
+        # Ключ добавляется в фильтр сразу: если он уже есть в прогонах,
+        # его биты и так установлены
+        if (
+            self.bloom_filter is None or self.bloom_filter.add(key)
+        ) and self._in_runs(key):
+            self.duplicates += 1
+            return False
+        self._recent.add(key)
+        self.size += 1
+        if len(self._recent) >= self.max_memory_ids:
+            self._spill()
+        return True
+
+    def add_id(self, id_: Optional[str]) -> bool:
+        """ Документы без идентификатора не считаются повторами """
+        key = pack_id(id_)
+        return key is None or self.add(key)
+
+    def _write_run(
+        self, records: Iterable[bytes],
+    ) -> Tuple[Run, Optional[BinaryIO]]:
+        if self.spill_dir is None:
+            return b''.join(records), None
+
+        run_file = tempfile.TemporaryFile(dir=self.spill_dir)
+        for records_batch in batched(records, _MERGE_BUFFER_IDS):
+            run_file.write(b''.join(records_batch))
+        run_file.flush()
+        return (
+            mmap.mmap(run_file.fileno(), 0, access=mmap.ACCESS_READ),
+            run_file,
+        )
+
+    @staticmethod
+    def _release_run(run: Run, run_file: Optional[BinaryIO]) -> None:
+        if run_file is not None:
+            run.close()
+            run_file.close()
+
+    def _spill(self) -> None:
+        self._runs.append(self._write_run(sorted(self._recent)))
+        self._recent = set()
+
+        # Как в двоичном счетчике: сливаются последние прогоны, пока
+        # предпоследний не больше последнего
+        while (
+            len(self._runs) > 1
+            and len(self._runs[-2][0]) <= len(self._runs[-1][0])
+        ):
+            runs = self._runs[-2:]
+            self._runs[-2:] = [
+                self._write_run(
+                    heapq.merge(*(_iter_run(run) for run, _ in runs)),
+                ),
+            ]
+            for run, run_file in runs:
+                self._release_run(run, run_file)
+
+    def close(self) -> None:
+        while self._runs:
+            self._release_run(*self._runs.pop())
+        self._recent = set()
+
+    def __enter__(self) -> 'IdIndex':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
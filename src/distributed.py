@@ -0,0 +1,584 @@
+"""
+Распределенный сбор информации о документах через общую папку
+
+Координатор (`plan_distributed_collection`) делит архивы папки на задачи
+и записывает их в рабочую папку, доступную всем узлам (например, NFS):
+
+    work/
+        job.json            параметры сбора: папка архивов, формат, парсер
+        pending/            задачи, которые еще никто не взял
+        claimed/            задачи в работе
+        done/               выполненные задачи
+        parts/              выходные файлы задач: documents-00001.csv, ...
+
+Узел (`run_worker_node`, на любом хосте или в отдельном процессе) берет
+задачу, переименовывая ее файл из `pending` в `claimed` под временным
+именем: переименование атомарно, поэтому задачу получает ровно один
+узел. Узел записывает в файл задачи свой токен владельца (хост, pid и
+случайная часть) и только потом переименовывает файл в имя задачи, так
+что в `claimed` задача никогда не видна с токеном прежнего владельца.
+Пока задача в работе, узел обновляет время изменения файла; задачи, которые
+дольше `lease_timeout` секунд не обновлялись (узел остановился),
+возвращаются в `pending`, как и задачи, которые узел начал брать и не
+взял за то же время. Возраст аренды считается по часам файловой
+системы (время изменения пробного файла), а не по часам узла, поэтому
+расхождение часов хостов не влияет на срок.
+
+Узел, аренду которого отдали другому, может еще работать. Поэтому
+выходные файлы задачи пишутся под временными именами с токеном
+владельца, а перед их переименованием и перед переносом задачи в `done`
+узел проверяет, что токен в файле задачи все еще его; иначе результаты
+отбрасываются.
+
+После выполнения всех задач `merge_distributed_outputs` склеивает файлы
+задач в documents.csv и objects.csv: файлы задач пишутся без заголовков,
+заголовок формата пишется один раз. `collect_documents_distributed`
+выполняет все шаги с узлами в локальных процессах.
+"""
+
+
+import argparse
+import json
+import multiprocessing
+import os
+import secrets
+import shutil
+import socket
+import tempfile
+import threading
+import time
+from operator import itemgetter
+from typing import List, Optional, Sequence, Tuple
+
+from collector import (
+    DEFAULT_XML_PARSER, XML_PARSERS, collect_zip_files_multiple_core,
+)
+from instrumentation import Instrumentation
+from sinks import (
+    COMPRESSION_EXTENSIONS, DEFAULT_SINK, SINKS, format_sink, part_file_path,
+    sink_headers,
+)
+from utils import filter_file_sizes, pool_or_new
+
+
+JOB_FILE_NAME = 'job.json'
+PENDING_DIR_NAME = 'pending'
+CLAIMED_DIR_NAME = 'claimed'
+DONE_DIR_NAME = 'done'
+PARTS_DIR_NAME = 'parts'
+TASK_FILE_NAME_FORMAT = 'task-{:05d}.json'
+# Файл задачи, которую узел берет: записывается токен владельца
+CLAIMING_FILE_SUFFIX = '.claiming'
+
+DEFAULT_TASKS_QUANTITY = 16
+DEFAULT_LOCAL_NODES = 2
+DEFAULT_LEASE_TIMEOUT = 60.0
+# Как часто свободный узел проверяет, не освободились ли задачи
+DEFAULT_IDLE_INTERVAL = 1.0
+
+
+def _write_json(path: str, value, owner: str = None) -> None:
+    # Файлы задач могут писать несколько узлов: у каждого свой временный
+    # файл
+    temp_path = f'{path}.{owner}.tmp' if owner else f'{path}.tmp'
+    with open(temp_path, 'wt', encoding='utf-8') as json_file:
+        json.dump(value, json_file, indent=1)
+        json_file.flush()
+        os.fsync(json_file.fileno())
+    os.replace(temp_path, path)
+
+
+def _read_json(path: str):
+    with open(path, 'rt', encoding='utf-8') as json_file:
+        return json.load(json_file)
+
+
+def _task_num(task_file_name: str) -> int:
+    return int(task_file_name[len('task-'):-len('.json')])
+
+
+def _task_file_names(dir_path: str) -> List[str]:
+    return sorted(
+        file_name for file_name in os.listdir(dir_path)
+        if file_name.startswith('task-') and file_name.endswith('.json')
+    )
+
+
+def _claiming_file_names(claimed_dir_path: str) -> List[str]:
+    return sorted(
+        file_name for file_name in os.listdir(claimed_dir_path)
+        if file_name.startswith('task-')
+        and file_name.endswith(CLAIMING_FILE_SUFFIX)
+    )
+
+
+def _claimed_task_file_name(claiming_file_name: str) -> str:
+    # task-00001.json.<владелец>.claiming -> task-00001.json
+    return claiming_file_name[
+        :claiming_file_name.index('.json.') + len('.json')
+    ]
+
+
+def claim_owner() -> str:
+    """ Новый токен владельца задачи: хост, pid и случайная часть """
+    return f'{socket.gethostname()}-{os.getpid()}-{secrets.token_hex(4)}'
+
+
+def _owns_claim(claimed_path: str, owner: str) -> bool:
+    try:
+        return _read_json(claimed_path).get('owner') == owner
+    except FileNotFoundError:
+        return False
+
+
+def _filesystem_time(work_dir_path: str) -> float:
+    """
+    Текущее время по часам файловой системы рабочей папки
+
+    Время изменения файлов задач ставит файловая система (на NFS —
+    сервер), поэтому возраст аренды нужно сравнивать с ее временем, а не
+    с `time.time()` узла.
+    """
+    probe_path = os.path.join(work_dir_path, f'.clock-{claim_owner()}')
+    with open(probe_path, 'wb'):
+        pass
+    try:
+        os.utime(probe_path)
+        return os.path.getmtime(probe_path)
+    finally:
+        os.remove(probe_path)
+
+
+def plan_distributed_collection(
+    dir_path: str, work_dir_path: str,
+    tasks_quantity: int = DEFAULT_TASKS_QUANTITY,
+    sink_format: str = DEFAULT_SINK, compression: str = None,
+    parser: str = DEFAULT_XML_PARSER, recursive: bool = False,
+) -> int:
+    """
+    Делит архивы папки `dir_path` на задачи в рабочей папке
+
+    Архивы распределяются от больших к меньшим в наименее загруженную
+    задачу (LPT), поэтому задачи близки по размеру. Пути архивов
+    хранятся относительно `dir_path`: на узле папка может быть смонтирована
+    по другому пути. Возвращает количество задач.
+
+    Рабочая папка должна быть новой: задачи прежнего сбора смешались бы
+    с новыми.
+    """
+    if os.path.exists(os.path.join(work_dir_path, JOB_FILE_NAME)):
+        raise FileExistsError(f'{work_dir_path} already has a job')
+    for dir_name in (
+        PENDING_DIR_NAME, CLAIMED_DIR_NAME, DONE_DIR_NAME, PARTS_DIR_NAME,
+    ):
+        os.makedirs(os.path.join(work_dir_path, dir_name), exist_ok=True)
+
+    zip_file_sizes = sorted(
+        filter_file_sizes(dir_path, 'zip', recursive),
+        key=itemgetter(1), reverse=True,
+    )
+    tasks: List[Tuple[int, List[str]]] = [
+        (0, []) for _ in range(min(tasks_quantity, len(zip_file_sizes)))
+    ]
+    for zip_file_path, size in zip_file_sizes:
+        task_num = min(range(len(tasks)), key=lambda num: tasks[num][0])
+        task_size, zip_file_paths = tasks[task_num]
+        zip_file_paths.append(os.path.relpath(zip_file_path, dir_path))
+        tasks[task_num] = (task_size + size, zip_file_paths)
+
+    _write_json(
+        os.path.join(work_dir_path, JOB_FILE_NAME),
+        {
+            'dir_path': os.path.abspath(dir_path),
+            'format': sink_format,
+            'compression': compression,
+            'parser': parser,
+            'tasks': len(tasks),
+        },
+    )
+    for task_num, (_, zip_file_paths) in enumerate(tasks, 1):
+        _write_json(
+            os.path.join(
+                work_dir_path, PENDING_DIR_NAME,
+                TASK_FILE_NAME_FORMAT.format(task_num),
+            ),
+            {'zip_file_paths': zip_file_paths},
+        )
+    return len(tasks)
+
+
+def claim_task(work_dir_path: str, owner: str = None) -> Optional[str]:
+    """
+    Берет свободную задачу для владельца `owner` (по умолчанию — новый
+    токен); возвращает имя ее файла или None
+
+    None возвращается и тогда, когда задачу, которую узел начал брать,
+    за это время вернули в очередь (`requeue_stale_tasks`).
+    """
+    owner = owner or claim_owner()
+    pending_dir_path = os.path.join(work_dir_path, PENDING_DIR_NAME)
+    for task_file_name in _task_file_names(pending_dir_path):
+        claimed_path = os.path.join(
+            work_dir_path, CLAIMED_DIR_NAME, task_file_name,
+        )
+        claiming_path = f'{claimed_path}.{owner}{CLAIMING_FILE_SUFFIX}'
+        try:
+            os.rename(
+                os.path.join(pending_dir_path, task_file_name), claiming_path,
+            )
+        except FileNotFoundError:
+            # Задачу взял другой узел
+            continue
+        try:
+            # Файл под временным именем не виден узлам, которые проверяют
+            # владельца: токен прежнего владельца в нем не действует
+            task = _read_json(claiming_path)
+            # Файл записывается заново, поэтому его время изменения —
+            # начало срока аренды (задача, которую вернули в очередь,
+            # сохраняет старое время)
+            _write_json(claiming_path, {**task, 'owner': owner}, owner)
+            os.rename(claiming_path, claimed_path)
+        except FileNotFoundError:
+            # Узел брал задачу дольше срока аренды, и ее вернули в очередь
+            return None
+        return task_file_name
+    return None
+
+
+def requeue_stale_tasks(
+    work_dir_path: str, lease_timeout: float = DEFAULT_LEASE_TIMEOUT,
+) -> List[str]:
+    """
+    Возвращает в очередь задачи, которые узлы перестали обновлять
+
+    Задачи, которые узел начал брать, но не взял (`claim_task`),
+    возвращаются, если с переименования прошло `lease_timeout` секунд:
+    переименование обновляет время изменения метаданных (ctime).
+    """
+    claimed_dir_path = os.path.join(work_dir_path, CLAIMED_DIR_NAME)
+    now = _filesystem_time(work_dir_path)
+    requeued = []
+    for file_name, task_file_name, get_time in [
+        (task_file_name, task_file_name, os.path.getmtime)
+        for task_file_name in _task_file_names(claimed_dir_path)
+    ] + [
+        (file_name, _claimed_task_file_name(file_name), os.path.getctime)
+        for file_name in _claiming_file_names(claimed_dir_path)
+    ]:
+        claimed_path = os.path.join(claimed_dir_path, file_name)
+        try:
+            if now - get_time(claimed_path) < lease_timeout:
+                continue
+            os.rename(
+                claimed_path,
+                os.path.join(work_dir_path, PENDING_DIR_NAME, task_file_name),
+            )
+        except FileNotFoundError:
+            continue
+        requeued.append(task_file_name)
+    return requeued
+
+
+def _renew_lease(
+    claimed_path: str, owner: str, interval: float, stop: threading.Event,
+) -> None:
+    while not stop.wait(interval):
+        # Задачу другого узла не продлеваем
+        if not _owns_claim(claimed_path, owner):
+            return
+        try:
+            os.utime(claimed_path)
+        except FileNotFoundError:
+            return
+
+
+def _part_file_paths(
+    work_dir_path: str, extension: str, task_num: int,
+) -> Tuple[str, str]:
+    parts_dir_path = os.path.join(work_dir_path, PARTS_DIR_NAME)
+    return tuple(
+        part_file_path(
+            os.path.join(parts_dir_path, f'{name}.{extension}'), task_num,
+        )
+        for name in ('documents', 'objects')
+    )
+
+
+def run_task(
+    work_dir_path: str, task_file_name: str, dir_path: str = None,
+    processes: int = None, instrumentation: Instrumentation = None,
+    pool: multiprocessing.Pool = None, owner: str = None,
+) -> bool:
+    """
+    Собирает архивы задачи в ее выходные файлы
+
+    Без `owner` владельцем считается тот, кто записан в файле задачи
+    сейчас. Возвращает False, если задачу за время сбора отдали другому
+    владельцу: тогда выходные файлы не записываются.
+    """
+    job = _read_json(os.path.join(work_dir_path, JOB_FILE_NAME))
+    claimed_path = os.path.join(
+        work_dir_path, CLAIMED_DIR_NAME, task_file_name,
+    )
+    task = _read_json(claimed_path)
+    owner = owner or task.get('owner')
+    dir_path = dir_path or job['dir_path']
+    sink_class, extension = format_sink(job['format'], job['compression'])
+    part_file_paths = _part_file_paths(
+        work_dir_path, extension, _task_num(task_file_name),
+    )
+
+    temp_file_paths = [
+        f'{file_path}.{owner}.tmp' for file_path in part_file_paths
+    ]
+    try:
+        with open(temp_file_paths[0], 'wb') as documents_file, \
+             open(temp_file_paths[1], 'wb') as objects_file, \
+             sink_class(documents_file, objects_file, False) as sink:
+
+            collect_zip_files_multiple_core(
+                [
+                    os.path.join(dir_path, zip_file_path)
+                    for zip_file_path in task['zip_file_paths']
+                ],
+                sink, job['parser'], processes, render_in_workers=True,
+                instrumentation=instrumentation, pool=pool,
+            )
+        if not _owns_claim(claimed_path, owner):
+            return False
+        for temp_file_path, file_path in zip(
+            temp_file_paths, part_file_paths,
+        ):
+            os.replace(temp_file_path, file_path)
+        return True
+    finally:
+        for temp_file_path in temp_file_paths:
+            try:
+                os.remove(temp_file_path)
+            except FileNotFoundError:
+                pass
+
+
+def complete_task(
+    work_dir_path: str, task_file_name: str, owner: str,
+) -> bool:
+    """
+    Переносит задачу в выполненные, если ее владелец все еще `owner`
+    """
+    claimed_path = os.path.join(
+        work_dir_path, CLAIMED_DIR_NAME, task_file_name,
+    )
+    if not _owns_claim(claimed_path, owner):
+        return False
+    try:
+        os.replace(
+            claimed_path,
+            os.path.join(work_dir_path, DONE_DIR_NAME, task_file_name),
+        )
+    except FileNotFoundError:
+        return False
+    return True
+
+
+def run_worker_node(
+    work_dir_path: str, dir_path: str = None, processes: int = None,
+    lease_timeout: float = DEFAULT_LEASE_TIMEOUT,
+    idle_interval: float = DEFAULT_IDLE_INTERVAL,
+    instrumentation: Instrumentation = None, verbose: bool = True,
+) -> List[str]:
+    """
+    Выполняет задачи рабочей папки, пока все они не будут выполнены
+
+    Пул из `processes` процессов создается один раз на все задачи узла.
+    Если свободных задач нет, но некоторые еще в работе, узел ждет: их
+    узлы могут остановиться, и задачи вернутся в очередь. Возвращает
+    имена выполненных узлом задач; задачи, которые за время работы
+    отдали другому узлу, в них не входят.
+    """
+    node_name = f'{socket.gethostname()}:{os.getpid()}'
+    completed = []
+    with pool_or_new(None, processes) as pool:
+        while True:
+            owner = claim_owner()
+            task_file_name = claim_task(work_dir_path, owner)
+            if task_file_name is None:
+                claimed_dir_path = os.path.join(
+                    work_dir_path, CLAIMED_DIR_NAME,
+                )
+                if not (
+                    _task_file_names(claimed_dir_path)
+                    or _claiming_file_names(claimed_dir_path)
+                ):
+                    return completed
+                requeue_stale_tasks(work_dir_path, lease_timeout)
+                time.sleep(idle_interval)
+                continue
+
+            claimed_path = os.path.join(
+                work_dir_path, CLAIMED_DIR_NAME, task_file_name,
+            )
+            stop_renewal = threading.Event()
+            renewal_thread = threading.Thread(
+                target=_renew_lease,
+                args=(claimed_path, owner, lease_timeout / 3, stop_renewal),
+                daemon=True,
+            )
+            renewal_thread.start()
+            try:
+                written = run_task(
+                    work_dir_path, task_file_name, dir_path, processes,
+                    instrumentation, pool, owner,
+                )
+            finally:
+                stop_renewal.set()
+                renewal_thread.join()
+            if not written or not complete_task(
+                work_dir_path, task_file_name, owner,
+            ):
+                # Задачу вернули в очередь, ее выполнит другой узел
+                if verbose:
+                    print(f'Task {task_file_name} lost by {node_name}')
+                continue
+            completed.append(task_file_name)
+            if verbose:
+                print(f'Task {task_file_name} done on {node_name}')
+
+
+def merge_distributed_outputs(
+    work_dir_path: str, documents_file_path: str, objects_file_path: str,
+) -> None:
+    """ Склеивает выходные файлы выполненных задач в выходные файлы """
+    job = _read_json(os.path.join(work_dir_path, JOB_FILE_NAME))
+    done = _task_file_names(os.path.join(work_dir_path, DONE_DIR_NAME))
+    if len(done) != job['tasks']:
+        raise RuntimeError(
+            f'{job["tasks"] - len(done)} of {job["tasks"]} tasks are not done',
+        )
+
+    sink_class, extension = format_sink(job['format'], job['compression'])
+    for file_path, header, part_num in zip(
+        (documents_file_path, objects_file_path), sink_headers(sink_class),
+        (0, 1),
+    ):
+        with open(file_path, 'wb') as output_file:
+            output_file.write(header)
+            for task_file_name in done:
+                part_path = _part_file_paths(
+                    work_dir_path, extension, _task_num(task_file_name),
+                )[part_num]
+                with open(part_path, 'rb') as part_file:
+                    shutil.copyfileobj(part_file, output_file)
+
+
+def _run_worker_node_process(*args, **kwargs) -> None:
+    run_worker_node(*args, **kwargs)
+
+
+def collect_documents_distributed(
+    dir_path: str, documents_file_path: str, objects_file_path: str,
+    work_dir_path: str = None, nodes: int = DEFAULT_LOCAL_NODES,
+    processes_per_node: int = 1,
+    tasks_quantity: int = DEFAULT_TASKS_QUANTITY,
+    sink_format: str = DEFAULT_SINK, compression: str = None,
+    parser: str = DEFAULT_XML_PARSER, recursive: bool = False,
+    verbose: bool = True,
+) -> None:
+    """
+    Распределенный сбор с `nodes` узлами в локальных процессах
+
+    Без `work_dir_path` рабочая папка создается рядом с файлом документов
+    и удаляется после склейки.
+    """
+    temp_dir = None
+    if work_dir_path is None:
+        temp_dir = tempfile.TemporaryDirectory(
+            dir=os.path.dirname(os.path.abspath(documents_file_path)),
+        )
+        work_dir_path = temp_dir.name
+    try:
+        plan_distributed_collection(
+            dir_path, work_dir_path, tasks_quantity, sink_format, compression,
+            parser, recursive,
+        )
+        node_processes = [
+            multiprocessing.Process(
+                target=_run_worker_node_process, args=(work_dir_path, ),
+                kwargs={'processes': processes_per_node, 'verbose': verbose},
+            )
+            for _ in range(nodes)
+        ]
+        for node_process in node_processes:
+            node_process.start()
+        for node_process in node_processes:
+            node_process.join()
+        merge_distributed_outputs(
+            work_dir_path, documents_file_path, objects_file_path,
+        )
+    finally:
+        if temp_dir is not None:
+            temp_dir.cleanup()
+
+
+def parse_arguments(arguments: Sequence[str] = None) -> argparse.Namespace:
+    arguments_parser = argparse.ArgumentParser(
+        description='Распределенный сбор информации о документах',
+    )
+    commands = arguments_parser.add_subparsers(dest='command', required=True)
+
+    plan_parser = commands.add_parser('plan', help='разбить архивы на задачи')
+    plan_parser.add_argument('work_dir', help='общая рабочая папка')
+    plan_parser.add_argument('--dir', default='documents')
+    plan_parser.add_argument(
+        '--tasks', type=int, default=DEFAULT_TASKS_QUANTITY,
+    )
+    plan_parser.add_argument(
+        '--format', choices=tuple(SINKS), default=DEFAULT_SINK,
+    )
+    plan_parser.add_argument(
+        '--compression', choices=tuple(COMPRESSION_EXTENSIONS),
+    )
+    plan_parser.add_argument(
+        '--parser', choices=tuple(XML_PARSERS), default=DEFAULT_XML_PARSER,
+    )
+    plan_parser.add_argument('--recursive', action='store_true')
+
+    worker_parser = commands.add_parser('worker', help='выполнять задачи')
+    worker_parser.add_argument('work_dir', help='общая рабочая папка')
+    worker_parser.add_argument(
+        '--dir', help='папка архивов на этом узле, если путь другой',
+    )
+    worker_parser.add_argument('--processes', type=int)
+    worker_parser.add_argument(
+        '--lease-timeout', type=float, default=DEFAULT_LEASE_TIMEOUT,
+    )
+
+    merge_parser = commands.add_parser('merge', help='склеить результаты')
+    merge_parser.add_argument('work_dir', help='общая рабочая папка')
+    merge_parser.add_argument('documents_file')
+    merge_parser.add_argument('objects_file')
+    return arguments_parser.parse_args(arguments)
+
+
+def main(arguments: Sequence[str] = None) -> None:
+    arguments = parse_arguments(arguments)
+    if arguments.command == 'plan':
+        tasks_quantity = plan_distributed_collection(
+            arguments.dir, arguments.work_dir, arguments.tasks,
+            arguments.format, arguments.compression, arguments.parser,
+            arguments.recursive,
+        )
+        print(f'{tasks_quantity} tasks planned')
+    elif arguments.command == 'worker':
+        run_worker_node(
+            arguments.work_dir, arguments.dir, arguments.processes,
+            arguments.lease_timeout,
+        )
+    else:
+        merge_distributed_outputs(
+            arguments.work_dir, arguments.documents_file,
+            arguments.objects_file,
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,6 @@
-from typing import Sequence
+import itertools
+from array import array
+from typing import Iterable, Iterator, List, Optional, Sequence
 
 
 class DocumentObject:
@@ -46,3 +48,175 @@ class Document:
 
     def __hash__(self):
         return hash(self.id)
+
+
+class StringColumn:
+    """
+    Строки (или None) в одном буфере
+
+    Строки хранятся подряд в UTF-8 (`data`), их границы — в `offsets`
+    (uint32, на одно значение больше, чем строк: до 4 ГиБ строк в
+    колонке), пустые значения отмечены в `nulls`. Объект `str` создается
+    только при чтении значения.
+    """
+    __slots__ = ('data', 'offsets', 'nulls')
+
+    def __init__(self, values: Iterable[Optional[str]] = ()) -> None:
+        self.data = bytearray()
+        self.offsets = array('I', (0, ))
+        self.nulls = bytearray()
+        self.extend(values)
+
+    def append(self, value: Optional[str]) -> None:
+        if value is None:
+            self.nulls.append(1)
+        else:
+            self.data += value.encode('utf-8')
+            self.nulls.append(0)
+        self.offsets.append(len(self.data))
+
+    def extend(self, values: Iterable[Optional[str]]) -> None:
+        for value in values:
+            self.append(value)
+
+    def __len__(self) -> int:
+        return len(self.nulls)
+
+    def __getitem__(self, index: int) -> Optional[str]:
+        if index < 0:
+            index += len(self)
+        if self.nulls[index]:
+            return None
+        return self.data[self.offsets[index]:self.offsets[index + 1]].decode(
+            'utf-8',
+        )
+
+    def slice(self, start: int, stop: int) -> List[Optional[str]]:
+        return [self[index] for index in range(start, stop)]
+
+    def take(self, indexes: Iterable[int]) -> 'StringColumn':
+        """ Колонка из значений `indexes` (копируются байты, без строк) """
+        column = StringColumn()
+        for index in indexes:
+            column.data += self.data[
+                self.offsets[index]:self.offsets[index + 1]
+            ]
+            column.nulls.append(self.nulls[index])
+            column.offsets.append(len(column.data))
+        return column
+
+    def __iter__(self) -> Iterator[Optional[str]]:
+        return iter(self.slice(0, len(self)))
+
+    def truncate(self, length: int) -> None:
+        """ Оставляет первые `length` значений """
+        del self.data[self.offsets[length]:]
+        del self.offsets[length + 1:]
+        del self.nulls[length:]
+
+
+class DocumentBatch:
+    """
+    Пачка документов в нескольких непрерывных буферах
+
+    Колонки `ids`, `levels` и `object_names` — `StringColumn`, объекты
+    документа `n` — значения `object_names` с `object_offsets[n]` по
+    `object_offsets[n + 1]`. Парсеры сборщика заполняют пачку без
+    создания `Document` и `DocumentObject`, а между процессами она
+    передается как несколько буферов вместо объекта на каждое значение.
+
+    Для тестов и небольших вызывающих функций пачка выглядит как
+    последовательность `Document`, которые создаются при обращении.
+    Уровни хранятся строками, как в XML.
+    """
+    __slots__ = ('ids', 'levels', 'object_names', 'object_offsets')
+
+    def __init__(self) -> None:
+        self.ids = StringColumn()
+        self.levels = StringColumn()
+        self.object_names = StringColumn()
+        self.object_offsets = array('I', (0, ))
+
+    @classmethod
+    def from_documents(cls, documents: Iterable[Document]) -> 'DocumentBatch':
+        if isinstance(documents, cls):
+            return documents
+        batch = cls()
+        for document in documents:
+            batch.append_document(document)
+        return batch
+
+    def append(
+        self, id_: Optional[str], level, object_names: Iterable[Optional[str]],
+    ) -> None:
+        self.ids.append(id_)
+        self.levels.append(None if level is None else str(level))
+        self.object_names.extend(object_names)
+        self.object_offsets.append(len(self.object_names))
+
+    def append_document(self, document: Document) -> None:
+        self.append(
+            document.id, document.level,
+            [object_.name for object_ in document.objects],
+        )
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __getitem__(self, index: int) -> Document:
+        if index < 0:
+            index += len(self)
+        return Document(
+            id_=self.ids[index], level=self.levels[index],
+            objects=[
+                DocumentObject(name=name)
+                for name in self.object_names.slice(
+                    self.object_offsets[index],
+                    self.object_offsets[index + 1],
+                )
+            ],
+        )
+
+    def __iter__(self) -> Iterator[Document]:
+        return map(self.__getitem__, range(len(self)))
+
+    def take(self, indexes: Sequence[int]) -> 'DocumentBatch':
+        """ Пачка из документов `indexes` вместе с их объектами """
+        batch = DocumentBatch()
+        batch.ids = self.ids.take(indexes)
+        batch.levels = self.levels.take(indexes)
+        offsets = self.object_offsets
+        batch.object_names = self.object_names.take(
+            itertools.chain.from_iterable(
+                range(offsets[index], offsets[index + 1]) for index in indexes
+            )
+        )
+        for index in indexes:
+            batch.object_offsets.append(
+                batch.object_offsets[-1] + offsets[index + 1] - offsets[index],
+            )
+        return batch
+
+    def truncate(self, length: int) -> None:
+        """ Оставляет первые `length` документов, например, при ошибке """
+        self.ids.truncate(length)
+        self.levels.truncate(length)
+        self.object_names.truncate(self.object_offsets[length])
+        del self.object_offsets[length + 1:]
+
+    def object_counts(self) -> Iterator[int]:
+        offsets = self.object_offsets
+        return map(int.__sub__, offsets[1:], offsets[:-1])
+
+    def object_document_ids(
+        self, start: int = 0, stop: int = None,
+    ) -> Iterator[Optional[str]]:
+        """ id документа для каждого объекта документов `[start, stop)` """
+        stop = len(self) if stop is None else stop
+        offsets = self.object_offsets
+        return itertools.chain.from_iterable(
+            itertools.repeat(id_, offsets[index + 1] - offsets[index])
+            for index, id_ in zip(
+                range(start, stop), self.ids.slice(start, stop),
+            )
+        )
@@ -0,0 +1,187 @@
+"""
+Изоляция ошибок при сборе
+
+Без `FaultTolerance` первая же ошибка в архиве прерывает сбор. С ним:
+
+- файл архива, который не удалось прочитать или разобрать, пропускается,
+  а остальные документы архива собираются (`call_isolated` в процессе
+  пула собирает такие ошибки в `member_errors`);
+- задача пула, завершившаяся ошибкой, повторяется не больше
+  `max_attempts` раз, если ошибка может быть временной (`OSError`:
+  сбой чтения, сетевое хранилище) или задача не уложилась в
+  `task_timeout` секунд (например, процесс пула завершен из-за нехватки
+  памяти); иначе ошибка записывается в отчет, а сбор продолжается;
+- процессы пула заменяются новыми после `max_tasks_per_child` задач,
+  так память, занятая большим архивом, не копится.
+
+Ошибки записываются в отчет JSON Lines (`report_path`, создается при
+первой ошибке), архивы с ошибками копируются в папку карантина
+(`quarantine_dir_path`).
+"""
+
+
+import json
+import os
+import shutil
+from typing import Callable, List, NamedTuple, Optional, Set, Tuple
+
+
+ERROR_REPORT_FILE_SUFFIX = '.errors.jsonl'
+DEFAULT_MAX_ATTEMPTS = 3
+
+
+class CollectionError(NamedTuple):
+    """ Ошибка файла `member` архива или всей задачи (`member` None) """
+    zip_file_path: str
+    member: Optional[str]
+    error: str
+    attempts: int
+
+
+class TaskOutcome(NamedTuple):
+    """ Результат задачи пула, выполненной `call_isolated` """
+    result: object
+    member_errors: List[Tuple[str, str]]
+    error: Optional[str]
+    transient: bool
+
+
+def describe_error(error: BaseException) -> str:
+    return f'{type(error).__name__}: {error}'
+
+
+def is_transient(error: BaseException) -> bool:
+    """ Ошибки, после которых задачу стоит повторить """
+    return isinstance(error, OSError)
+
+
+# Ошибки файлов архивов текущей задачи процесса пула. Задаются на время
+# задачи в `call_isolated`, без него — None, и ошибка прерывает задачу
+_member_errors: Optional[List[Tuple[str, str]]] = None
+
+
+def get_member_errors() -> Optional[List[Tuple[str, str]]]:
+    return _member_errors
+
+
+def call_isolated(task: Callable, *args) -> TaskOutcome:
+    """
+    Выполняет задачу пула, пропуская файлы архивов с ошибками
+
+    Ошибка задачи возвращается в `TaskOutcome`, а не выбрасывается:
+    родительский процесс решает, повторить задачу или записать ошибку.
+    """
+    global _member_errors
+    member_errors = _member_errors = []
+    try:
+        return TaskOutcome(task(*args), member_errors, None, False)
+    except Exception as error:
+        return TaskOutcome(
+            None, member_errors, describe_error(error), is_transient(error),
+        )
+    finally:
+        _member_errors = None
+
+
+class FaultTolerance:
+    """
+    Настройки изоляции ошибок и отчет об ошибках сбора
+
+    `errors` — все ошибки, `failed_tasks` — сколько задач не выполнено
+    (их документы не собраны), `timeouts` — сколько задач не уложилось в
+    `task_timeout`: их процессы могут быть еще заняты, и пул, созданный
+    сборщиком, в конце завершается принудительно.
+    """
+    def __init__(
+        self, report_path: str = None, quarantine_dir_path: str = None,
+        max_attempts: int = DEFAULT_MAX_ATTEMPTS, task_timeout: float = None,
+        max_tasks_per_child: int = None,
+    ) -> None:
+        self.report_path = report_path
+        self.quarantine_dir_path = quarantine_dir_path
+        self.max_attempts = max_attempts
+        self.task_timeout = task_timeout
+        self.max_tasks_per_child = max_tasks_per_child
+        self.errors: List[CollectionError] = []
+        self.failed_tasks = self.timeouts = 0
+        self._report_file = None
+        self._quarantined: Set[str] = set()
+
+    @property
+    def failed_zip_file_paths(self) -> Set[str]:
+        """
+        Архивы с невыполненными задачами: документы таких архивов собраны
+        не полностью, а повторный сбор может закончиться успешно
+        """
+        return self.failed_zip_file_paths_since(0)
+
+    def failed_zip_file_paths_since(self, errors_quantity: int) -> Set[str]:
+        """
+        `failed_zip_file_paths` только по ошибкам, добавленным после
+        первых `errors_quantity` (например, за один из нескольких сборов
+        с общим `FaultTolerance`)
+        """
+        return {
+            error.zip_file_path for error in self.errors[errors_quantity:]
+            if error.member is None
+        }
+
+    def add(
+        self, zip_file_path: str, member: Optional[str], error: str,
+        attempts: int = 1,
+    ) -> None:
+        collection_error = CollectionError(
+            zip_file_path, member, error, attempts,
+        )
+        self.errors.append(collection_error)
+        if member is None:
+            self.failed_tasks += 1
+
+        if self.report_path is not None:
+            if self._report_file is None:
+                self._report_file = open(
+                    self.report_path, 'at', encoding='utf-8',
+                )
+            self._report_file.write(
+                json.dumps(collection_error._asdict(), ensure_ascii=False),
+            )
+            self._report_file.write('\n')
+            self._report_file.flush()
+
+        if (
+            self.quarantine_dir_path is not None
+            and zip_file_path not in self._quarantined
+        ):
+            self._quarantined.add(zip_file_path)
+            self._quarantine(zip_file_path)
+
+    def _quarantine(self, zip_file_path: str) -> None:
+        # Архив копируется, а не перемещается: папка архивов не
+        # принадлежит сборщику
+        os.makedirs(self.quarantine_dir_path, exist_ok=True)
+        name, extension = os.path.splitext(os.path.basename(zip_file_path))
+        quarantine_path = os.path.join(
+            self.quarantine_dir_path, f'{name}{extension}',
+        )
+        copy_num = 1
+        while os.path.exists(quarantine_path):
+            copy_num += 1
+            quarantine_path = os.path.join(
+                self.quarantine_dir_path, f'{name}-{copy_num}{extension}',
+            )
+        try:
+            shutil.copy2(zip_file_path, quarantine_path)
+        except OSError:
+            # Архив мог быть удален; ошибка уже в отчете
+            pass
+
+    def close(self) -> None:
+        if self._report_file is not None:
+            self._report_file.close()
+            self._report_file = None
+
+    def __enter__(self) -> 'FaultTolerance':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
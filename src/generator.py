@@ -1,14 +1,36 @@
+"""
+Генератор zip-архивов со случайными документами
+
+`generate_zip_files_with_random_documents` делит архивы на пачки
+документов. Процессы пула формируют и сжимают документы пачек, а
+родительский процесс дописывает сжатые файлы в архивы по порядку
+(`zip_writer.ZipStreamWriter`). Так сжатие масштабируется по ядрам и для
+одного большого архива, а в памяти находятся только пачки в работе.
+"""
+
+
+import argparse
+import multiprocessing
 import os
-from functools import partial
-from multiprocessing import Pool
+import sys
+from collections import deque
+from functools import lru_cache, partial
 from random import randint
+from typing import (
+    TYPE_CHECKING, Callable, Iterable, Iterator, List, Sequence, Tuple,
+)
 from uuid import uuid4
-from zipfile import ZipFile
-
-from jinja2 import Environment, PackageLoader
+from zipfile import ZIP_BZIP2, ZIP_DEFLATED, ZIP_LZMA, ZIP_STORED, ZipFile
 
 from entities import Document, DocumentObject
-from utils import clear_directory
+from instrumentation import (
+    COUNTER_BYTES, COUNTER_DOCUMENTS, STAGE_WRITE, Instrumentation,
+)
+from utils import clear_directory, pool_or_new
+from zip_writer import CompressedMember, ZipStreamWriter, compress_member
+
+if TYPE_CHECKING:
+    import jinja2
 
 
 # Documents generator
@@ -17,10 +39,39 @@ DEFAULT_MAX_LEVEL = 100
 DEFAULT_MIN_OBJECTS_QUANTITY = 1
 DEFAULT_MAX_OBJECTS_QUANTITY = 10
 
+DEFAULT_GENERATION_BATCH_SIZE = 1000
+
+# Методы сжатия файлов архива
+COMPRESSION_METHODS = {
+    'stored': ZIP_STORED,
+    'deflated': ZIP_DEFLATED,
+    'bzip2': ZIP_BZIP2,
+    'lzma': ZIP_LZMA,
+}
+# Пачек в работе на процесс пула: столько сжатых пачек может ждать записи
+DEFAULT_PENDING_BATCHES_PER_PROCESS = 4
+
 # Templates
-DEFAULT_TEMPLATE_ENV = Environment(loader=PackageLoader('generator'))
 DEFAULT_XML_TEMPLATE_NAME = 'document.xml'
 
+# Заранее разобранный шаблон `templates/document.xml` для
+# `document_to_xml_fast`. Результат совпадает с Jinja посимвольно
+FAST_XML_HEAD = (
+    "<root>\n"
+    "    <var name='id' value='{}'/>\n"
+    "    <var name='level' value='{}'/>\n"
+    "    <objects>\n"
+    "        \n"
+)
+FAST_XML_OBJECT = (
+    "            <object name='{}'/>\n"
+    "        \n"
+)
+FAST_XML_TAIL = (
+    "    </objects>\n"
+    "</root>"
+)
+
 
 def generate_random_document(
     min_level: int = DEFAULT_MIN_LEVEL,
@@ -38,52 +89,353 @@ def generate_random_document(
     )
 
 
+def random_uuid4_strings(quantity: int) -> List[str]:
+    """
+    Случайные UUID версии 4 в строковом виде
+
+    Байты получаются одним вызовом `os.urandom` на все идентификаторы,
+    что намного быстрее `uuid4()` для каждого.
+    """
+    random_bytes = bytearray(os.urandom(16 * quantity))
+    # Версия (4) и вариант (RFC 4122), как в `uuid.uuid4`
+    random_bytes[6::16] = bytes(
+        byte & 0x0f | 0x40 for byte in random_bytes[6::16]
+    )
+    random_bytes[8::16] = bytes(
+        byte & 0x3f | 0x80 for byte in random_bytes[8::16]
+    )
+    hex_bytes = random_bytes.hex()
+    return [
+        f'{hex_bytes[start:start + 8]}-{hex_bytes[start + 8:start + 12]}-'
+        f'{hex_bytes[start + 12:start + 16]}-'
+        f'{hex_bytes[start + 16:start + 20]}-'
+        f'{hex_bytes[start + 20:start + 32]}'
+        for start in range(0, len(hex_bytes), 32)
+    ]
+
+
+def generate_random_documents(
+    quantity: int,
+    min_level: int = DEFAULT_MIN_LEVEL,
+    max_level: int = DEFAULT_MAX_LEVEL,
+    min_objects_quantity: int = DEFAULT_MIN_OBJECTS_QUANTITY,
+    max_objects_quantity: int = DEFAULT_MAX_OBJECTS_QUANTITY,
+) -> List[Document]:
+    objects_quantities = [
+        randint(min_objects_quantity, max_objects_quantity)
+        for _ in range(quantity)
+    ]
+    uuids = iter(random_uuid4_strings(quantity + sum(objects_quantities)))
+    return [
+        Document(
+            id_=next(uuids),
+            level=randint(min_level, max_level),
+            objects=[
+                DocumentObject(name=next(uuids))
+                for _ in range(objects_quantity)
+            ],
+        )
+        for objects_quantity in objects_quantities
+    ]
+
+
+@lru_cache(maxsize=None)
+def get_template_env() -> 'jinja2.Environment':
+    """
+    Окружение Jinja для шаблонов `templates`
+
+    Jinja импортируется при первом обращении: ее импорт дольше запуска
+    интерпретатора, а архивы по умолчанию генерируются без нее
+    (`document_to_xml_fast`).
+    """
+    from jinja2 import Environment, PackageLoader
+    return Environment(loader=PackageLoader('generator'))
+
+
+def __getattr__(name: str):
+    # `DEFAULT_TEMPLATE_ENV` создается при первом обращении
+    if name == 'DEFAULT_TEMPLATE_ENV':
+        return get_template_env()
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
 def document_to_xml(
     document: Document, template_name: str = DEFAULT_XML_TEMPLATE_NAME,
-    template_env: Environment = DEFAULT_TEMPLATE_ENV,
+    template_env: 'jinja2.Environment' = None,
 ) -> str:
+    template_env = template_env or get_template_env()
     return template_env.get_template(template_name).render(document=document)
 
 
+def document_to_xml_fast(document: Document) -> str:
+    """ То же, что `document_to_xml` со стандартным шаблоном, без Jinja """
+    parts = [FAST_XML_HEAD.format(document.id, document.level)]
+    parts.extend(
+        FAST_XML_OBJECT.format(object_.name) for object_ in document.objects
+    )
+    parts.append(FAST_XML_TAIL)
+    return ''.join(parts)
+
+
+def _document_renderer(template_name: str = None) -> Callable[..., str]:
+    """ Функция `render(document=...)` для шаблона `template_name` """
+    if template_name is None:
+        return document_to_xml_fast
+    return get_template_env().get_template(template_name).render
+
+
+def _iter_random_document_batches(
+    quantity: int,
+    min_objects_quantity: int = DEFAULT_MIN_OBJECTS_QUANTITY,
+    max_objects_quantity: int = DEFAULT_MAX_OBJECTS_QUANTITY,
+) -> Iterator[List[Document]]:
+    # Документы создаются пачками, чтобы не держать в памяти весь архив
+    for batch_start in range(0, quantity, DEFAULT_GENERATION_BATCH_SIZE):
+        yield generate_random_documents(
+            min(DEFAULT_GENERATION_BATCH_SIZE, quantity - batch_start),
+            min_objects_quantity=min_objects_quantity,
+            max_objects_quantity=max_objects_quantity,
+        )
+
+
 def generate_zip_file_with_random_documents(
-    zip_file_path: str, documents_per_file: int, verbose: bool = True
+    zip_file_path: str, documents_per_file: int, verbose: bool = True,
+    min_objects_quantity: int = DEFAULT_MIN_OBJECTS_QUANTITY,
+    max_objects_quantity: int = DEFAULT_MAX_OBJECTS_QUANTITY,
+    template_name: str = None, compression: int = ZIP_STORED,
+    compression_level: int = None,
 ) -> None:
-    with ZipFile(zip_file_path, 'w') as zip_file:
-        for document_num in range(documents_per_file):
-            zip_file.writestr(
-                f'{document_num}.xml',
-                document_to_xml(generate_random_document()),
-            )
+    """
+    Создает архив в текущем процессе
+
+    Без `template_name` документы формируются `document_to_xml_fast`,
+    с ним — соответствующим шаблоном Jinja. `compression` — метод сжатия
+    `zipfile` (ZIP_STORED, ZIP_DEFLATED, ...), `compression_level` — его
+    уровень, как в `ZipFile`.
+    """
+    render = _document_renderer(template_name)
+    with ZipFile(
+             zip_file_path, 'w', compression,
+             compresslevel=compression_level,
+         ) as zip_file:
+        document_num = 0
+        for documents in _iter_random_document_batches(
+            documents_per_file, min_objects_quantity, max_objects_quantity,
+        ):
+            for document in documents:
+                zip_file.writestr(
+                    f'{document_num}.xml', render(document=document),
+                )
+                document_num += 1
 
     if verbose:
         print(f'{zip_file_path} created')
 
 
+def compress_random_documents(
+    first_document_num: int, quantity: int,
+    min_objects_quantity: int = DEFAULT_MIN_OBJECTS_QUANTITY,
+    max_objects_quantity: int = DEFAULT_MAX_OBJECTS_QUANTITY,
+    template_name: str = None, compression: int = ZIP_STORED,
+    compression_level: int = None,
+) -> List[CompressedMember]:
+    """
+    Сжатые файлы `first_document_num.xml`, ... со случайными документами
+    для `ZipStreamWriter`; выполняется в процессах пула
+    """
+    render = _document_renderer(template_name)
+    members = []
+    for documents in _iter_random_document_batches(
+        quantity, min_objects_quantity, max_objects_quantity,
+    ):
+        for document in documents:
+            members.append(
+                compress_member(
+                    f'{first_document_num + len(members)}.xml',
+                    render(document=document).encode('utf-8'),
+                    compression, compression_level,
+                ),
+            )
+    return members
+
+
+def _imap_bounded(
+    pool: multiprocessing.Pool, task: Callable,
+    tasks_args: Iterable[tuple], max_pending: int,
+) -> Iterator[Tuple[tuple, object]]:
+    """
+    Аргументы и результаты задач по порядку
+
+    В отличие от `Pool.imap`, задач в работе и готовых, но еще не
+    полученных результатов не больше `max_pending`: пул не опережает
+    потребителя результатов и не накапливает их в памяти.
+    """
+    pending = deque()
+    for task_args in tasks_args:
+        pending.append((task_args, pool.apply_async(task, task_args)))
+        if len(pending) >= max_pending:
+            task_args, result = pending.popleft()
+            yield task_args, result.get()
+    while pending:
+        task_args, result = pending.popleft()
+        yield task_args, result.get()
+
+
 def generate_zip_files_with_random_documents(
     dir_path: str, quantity: int, documents_per_file: int,
     verbose: bool = True,
+    min_objects_quantity: int = DEFAULT_MIN_OBJECTS_QUANTITY,
+    max_objects_quantity: int = DEFAULT_MAX_OBJECTS_QUANTITY,
+    template_name: str = None, processes: int = None,
+    pool: multiprocessing.Pool = None, compression: int = ZIP_STORED,
+    compression_level: int = None,
+    batch_size: int = DEFAULT_GENERATION_BATCH_SIZE,
+    max_pending_batches: int = None,
+    instrumentation: Instrumentation = None,
 ) -> None:
+    """
+    Создает `quantity` архивов по `documents_per_file` документов
+
+    Документы формируются и сжимаются пачками по `batch_size` в пуле
+    процессов, пачек в работе не больше `max_pending_batches` (по
+    умолчанию `DEFAULT_PENDING_BATCHES_PER_PROCESS` на процесс). Ошибка
+    в процессе пула выбрасывается отсюда, недописанный архив удаляется.
+    В `instrumentation` считаются документы и записанные байты; с
+    `verbose` в конце выводится скорость генерации.
+    """
     if os.path.exists(dir_path):
         clear_directory(dir_path)
     else:
         os.makedirs(dir_path)
 
-    zip_file_paths = (
-        os.path.join(dir_path, f'{zip_file_num}.zip')
+    instrumentation = instrumentation or Instrumentation()
+    if max_pending_batches is None:
+        max_pending_batches = (
+            DEFAULT_PENDING_BATCHES_PER_PROCESS
+            * (processes or os.cpu_count() or 1)
+        )
+    # Пустой архив — одна пустая пачка
+    tasks_args = (
+        (
+            zip_file_num, batch_start,
+            min(batch_size, documents_per_file - batch_start),
+        )
         for zip_file_num in range(quantity)
+        for batch_start in range(0, max(documents_per_file, 1), batch_size)
     )
+    compress_documents = partial(
+        _compress_random_documents_task,
+        min_objects_quantity=min_objects_quantity,
+        max_objects_quantity=max_objects_quantity,
+        template_name=template_name, compression=compression,
+        compression_level=compression_level,
+    )
+
+    zip_file_path = zip_file = zip_writer = None
+    try:
+        with pool_or_new(pool, processes) as pool:
+            batches = _imap_bounded(
+                pool, compress_documents, tasks_args, max_pending_batches,
+            )
+            for (zip_file_num, batch_start, _), members in (
+                instrumentation.timed(batches)
+            ):
+                if batch_start == 0:
+                    if zip_writer is not None:
+                        _finish_zip_file(
+                            zip_file_path, zip_file, zip_writer,
+                            instrumentation, verbose,
+                        )
+                    zip_file_path = os.path.join(
+                        dir_path, f'{zip_file_num}.zip',
+                    )
+                    zip_file = open(zip_file_path, 'wb')
+                    zip_writer = ZipStreamWriter(zip_file)
+
+                with instrumentation.stage(STAGE_WRITE):
+                    for member in members:
+                        zip_writer.write(member)
+                instrumentation.count(COUNTER_DOCUMENTS, len(members))
 
-    generate_zip_file = partial(
-        generate_zip_file_with_random_documents,
-        documents_per_file=documents_per_file, verbose=verbose,
+            if zip_writer is not None:
+                _finish_zip_file(
+                    zip_file_path, zip_file, zip_writer, instrumentation,
+                    verbose,
+                )
+                zip_writer = None
+    except BaseException:
+        if zip_writer is not None:
+            zip_file.close()
+            os.remove(zip_file_path)
+            if verbose:
+                print(f'{zip_file_path} failed', file=sys.stderr)
+        raise
+    instrumentation.finish()
+
+    if verbose:
+        report = instrumentation.report()
+        megabytes = instrumentation.total(COUNTER_BYTES) / 2 ** 20
+        print(
+            f'{instrumentation.total(COUNTER_DOCUMENTS)} documents, '
+            f'{megabytes:.1f} MB in {report["elapsed"]:.1f} s: '
+            f'{report["documents_per_second"]:.0f} docs/s, '
+            f'{megabytes / report["elapsed"]:.1f} MB/s'
+        )
+
+
+def _compress_random_documents_task(
+    zip_file_num: int, batch_start: int, quantity: int, **kwargs,
+) -> List[CompressedMember]:
+    return compress_random_documents(batch_start, quantity, **kwargs)
+
+
+def _finish_zip_file(
+    zip_file_path: str, zip_file, zip_writer: ZipStreamWriter,
+    instrumentation: Instrumentation, verbose: bool,
+) -> None:
+    with instrumentation.stage(STAGE_WRITE):
+        zip_writer.close()
+        zip_file.close()
+    instrumentation.count(COUNTER_BYTES, zip_writer.size)
+    if verbose:
+        print(f'{zip_file_path} created')
+
+
+def parse_arguments(arguments: Sequence[str] = None) -> argparse.Namespace:
+    arguments_parser = argparse.ArgumentParser(
+        description='Создает zip-архивы со случайными документами',
+    )
+    arguments_parser.add_argument('--dir', default='documents')
+    arguments_parser.add_argument('--archives', type=int, default=50)
+    arguments_parser.add_argument(
+        '--documents-per-archive', type=int, default=100,
+    )
+    arguments_parser.add_argument(
+        '--compression', choices=tuple(COMPRESSION_METHODS),
+        default='stored', help='метод сжатия файлов архивов',
     )
+    arguments_parser.add_argument(
+        '--compression-level', type=int,
+        help='уровень сжатия: 0-9 для deflated и lzma, 1-9 для bzip2',
+    )
+    arguments_parser.add_argument('--processes', type=int)
+    arguments_parser.add_argument(
+        '--progress', type=float, metavar='SECONDS',
+        help='выводить прогресс и скорость раз в SECONDS секунд',
+    )
+    return arguments_parser.parse_args(arguments)
 
-    with Pool() as pool:
-        # TODO: Добавить расчет `chunksize`
-        pool.imap_unordered(generate_zip_file, zip_file_paths)
-        pool.close()
-        pool.join()
+
+def main(arguments: Sequence[str] = None) -> None:
+    arguments = parse_arguments(arguments)
+    generate_zip_files_with_random_documents(
+        arguments.dir, arguments.archives, arguments.documents_per_archive,
+        processes=arguments.processes,
+        compression=COMPRESSION_METHODS[arguments.compression],
+        compression_level=arguments.compression_level,
+        instrumentation=Instrumentation(arguments.progress),
+    )
 
 
 if __name__ == '__main__':
-    generate_zip_files_with_random_documents('documents', 50, 100)
+    main()
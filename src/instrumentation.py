@@ -0,0 +1,320 @@
+"""
+Счетчики и замеры этапов сборщика
+
+Сборщики получают объект `Instrumentation` и отмечают в нем время этапов:
+открытие архива, распаковка, декодирование, разбор XML, ожидание
+результатов пула, запись выходных файлов. В процессах пула замеры
+ведутся в собственном объекте и передаются родительскому процессу вместе
+с результатом задачи (`call_instrumented`).
+"""
+
+
+import os
+import sys
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, TextIO
+
+
+# Верхние границы корзин гистограммы длительностей, секунды
+HISTOGRAM_BUCKETS = (1e-5, 1e-4, 1e-3, 1e-2, 1e-1, 1, 10, float('inf'))
+
+# Этапы
+STAGE_OPEN = 'open'
+STAGE_READ = 'read'
+STAGE_DECOMPRESS = 'decompress'
+STAGE_DECODE = 'decode'
+STAGE_PARSE = 'parse'
+STAGE_TASK = 'task'
+STAGE_BACKPRESSURE = 'backpressure'
+STAGE_WAIT = 'wait'
+STAGE_WRITE = 'write'
+
+# Счетчики
+COUNTER_DOCUMENTS = 'documents'
+COUNTER_OBJECTS = 'objects'
+COUNTER_BYTES = 'bytes'
+COUNTER_TASKS = 'tasks'
+# Документы из кэша разбора (`parse_cache`)
+COUNTER_CACHED = 'cached'
+
+MAIN_WORKER = 'main'
+# Потоки чтения архивов в родительском процессе
+IO_WORKER = 'io'
+
+
+class StageStats:
+    __slots__ = ('count', 'total', 'max', 'histogram')
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.histogram = [0] * len(HISTOGRAM_BUCKETS)
+
+    def add(self, duration: float) -> None:
+        self.count += 1
+        self.total += duration
+        if duration > self.max:
+            self.max = duration
+        self.histogram[bisect_left(HISTOGRAM_BUCKETS, duration)] += 1
+
+    def merge(self, other: 'StageStats') -> None:
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+        for bucket_num, count in enumerate(other.histogram):
+            self.histogram[bucket_num] += count
+
+    def to_dict(self) -> dict:
+        return {
+            'count': self.count,
+            'total': self.total,
+            'max': self.max,
+            'histogram': dict(
+                zip(map(str, HISTOGRAM_BUCKETS), self.histogram),
+            ),
+        }
+
+
+class Instrumentation:
+    """
+    Замеры этапов и счетчики по процессам
+
+    Если задан `progress_interval`, не чаще раза в `progress_interval`
+    секунд в `progress_file` выводится строка прогресса с количеством
+    документов в секунду, а в `callback` передается текущий отчет.
+    """
+    def __init__(
+        self, progress_interval: float = None,
+        progress_file: TextIO = sys.stderr,
+        callback: Callable[[dict], None] = None,
+    ) -> None:
+        self.progress_interval = progress_interval
+        self.progress_file = progress_file
+        self.callback = callback
+        self.stages: Dict[str, Dict[str, StageStats]] = {}
+        self.counters: Dict[str, Dict[str, int]] = {}
+        self.gauges: Dict[str, Dict[str, int]] = {}
+        self.started_at = self._progress_at = time.perf_counter()
+
+    def record(
+        self, stage: str, duration: float, worker: str = MAIN_WORKER,
+    ) -> None:
+        worker_stages = self.stages.setdefault(worker, {})
+        try:
+            stats = worker_stages[stage]
+        except KeyError:
+            stats = worker_stages[stage] = StageStats()
+        stats.add(duration)
+
+    @contextmanager
+    def stage(self, stage: str, worker: str = MAIN_WORKER) -> Iterator[None]:
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - started_at, worker)
+
+    def count(
+        self, counter: str, value: int = 1, worker: str = MAIN_WORKER,
+    ) -> None:
+        worker_counters = self.counters.setdefault(worker, {})
+        worker_counters[counter] = worker_counters.get(counter, 0) + value
+
+    def gauge(self, gauge: str, value: int) -> None:
+        """ Запоминает последнее и максимальное значение (глубина очереди) """
+        values = self.gauges.setdefault(gauge, {'last': value, 'max': value})
+        values['last'] = value
+        values['max'] = max(values['max'], value)
+
+    def timed(
+        self, iterable: Iterable, stage: str = STAGE_WAIT,
+    ) -> Iterator:
+        """ Замеряет время ожидания каждого элемента `iterable` """
+        iterator = iter(iterable)
+        while True:
+            started_at = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.record(stage, time.perf_counter() - started_at)
+            if self.progress_interval is not None:
+                self.progress()
+            yield item
+
+    @contextmanager
+    def stage_excluding(
+        self, stage: str, excluded: str = STAGE_WAIT,
+    ) -> Iterator[None]:
+        """
+        Замеряет время блока без вложенного этапа `excluded`
+
+        Например, время записи без ожидания результатов пула, когда запись
+        и ожидание чередуются в одном цикле.
+        """
+        main_stages = self.stages.setdefault(MAIN_WORKER, {})
+        excluded_before = main_stages.get(excluded, StageStats()).total
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            excluded_total = (
+                main_stages.get(excluded, StageStats()).total - excluded_before
+            )
+            self.record(
+                stage, time.perf_counter() - started_at - excluded_total,
+            )
+
+    def finish(self) -> None:
+        if self.progress_interval is not None:
+            self.progress(force=True)
+
+    def snapshot(self) -> dict:
+        """ Замеры текущего процесса для передачи в родительский процесс """
+        return {
+            'pid': os.getpid(),
+            'stages': self.stages.get(MAIN_WORKER, {}),
+            'counters': self.counters.get(MAIN_WORKER, {}),
+        }
+
+    def merge(self, snapshot: dict) -> None:
+        worker = str(snapshot['pid'])
+        worker_stages = self.stages.setdefault(worker, {})
+        for stage, stats in snapshot['stages'].items():
+            worker_stages.setdefault(stage, StageStats()).merge(stats)
+        for counter, value in snapshot['counters'].items():
+            self.count(counter, value, worker)
+
+    def total(self, counter: str) -> int:
+        return sum(
+            worker_counters.get(counter, 0)
+            for worker_counters in self.counters.values()
+        )
+
+    def report(self) -> dict:
+        elapsed = time.perf_counter() - self.started_at
+        stages = {}
+        for worker_stages in self.stages.values():
+            for stage, stats in worker_stages.items():
+                stages.setdefault(stage, StageStats()).merge(stats)
+
+        documents = self.total(COUNTER_DOCUMENTS)
+        return {
+            'elapsed': elapsed,
+            'documents_per_second': documents / elapsed if elapsed else 0.0,
+            'counters': {
+                counter: self.total(counter)
+                for worker_counters in self.counters.values()
+                for counter in worker_counters
+            },
+            'stages': {
+                stage: stats.to_dict() for stage, stats in stages.items()
+            },
+            'gauges': self.gauges,
+            'workers': {
+                worker: {
+                    # Доля времени, которую процесс был занят задачами:
+                    # низкая доля у процессов пула — пул простаивает
+                    'utilization': (
+                        worker_stages[STAGE_TASK].total / elapsed
+                        if STAGE_TASK in worker_stages and elapsed else None
+                    ),
+                    'stages': {
+                        stage: stats.to_dict()
+                        for stage, stats in worker_stages.items()
+                    },
+                    'counters': self.counters.get(worker, {}),
+                }
+                for worker, worker_stages in self.stages.items()
+            },
+        }
+
+    def progress(self, force: bool = False) -> None:
+        now = time.perf_counter()
+        if not force and now - self._progress_at < self.progress_interval:
+            return
+        self._progress_at = now
+
+        report = self.report()
+        # Большая доля ожидания — запись простаивает из-за пула, малая —
+        # пул ждет записи
+        wait = self.stages.get(MAIN_WORKER, {}).get(STAGE_WAIT, StageStats())
+        wait_share = wait.total / report['elapsed'] if report['elapsed'] else 0
+        if self.progress_file is not None:
+            print(
+                f'{self.total(COUNTER_DOCUMENTS)} documents, '
+                f'{report["documents_per_second"]:.0f} docs/s, '
+                f'waiting for workers {wait_share:.0%}',
+                file=self.progress_file,
+            )
+        if self.callback is not None:
+            self.callback(report)
+
+
+class NullInstrumentation:
+    """ Заглушка, когда замеры не нужны """
+    def record(self, stage: str, duration: float, worker=MAIN_WORKER):
+        pass
+
+    @contextmanager
+    def stage(self, stage: str, worker: str = MAIN_WORKER) -> Iterator[None]:
+        yield
+
+    def count(self, counter: str, value: int = 1, worker=MAIN_WORKER):
+        pass
+
+    def gauge(self, gauge: str, value: int) -> None:
+        pass
+
+    def timed(self, iterable: Iterable, stage: str = STAGE_WAIT) -> Iterable:
+        return iterable
+
+    @contextmanager
+    def stage_excluding(
+        self, stage: str, excluded: str = STAGE_WAIT,
+    ) -> Iterator[None]:
+        yield
+
+    def merge(self, snapshot: dict) -> None:
+        pass
+
+    def finish(self) -> None:
+        pass
+
+
+NULL_INSTRUMENTATION = NullInstrumentation()
+
+# Замеры текущего процесса. Сборщик задает их на время работы, процессы
+# пула — на время задачи
+_instrumentation = NULL_INSTRUMENTATION
+
+
+def get_instrumentation():
+    return _instrumentation
+
+
+def set_instrumentation(instrumentation) -> None:
+    global _instrumentation
+    _instrumentation = (
+        instrumentation if instrumentation is not None
+        else NULL_INSTRUMENTATION
+    )
+
+
+def call_instrumented(task: Callable, *args) -> tuple:
+    """
+    Выполняет задачу пула с замерами и возвращает `(результат, замеры)`
+    """
+    instrumentation = Instrumentation()
+    set_instrumentation(instrumentation)
+    try:
+        with instrumentation.stage(STAGE_TASK):
+            result = task(*args)
+        instrumentation.count(COUNTER_TASKS)
+    finally:
+        set_instrumentation(None)
+    return result, instrumentation.snapshot()
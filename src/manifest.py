@@ -0,0 +1,135 @@
+import json
+import os
+import zlib
+from typing import Dict, Iterable, List, Set, Tuple
+from zipfile import ZipFile, ZipInfo
+
+
+MANIFEST_FILE_SUFFIX = '.manifest.json'
+
+
+def member_key(zip_info: ZipInfo) -> str:
+    """ Ключ файла архива в манифесте: имя и CRC-32 """
+    return f'{zip_info.filename}:{zip_info.CRC}'
+
+
+def _zip_file_contents(zip_file_path: str) -> Tuple[int, List[str]]:
+    crc = 0
+    members = []
+    with ZipFile(zip_file_path, 'r') as zip_file:
+        for zip_info in zip_file.infolist():
+            crc = zlib.crc32(
+                f'{zip_info.filename}:{zip_info.CRC}:{zip_info.file_size}\n'
+                .encode('utf-8'),
+                crc,
+            )
+            members.append(member_key(zip_info))
+    return crc, members
+
+
+def zip_file_crc(zip_file_path: str) -> int:
+    """
+    Контрольная сумма содержимого архива
+
+    Считается по CRC-32 файлов из центрального каталога, поэтому архив не
+    распаковывается и не читается целиком.
+    """
+    return _zip_file_contents(zip_file_path)[0]
+
+
+class ArchiveManifest:
+    """
+    Список обработанных архивов: размер, время изменения и CRC содержимого
+
+    Архивы хранятся по пути относительно обрабатываемой папки. Если размер
+    и время изменения совпадают, архив считается неизменным без чтения;
+    иначе сравнивается CRC (архив мог быть скопирован без изменений).
+
+    Для каждого архива хранятся и ключи его собранных файлов
+    (`member_key`): из измененного архива собираются только новые файлы.
+    Архив, собранный не полностью, считается измененным, пока не будет
+    записан снова.
+    """
+    def __init__(self, path: str, archives: Dict[str, dict] = None) -> None:
+        self.path = path
+        self.archives = archives if archives is not None else {}
+
+    @classmethod
+    def load(cls, path: str) -> 'ArchiveManifest':
+        try:
+            with open(path, 'rt', encoding='utf-8') as manifest_file:
+                archives = json.load(manifest_file)['archives']
+        except FileNotFoundError:
+            archives = {}
+        return cls(path, archives)
+
+    def save(self) -> None:
+        # Запись через временный файл, чтобы сбой не испортил манифест
+        temp_path = f'{self.path}.tmp'
+        with open(temp_path, 'wt', encoding='utf-8') as manifest_file:
+            json.dump({'archives': self.archives}, manifest_file, indent=1)
+            manifest_file.flush()
+            os.fsync(manifest_file.fileno())
+        os.replace(temp_path, self.path)
+
+    @staticmethod
+    def _key(dir_path: str, zip_file_path: str) -> str:
+        return os.path.relpath(zip_file_path, dir_path)
+
+    @staticmethod
+    def _stat(zip_file_path: str) -> dict:
+        stat = os.stat(zip_file_path)
+        return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+    @classmethod
+    def snapshot(cls, zip_file_path: str) -> dict:
+        """
+        Размер, время изменения, CRC содержимого и ключи файлов архива
+
+        Снимок, взятый до сбора и переданный в `add`, не учитывает
+        изменений архива во время сбора.
+        """
+        archive = cls._stat(zip_file_path)
+        archive['crc'], archive['members'] = _zip_file_contents(zip_file_path)
+        return archive
+
+    def is_changed(self, dir_path: str, zip_file_path: str) -> bool:
+        archive = self.archives.get(self._key(dir_path, zip_file_path))
+        if archive is None or not archive.get('complete', True):
+            return True
+
+        stat = self._stat(zip_file_path)
+        if all(archive[name] == value for name, value in stat.items()):
+            return False
+
+        if archive['size'] == stat['size']:
+            crc = zip_file_crc(zip_file_path)
+            if archive['crc'] == crc:
+                archive.update(stat)
+                return False
+
+        return True
+
+    def members(self, dir_path: str, zip_file_path: str) -> Set[str]:
+        """
+        Ключи файлов архива при последней записи в манифест; пусто для
+        нового архива и для записей манифестов без ключей файлов
+        """
+        archive = self.archives.get(self._key(dir_path, zip_file_path), {})
+        return set(archive.get('members', ()))
+
+    def add(
+        self, dir_path: str, zip_file_path: str, snapshot: dict = None,
+        members: Iterable[str] = None, complete: bool = True,
+    ) -> None:
+        """
+        Записывает архив по снимку `snapshot` (по умолчанию текущему)
+
+        `members` — ключи собранных файлов, по умолчанию все файлы снимка.
+        """
+        archive = dict(snapshot or self.snapshot(zip_file_path))
+        if members is not None:
+            archive['members'] = sorted(members)
+        if not complete:
+            archive['complete'] = False
+        self.archives[self._key(dir_path, zip_file_path)] = archive
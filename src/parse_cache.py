@@ -0,0 +1,254 @@
+"""
+Кэш результатов разбора XML-файлов архивов
+
+Архивы часто пересобираются с теми же XML-файлами. CRC-32 и размер
+файла записаны в центральном каталоге архива, поэтому файл, который уже
+разбирался, узнается без распаковки. Кэш — база SQLite, где по CRC,
+размеру и хешу имени файла хранятся id, уровень и имена объектов
+документа. Файл с тем же CRC, размером и именем считается тем же
+документом; для разного содержимого такое совпадение практически
+исключено.
+
+Процессы пула открывают базу сами (`call_cached`) и записывают новые
+записи в конце каждой задачи. Записи, которые давно не использовались,
+удаляются при закрытии кэша в родительском процессе, если их больше
+`max_entries`.
+"""
+
+
+import hashlib
+import json
+import os
+import time
+from typing import (
+    TYPE_CHECKING, Callable, Dict, List, Optional, Sequence, Tuple,
+)
+from zipfile import ZipInfo
+
+from entities import DocumentBatch
+from utils import batched
+
+if TYPE_CHECKING:
+    import sqlite3
+
+
+# Около 200 байт на запись с несколькими объектами
+DEFAULT_MAX_ENTRIES = 1000 * 1000
+
+# Версия формата записей: при изменении разбора кэш очищается
+_VERSION = 1
+# Время использования записи обновляется не чаще раза в час
+_TOUCH_INTERVAL = 60 * 60
+_BUSY_TIMEOUT = 60
+# Не больше параметров в запросе, чем допускают старые версии SQLite
+_QUERY_KEYS = 500
+
+# id, уровень, имена объектов
+CachedDocument = Tuple[Optional[str], Optional[str], List[Optional[str]]]
+
+
+def _member_key(zip_info: ZipInfo) -> Tuple[int, int, int]:
+    name_hash = int.from_bytes(
+        hashlib.blake2b(
+            zip_info.filename.encode('utf-8'), digest_size=8,
+        ).digest(),
+        'little', signed=True,
+    )
+    return zip_info.CRC, zip_info.file_size, name_hash
+
+
+class ParseCache:
+    """
+    Кэш разобранных документов в файле `path`
+
+    Объект можно передавать в процессы пула: передается только путь к
+    базе, и каждый процесс открывает собственное соединение.
+    """
+    def __init__(
+        self, path: str, max_entries: int = DEFAULT_MAX_ENTRIES,
+    ) -> None:
+        self.__setstate__({'path': path, 'max_entries': max_entries})
+        # База создается сразу, до запуска процессов пула
+        self._connect()
+
+    def __getstate__(self) -> dict:
+        return {'path': self.path, 'max_entries': self.max_entries}
+
+    def __setstate__(self, state: dict) -> None:
+        # В процессе пула соединение открывается при первом обращении
+        self.path = state['path']
+        self.max_entries = state['max_entries']
+        self._connection = None
+        self._pid = None
+        self._new_entries = []
+        self._touched_keys = []
+
+    def _connect(self) -> 'sqlite3.Connection':
+        # Соединение нельзя использовать в дочернем процессе
+        if self._connection is not None and self._pid == os.getpid():
+            return self._connection
+
+        # sqlite3 импортируется, только если кэш используется
+        import sqlite3
+
+        connection = sqlite3.connect(self.path, timeout=_BUSY_TIMEOUT)
+        # WAL: процессы пула читают, пока другие процессы пишут
+        connection.execute('PRAGMA journal_mode = WAL')
+        connection.execute('PRAGMA synchronous = NORMAL')
+        with connection:
+            version, = connection.execute('PRAGMA user_version').fetchone()
+            if version != _VERSION:
+                connection.execute('DROP TABLE IF EXISTS members')
+                connection.execute(f'PRAGMA user_version = {_VERSION}')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS members ('
+                'crc INTEGER NOT NULL, size INTEGER NOT NULL, '
+                'name_hash INTEGER NOT NULL, id TEXT, level TEXT, '
+                'objects TEXT NOT NULL, used INTEGER NOT NULL, '
+                'PRIMARY KEY (crc, size, name_hash))'
+            )
+        self._connection, self._pid = connection, os.getpid()
+        return connection
+
+    def get_many(
+        self, zip_infos: Sequence[ZipInfo],
+    ) -> List[Optional[CachedDocument]]:
+        """
+        Документы файлов архива, None — для файлов, которых нет в кэше
+        """
+        keys = [_member_key(zip_info) for zip_info in zip_infos]
+        rows = {}
+        connection = self._connect()
+        # Один запрос на несколько файлов: по индексу выбираются записи с
+        # теми же CRC, остальные поля ключа сравниваются здесь
+        for crcs in batched(sorted({key[0] for key in keys}), _QUERY_KEYS):
+            for crc, size, name_hash, *row in connection.execute(
+                'SELECT crc, size, name_hash, id, level, objects, used '
+                'FROM members WHERE crc IN '
+                f'({", ".join("?" * len(crcs))})',
+                crcs,
+            ):
+                rows[crc, size, name_hash] = row
+
+        touched_before = time.time() - _TOUCH_INTERVAL
+        documents = []
+        for key in keys:
+            row = rows.get(key)
+            if row is None:
+                documents.append(None)
+                continue
+            id_, level, objects, used = row
+            if used < touched_before:
+                self._touched_keys.append(key)
+            documents.append((id_, level, json.loads(objects)))
+        return documents
+
+    def get(self, zip_info: ZipInfo) -> Optional[CachedDocument]:
+        """ Документ файла архива или None, если файла нет в кэше """
+        return self.get_many((zip_info, ))[0]
+
+    def put_batch(
+        self, zip_infos: Sequence[ZipInfo], batch: DocumentBatch,
+        start: int = 0,
+    ) -> None:
+        """
+        Добавляет документы `batch` с `start`, по одному на файл
+        `zip_infos`; записываются в базу при `flush`
+        """
+        used = int(time.time())
+        offsets = batch.object_offsets
+        for index, zip_info in enumerate(zip_infos, start):
+            self._new_entries.append((
+                *_member_key(zip_info), batch.ids[index], batch.levels[index],
+                json.dumps(
+                    batch.object_names.slice(
+                        offsets[index], offsets[index + 1],
+                    ),
+                    ensure_ascii=False,
+                ),
+                used,
+            ))
+
+    def flush(self) -> None:
+        if not self._new_entries and not self._touched_keys:
+            return
+        with self._connect() as connection:
+            connection.executemany(
+                'UPDATE members SET used = ? '
+                'WHERE crc = ? AND size = ? AND name_hash = ?',
+                [(int(time.time()), *key) for key in self._touched_keys],
+            )
+            connection.executemany(
+                'INSERT OR REPLACE INTO members '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                self._new_entries,
+            )
+        self._new_entries = []
+        self._touched_keys = []
+
+    def evict(self) -> int:
+        """
+        Удаляет записи, которые дольше всего не использовались, сверх
+        `max_entries`; возвращает, сколько записей удалено
+        """
+        with self._connect() as connection:
+            entries, = connection.execute(
+                'SELECT count(*) FROM members',
+            ).fetchone()
+            excess = entries - self.max_entries
+            if excess <= 0:
+                return 0
+            connection.execute(
+                'DELETE FROM members WHERE rowid IN ('
+                'SELECT rowid FROM members ORDER BY used LIMIT ?)',
+                (excess, ),
+            )
+        return excess
+
+    def close(self) -> None:
+        # Закрытый кэш не достается следующему сбору в этом же процессе
+        if _process_parse_caches.get(self.path) is self:
+            del _process_parse_caches[self.path]
+        if self._connection is None or self._pid != os.getpid():
+            return
+        self.flush()
+        self.evict()
+        self._connection.close()
+        self._connection = None
+
+    def __enter__(self) -> 'ParseCache':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+
+# Кэш текущей задачи или сбора в одном процессе. Без него (None) все
+# файлы разбираются
+_parse_cache: Optional[ParseCache] = None
+# Кэши, открытые в процессе пула, по пути базы: соединение переживает
+# задачу. Кэш убирается отсюда при закрытии
+_process_parse_caches: Dict[str, ParseCache] = {}
+
+
+def get_parse_cache() -> Optional[ParseCache]:
+    return _parse_cache
+
+
+def set_parse_cache(parse_cache: Optional[ParseCache]) -> None:
+    global _parse_cache
+    _parse_cache = parse_cache
+
+
+def call_cached(parse_cache: ParseCache, task: Callable, *args):
+    """ Выполняет задачу пула с кэшем разбора `parse_cache` """
+    parse_cache = _process_parse_caches.setdefault(
+        parse_cache.path, parse_cache,
+    )
+    set_parse_cache(parse_cache)
+    try:
+        return task(*args)
+    finally:
+        set_parse_cache(None)
+        # Документы, разобранные до ошибки, тоже верны
+        parse_cache.flush()
@@ -0,0 +1,979 @@
+"""
+Форматы выходных файлов сборщика
+
+Приемник (`Sink`) получает документы от любого режима сборщика и пишет их
+в пару файлов: документы и объекты документов. Чтобы добавить формат,
+достаточно добавить приемник в `SINKS`, разбор архивов не меняется.
+
+- `CsvSink` — documents.csv и objects.csv;
+- `ColumnarSink` — компактный двоичный колоночный формат (см. ниже);
+- `CompressedSink` — формат другого приемника, сжатый gzip или zstd;
+- `PartitionedSink` — то же, с разбиением на файлы-части
+  (objects-00001.csv.gz, ...) по размеру или количеству строк;
+- `DeduplicatingSink` — пропускает документы с уже записанными id
+  (индекс id — `dedup.IdIndex`) и передает остальные другому приемнику.
+
+Каждый фрагмент сжимается отдельно (в процессах-обработчиках, если
+сборщик формирует фрагменты в них), а файл состоит из подряд записанных
+сжатых фрагментов: и gzip, и zstd читают такие файлы как один поток.
+
+Колоночный формат
+-----------------
+
+Файл начинается с заголовка `DCOL`, версии формата (1 байт) и вида файла
+(`D` — документы, `O` — объекты), за ним следуют группы строк. Группа:
+`RGRP`, количество строк и размер данных группы (uint32), данные. Все
+числа — little-endian.
+
+Группа документов — колонка id и колонка level. Группа объектов —
+словарь id (id документов соответствующей группы документов), индексы в
+словаре (uint32 на объект) и колонка name. Так id не повторяется в каждой
+строке объектов.
+
+Строковая колонка начинается с байта вида: 1 — все значения являются
+UUID в каноническом виде и хранятся по 16 байт, 0 — произвольные строки:
+маска пустых значений (байт на строку), смещения (uint32, строк + 1) и
+строки в UTF-8. Колонка level: 2 — битовая маска заполненных значений
+(бит на строку, младший бит первого байта — первая строка) и int32
+(0 для пустых значений), 0 — строковая колонка, если уровни не целые
+числа. В файлах версии 1 встречается вид 1 — int32, где пустое значение
+— `NULL_LEVEL`; такие файлы читаются.
+"""
+
+
+import csv
+import gzip
+import itertools
+import os
+import struct
+import sys
+from array import array
+from functools import partial
+from io import BytesIO, StringIO, TextIOBase, TextIOWrapper
+from typing import (
+    BinaryIO, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional,
+    Sequence, Tuple, Type,
+)
+from uuid import UUID
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from dedup import IdIndex
+from entities import Document, DocumentBatch, DocumentObject, StringColumn
+from utils import BackgroundWriter, batched
+
+
+# Запись
+DEFAULT_WRITE_BATCH_SIZE = 1000
+DEFAULT_MAX_IN_FLIGHT_WRITES = 16
+
+# CSV
+DOCUMENTS_CSV_HEADER = ('id', 'level')
+OBJECTS_CSV_HEADER = ('id', 'name')
+
+# Колоночный формат
+COLUMNAR_MAGIC = b'DCOL'
+COLUMNAR_VERSION = 2
+# Версии, которые читает `iter_columnar_row_groups`
+COLUMNAR_READ_VERSIONS = (1, 2)
+COLUMNAR_DOCUMENTS = b'D'
+COLUMNAR_OBJECTS = b'O'
+COLUMNAR_ROW_GROUP_MAGIC = b'RGRP'
+DEFAULT_ROW_GROUP_SIZE = 10000
+# Пустой уровень в колонке int32 версии 1
+NULL_LEVEL = -2 ** 31
+
+_COLUMNAR_HEADER = struct.Struct('<4sBc')
+_ROW_GROUP_HEADER = struct.Struct('<4sII')
+_UINT32 = struct.Struct('<I')
+
+_STRINGS_PLAIN = 0
+_STRINGS_UUID = 1
+_LEVELS_STRINGS = 0
+_LEVELS_INT32_NULL_LEVEL = 1
+_LEVELS_INT32 = 2
+_UUID_SIZE = 16
+
+# Сжатие
+COMPRESSION_GZIP = 'gzip'
+COMPRESSION_ZSTD = 'zstd'
+COMPRESSION_EXTENSIONS = {COMPRESSION_GZIP: 'gz', COMPRESSION_ZSTD: 'zst'}
+PART_NUM_FORMAT = '05d'
+
+
+def documents_to_csv_files(
+    documents: Iterable, documents_file: TextIOWrapper,
+    objects_file: TextIOWrapper, write_headers: bool = True,
+) -> None:
+    # Используется однопоточная реализация
+    # Запись в отдельных потоках — `documents_to_csv_files_threaded`.
+    # Замеры на 50000 документах (1 ядро, Python 3.11):
+    # - локальный диск: 0.50 с здесь, 0.54 с в потоках (передача пачек
+    #   через очереди стоит около 10 %);
+    # - objects.csv на медленном хранилище (1 мс на каждые 64 КиБ):
+    #   1.21 с здесь, 1.08 с в потоках.
+    # Потоки имеет смысл включать, только если один из файлов пишется
+    # заметно медленнее другого
+    documents_writer = csv.writer(documents_file)
+    objects_writer = csv.writer(objects_file)
+    if write_headers:
+        documents_writer.writerow(DOCUMENTS_CSV_HEADER)
+        objects_writer.writerow(OBJECTS_CSV_HEADER)
+    if isinstance(documents, DocumentBatch):
+        # Строки берутся из колонок пачки без создания `Document`
+        documents_writer.writerows(zip(documents.ids, documents.levels))
+        objects_writer.writerows(
+            zip(documents.object_document_ids(), documents.object_names),
+        )
+        return
+    for document in documents:
+        documents_writer.writerow((document.id, document.level))
+        for object_ in document.objects:
+            objects_writer.writerow((document.id, object_.name))
+
+
+def documents_to_csv_files_threaded(
+    documents: Iterable, documents_file: TextIOWrapper,
+    objects_file: TextIOWrapper, write_headers: bool = True,
+    batch_size: int = DEFAULT_WRITE_BATCH_SIZE,
+    max_in_flight_batches: int = DEFAULT_MAX_IN_FLIGHT_WRITES,
+) -> None:
+    """
+    Пишет documents.csv и objects.csv в отдельных потоках
+
+    Строки передаются потокам пачками по `batch_size` документов, поэтому
+    медленная запись одного файла не останавливает запись другого, пока
+    не заполнится очередь из `max_in_flight_batches` пачек.
+    """
+    with BackgroundWriter(
+             csv.writer(documents_file).writerows, max_in_flight_batches,
+         ) as documents_writer, \
+         BackgroundWriter(
+             csv.writer(objects_file).writerows, max_in_flight_batches,
+         ) as objects_writer:
+
+        if write_headers:
+            documents_writer.write((DOCUMENTS_CSV_HEADER, ))
+            objects_writer.write((OBJECTS_CSV_HEADER, ))
+        for documents_batch in batched(documents, batch_size):
+            documents_writer.write(
+                [(document.id, document.level) for document in documents_batch]
+            )
+            objects_writer.write(
+                [
+                    (document.id, object_.name)
+                    for document in documents_batch
+                    for object_ in document.objects
+                ]
+            )
+
+
+def documents_to_csv_fragments(
+    documents: Iterable, write_headers: bool = False,
+) -> Tuple[str, str]:
+    """
+    Формирует строки documents.csv и objects.csv
+
+    Используется в процессах-обработчиках: родительскому процессу остается
+    только дописать готовые фрагменты в файлы.
+    """
+    documents_fragment, objects_fragment = StringIO(), StringIO()
+    documents_to_csv_files(
+        documents, documents_fragment, objects_fragment, write_headers,
+    )
+    return documents_fragment.getvalue(), objects_fragment.getvalue()
+
+
+def _array_bytes(typecode: str, values: Iterable[int]) -> bytes:
+    values = array(typecode, values)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values.tobytes()
+
+
+def _array_from_bytes(typecode: str, data: bytes) -> array:
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+
+def _uuid_bytes(values: Sequence[Optional[str]]) -> Optional[bytes]:
+    """ Упаковывает UUID по 16 байт или возвращает None, если не UUID """
+    packed = bytearray()
+    for value in values:
+        if value is None or len(value) != 36:
+            return None
+        try:
+            uuid = UUID(value)
+        except ValueError:
+            return None
+        # Упаковка должна сохранять строку как есть, включая регистр
+        if str(uuid) != value:
+            return None
+        packed += uuid.bytes
+    return bytes(packed)
+
+
+def _encode_string_column(
+    column: StringColumn, start: int, stop: int,
+) -> bytes:
+    """ Как `_encode_strings` для `column[start:stop]`, без декодирования """
+    offsets = column.offsets
+    lengths = map(
+        int.__sub__, offsets[start + 1:stop + 1], offsets[start:stop],
+    )
+    if all(length == 36 for length in lengths):
+        # Возможно, UUID: проверяются значения
+        return _encode_strings(column.slice(start, stop))
+
+    data_start = offsets[start]
+    return b''.join(
+        (
+            bytes((_STRINGS_PLAIN, )), column.nulls[start:stop],
+            _array_bytes(
+                'I',
+                (offset - data_start for offset in offsets[start:stop + 1]),
+            ),
+            column.data[data_start:offsets[stop]],
+        )
+    )
+
+
+def _encode_strings(values: Sequence[Optional[str]]) -> bytes:
+    packed = _uuid_bytes(values)
+    if packed is not None:
+        return bytes((_STRINGS_UUID, )) + packed
+
+    nulls = bytes(value is None for value in values)
+    encoded = [(value or '').encode('utf-8') for value in values]
+    offsets = [0]
+    for value in encoded:
+        offsets.append(offsets[-1] + len(value))
+    return b''.join(
+        (
+            bytes((_STRINGS_PLAIN, )), nulls, _array_bytes('I', offsets),
+            *encoded,
+        )
+    )
+
+
+def _decode_strings(
+    data: memoryview, offset: int, quantity: int,
+) -> Tuple[List[Optional[str]], int]:
+    kind = data[offset]
+    offset += 1
+    if kind == _STRINGS_UUID:
+        end = offset + quantity * _UUID_SIZE
+        return [
+            str(UUID(bytes=bytes(data[start:start + _UUID_SIZE])))
+            for start in range(offset, end, _UUID_SIZE)
+        ], end
+
+    nulls = data[offset:offset + quantity]
+    offset += quantity
+    offsets_end = offset + (quantity + 1) * 4
+    offsets = _array_from_bytes('I', data[offset:offsets_end])
+    values = [
+        None if nulls[value_num] else str(
+            data[
+                offsets_end + offsets[value_num]:
+                offsets_end + offsets[value_num + 1]
+            ],
+            'utf-8',
+        )
+        for value_num in range(quantity)
+    ]
+    return values, offsets_end + offsets[quantity]
+
+
+def _validity_bitmap(levels: Sequence) -> bytes:
+    bitmap = bytearray(b'\xff' * ((len(levels) + 7) // 8))
+    for level_num, level in enumerate(levels):
+        if level is None:
+            bitmap[level_num >> 3] &= ~(1 << (level_num & 7))
+    return bytes(bitmap)
+
+
+def _encode_levels(levels: Sequence) -> bytes:
+    try:
+        int_levels = [0 if level is None else int(level) for level in levels]
+        # Уровень должен восстанавливаться без потерь
+        if any(
+            level is not None and str(int_level) != str(level)
+            for level, int_level in zip(levels, int_levels)
+        ):
+            raise ValueError(levels)
+        return b''.join(
+            (
+                bytes((_LEVELS_INT32, )), _validity_bitmap(levels),
+                _array_bytes('i', int_levels),
+            )
+        )
+    except (TypeError, ValueError, OverflowError):
+        return bytes((_LEVELS_STRINGS, )) + _encode_strings(
+            [None if level is None else str(level) for level in levels]
+        )
+
+
+def _decode_levels(
+    data: memoryview, offset: int, quantity: int,
+) -> Tuple[list, int]:
+    kind = data[offset]
+    offset += 1
+    if kind == _LEVELS_STRINGS:
+        return _decode_strings(data, offset, quantity)
+    if kind == _LEVELS_INT32_NULL_LEVEL:
+        end = offset + quantity * 4
+        return [
+            None if level == NULL_LEVEL else level
+            for level in _array_from_bytes('i', data[offset:end])
+        ], end
+
+    bitmap = data[offset:offset + (quantity + 7) // 8]
+    offset += len(bitmap)
+    end = offset + quantity * 4
+    return [
+        level if bitmap[level_num >> 3] >> (level_num & 7) & 1 else None
+        for level_num, level in enumerate(
+            _array_from_bytes('i', data[offset:end]),
+        )
+    ], end
+
+
+def _row_group(rows_quantity: int, payload: Sequence[bytes]) -> bytes:
+    return b''.join(
+        (
+            _ROW_GROUP_HEADER.pack(
+                COLUMNAR_ROW_GROUP_MAGIC, rows_quantity,
+                sum(map(len, payload)),
+            ),
+            *payload,
+        )
+    )
+
+
+def columnar_file_header(kind: bytes) -> bytes:
+    return _COLUMNAR_HEADER.pack(COLUMNAR_MAGIC, COLUMNAR_VERSION, kind)
+
+
+def documents_to_columnar_fragments(
+    documents: Iterable[Document],
+    row_group_size: int = DEFAULT_ROW_GROUP_SIZE,
+) -> Tuple[bytes, bytes]:
+    """
+    Формирует группы строк файлов документов и объектов
+
+    Как и `documents_to_csv_fragments`, используется в
+    процессах-обработчиках.
+    """
+    if isinstance(documents, DocumentBatch):
+        return _document_batch_to_columnar_fragments(documents, row_group_size)
+
+    documents_groups, objects_groups = [], []
+    for documents_batch in batched(documents, row_group_size):
+        ids = _encode_strings([document.id for document in documents_batch])
+        documents_groups.append(
+            _row_group(
+                len(documents_batch),
+                (
+                    ids,
+                    _encode_levels(
+                        [document.level for document in documents_batch]
+                    ),
+                ),
+            )
+        )
+
+        indexes, names = [], []
+        for document_num, document in enumerate(documents_batch):
+            for object_ in document.objects:
+                indexes.append(document_num)
+                names.append(object_.name)
+        objects_groups.append(
+            _row_group(
+                len(names),
+                (
+                    _UINT32.pack(len(documents_batch)), ids,
+                    _array_bytes('I', indexes), _encode_strings(names),
+                ),
+            )
+        )
+    return b''.join(documents_groups), b''.join(objects_groups)
+
+
+def _document_batch_to_columnar_fragments(
+    batch: DocumentBatch, row_group_size: int,
+) -> Tuple[bytes, bytes]:
+    # Те же группы, что и из `Document`, но строки объектов копируются из
+    # буфера пачки без декодирования
+    documents_groups, objects_groups = [], []
+    object_offsets = batch.object_offsets
+    for start in range(0, len(batch), row_group_size):
+        stop = min(start + row_group_size, len(batch))
+        ids = _encode_strings(batch.ids.slice(start, stop))
+        documents_groups.append(
+            _row_group(
+                stop - start,
+                (ids, _encode_levels(batch.levels.slice(start, stop))),
+            )
+        )
+
+        indexes = array('I')
+        for document_num in range(start, stop):
+            indexes.extend(
+                itertools.repeat(
+                    document_num - start,
+                    object_offsets[document_num + 1]
+                    - object_offsets[document_num],
+                )
+            )
+        if sys.byteorder == 'big':
+            indexes.byteswap()
+        objects_groups.append(
+            _row_group(
+                len(indexes),
+                (
+                    _UINT32.pack(stop - start), ids, indexes.tobytes(),
+                    _encode_string_column(
+                        batch.object_names, object_offsets[start],
+                        object_offsets[stop],
+                    ),
+                ),
+            )
+        )
+    return b''.join(documents_groups), b''.join(objects_groups)
+
+
+def iter_columnar_row_groups(
+    file: BinaryIO,
+) -> Iterator[Dict[str, list]]:
+    """
+    Читает группы строк файла колоночного формата
+
+    Для файла документов возвращаются колонки `id` и `level`, для файла
+    объектов — словарь `id`, индексы в словаре `document` и `name`.
+    """
+    magic, version, kind = _COLUMNAR_HEADER.unpack(
+        file.read(_COLUMNAR_HEADER.size),
+    )
+    if magic != COLUMNAR_MAGIC or version not in COLUMNAR_READ_VERSIONS:
+        raise ValueError(f'Unsupported columnar file: {magic!r} {version}')
+
+    while True:
+        header = file.read(_ROW_GROUP_HEADER.size)
+        if not header:
+            return
+        magic, rows_quantity, size = _ROW_GROUP_HEADER.unpack(header)
+        if magic != COLUMNAR_ROW_GROUP_MAGIC:
+            raise ValueError(f'Broken row group: {magic!r}')
+        data = memoryview(file.read(size))
+
+        if kind == COLUMNAR_DOCUMENTS:
+            ids, offset = _decode_strings(data, 0, rows_quantity)
+            levels, _ = _decode_levels(data, offset, rows_quantity)
+            yield {'id': ids, 'level': levels}
+        else:
+            (ids_quantity, ) = _UINT32.unpack_from(data)
+            ids, offset = _decode_strings(data, _UINT32.size, ids_quantity)
+            indexes_end = offset + rows_quantity * 4
+            indexes = _array_from_bytes('I', data[offset:indexes_end])
+            names, _ = _decode_strings(data, indexes_end, rows_quantity)
+            yield {'id': ids, 'document': list(indexes), 'name': names}
+
+
+def read_columnar_documents(
+    documents_file: BinaryIO, objects_file: BinaryIO,
+) -> Iterator[Document]:
+    """ Восстанавливает документы из файлов колоночного формата """
+    for documents_group, objects_group in zip(
+        iter_columnar_row_groups(documents_file),
+        iter_columnar_row_groups(objects_file),
+    ):
+        documents = [
+            Document(id_=id_, level=level, objects=[])
+            for id_, level in zip(
+                documents_group['id'], documents_group['level'],
+            )
+        ]
+        for document_num, name in zip(
+            objects_group['document'], objects_group['name'],
+        ):
+            documents[document_num].objects.append(DocumentObject(name=name))
+        yield from documents
+
+
+class Sink:
+    """
+    Приемник документов
+
+    Сборщик передает приемнику документы (`write_documents`) или
+    фрагменты файлов (`write_fragment`), сформированные `render` в
+    процессах-обработчиках. `render` — функция уровня модуля, чтобы ее
+    можно было передать в пул процессов.
+
+    Файлы открывает и закрывает вызывающий код. Текстовые форматы
+    принимают и двоичные файлы, чтобы сборщики могли сохранять размеры
+    файлов в контрольной точке.
+    """
+    extension: str = NotImplemented
+    render: Callable[[Iterable[Document]], tuple] = NotImplemented
+
+    def write_documents(self, documents: Iterable[Document]) -> None:
+        if isinstance(documents, DocumentBatch):
+            self.write_fragment(self.render(documents))
+            return
+        for documents_batch in batched(documents, DEFAULT_WRITE_BATCH_SIZE):
+            self.write_fragment(self.render(documents_batch))
+
+    def write_fragment(self, fragment: tuple) -> None:
+        raise NotImplementedError
+
+    def flush(self) -> None:
+        """ Дописывает все переданное в файлы """
+
+    def close(self) -> None:
+        self.flush()
+
+    def __enter__(self) -> 'Sink':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+
+class CsvSink(Sink):
+    extension = 'csv'
+    render = staticmethod(documents_to_csv_fragments)
+
+    def __init__(
+        self, documents_file, objects_file, write_headers: bool = True,
+        threaded_writers: bool = False,
+    ) -> None:
+        self._wrappers = []
+        self.files = (
+            self._text_file(documents_file), self._text_file(objects_file),
+        )
+        self.threaded_writers = threaded_writers
+        self._writers = None
+        if write_headers:
+            documents_to_csv_files((), *self.files)
+
+    def _text_file(self, file) -> TextIOBase:
+        if isinstance(file, TextIOBase):
+            return file
+        wrapper = TextIOWrapper(
+            file, encoding='utf-8', newline='', write_through=True,
+        )
+        self._wrappers.append(wrapper)
+        return wrapper
+
+    def write_documents(self, documents: Iterable[Document]) -> None:
+        if self.threaded_writers:
+            # Строки передаются тем же потокам записи, что и фрагменты:
+            # потоки ждут только в `flush`, а не после каждой пачки
+            super().write_documents(documents)
+        else:
+            documents_to_csv_files(documents, *self.files, write_headers=False)
+
+    def write_fragment(self, fragment: Tuple[str, str]) -> None:
+        if not self.threaded_writers:
+            for file, file_fragment in zip(self.files, fragment):
+                file.write(file_fragment)
+            return
+
+        if self._writers is None:
+            self._writers = [
+                BackgroundWriter(file.write) for file in self.files
+            ]
+        for writer, file_fragment in zip(self._writers, fragment):
+            writer.write(file_fragment)
+
+    def flush(self) -> None:
+        if self._writers is not None:
+            writers, self._writers = self._writers, None
+            for writer in writers:
+                writer.close()
+        for file in self.files:
+            file.flush()
+
+    def close(self) -> None:
+        try:
+            self.flush()
+        finally:
+            # Двоичные файлы остаются открытыми у вызывающего кода
+            for wrapper in self._wrappers:
+                wrapper.detach()
+            self._wrappers = []
+
+
+class ColumnarSink(Sink):
+    extension = 'dcol'
+    render = staticmethod(documents_to_columnar_fragments)
+
+    def __init__(
+        self, documents_file: BinaryIO, objects_file: BinaryIO,
+        write_headers: bool = True,
+        row_group_size: int = DEFAULT_ROW_GROUP_SIZE,
+    ) -> None:
+        self.files = (documents_file, objects_file)
+        self.row_group_size = row_group_size
+        if write_headers:
+            documents_file.write(columnar_file_header(COLUMNAR_DOCUMENTS))
+            objects_file.write(columnar_file_header(COLUMNAR_OBJECTS))
+
+    def write_documents(self, documents: Iterable[Document]) -> None:
+        if isinstance(documents, DocumentBatch):
+            self.write_batch(documents)
+            return
+        for documents_batch in batched(documents, self.row_group_size):
+            self.write_fragment(
+                documents_to_columnar_fragments(
+                    documents_batch, self.row_group_size,
+                )
+            )
+
+    def write_batch(self, batch: DocumentBatch) -> None:
+        """ Пишет пачку из ее колонок, без создания `Document` """
+        self.write_fragment(
+            _document_batch_to_columnar_fragments(batch, self.row_group_size),
+        )
+
+    def write_fragment(self, fragment: Tuple[bytes, bytes]) -> None:
+        for file, file_fragment in zip(self.files, fragment):
+            file.write(file_fragment)
+
+    def flush(self) -> None:
+        for file in self.files:
+            file.flush()
+
+
+def compress(
+    data: bytes, compression: Optional[str], level: int = None,
+) -> bytes:
+    """ Сжимает данные в отдельный gzip-member или zstd-frame """
+    if compression is None or not data:
+        return data
+    if compression == COMPRESSION_GZIP:
+        return gzip.compress(data, 6 if level is None else level)
+    if compression == COMPRESSION_ZSTD:
+        if zstandard is None:
+            raise RuntimeError('zstd compression requires zstandard package')
+        return zstandard.ZstdCompressor(
+            3 if level is None else level,
+        ).compress(data)
+    raise ValueError(f'Unknown compression: {compression}')
+
+
+def decompress(data: bytes, compression: Optional[str]) -> bytes:
+    """ Распаковывает файл из нескольких сжатых фрагментов """
+    if compression is None:
+        return data
+    if compression == COMPRESSION_GZIP:
+        return gzip.decompress(data)
+    if compression == COMPRESSION_ZSTD:
+        if zstandard is None:
+            raise RuntimeError('zstd compression requires zstandard package')
+        return zstandard.ZstdDecompressor().stream_reader(
+            data, read_across_frames=True,
+        ).read()
+    raise ValueError(f'Unknown compression: {compression}')
+
+
+class EncodedFragment(NamedTuple):
+    data: Tuple[bytes, bytes]
+    # Строки документов и объектов — для разбиения на части
+    rows: Tuple[int, int]
+
+
+def render_encoded(
+    documents: Iterable[Document],
+    render: Callable[[Iterable[Document]], tuple],
+    compression: str = None, compression_level: int = None,
+) -> EncodedFragment:
+    """ Формирует фрагменты функцией `render`, кодирует и сжимает их """
+    batch = DocumentBatch.from_documents(documents)
+    return EncodedFragment(
+        data=tuple(
+            compress(
+                fragment.encode('utf-8') if isinstance(fragment, str)
+                else fragment,
+                compression, compression_level,
+            )
+            for fragment in render(batch)
+        ),
+        rows=(len(batch), len(batch.object_names)),
+    )
+
+
+def sink_headers(sink_class: Type[Sink]) -> Tuple[bytes, bytes]:
+    """ Заголовки пустых файлов формата """
+    documents_file, objects_file = BytesIO(), BytesIO()
+    sink_class(documents_file, objects_file).close()
+    return documents_file.getvalue(), objects_file.getvalue()
+
+
+class CompressedSink(Sink):
+    """
+    Пишет формат `sink_class` со сжатием
+
+    Файлы дописываются целыми сжатыми фрагментами, поэтому размеры файлов
+    в контрольной точке `collect_documents_info_resumable` по-прежнему
+    указывают на границу фрагмента.
+    """
+    def __init__(
+        self, documents_file: BinaryIO, objects_file: BinaryIO,
+        write_headers: bool = True, sink_class: Type[Sink] = CsvSink,
+        compression: str = COMPRESSION_GZIP, compression_level: int = None,
+    ) -> None:
+        self.files = (documents_file, objects_file)
+        self.extension = (
+            f'{sink_class.extension}.{COMPRESSION_EXTENSIONS[compression]}'
+        )
+        self.render = partial(
+            render_encoded, render=sink_class.render,
+            compression=compression, compression_level=compression_level,
+        )
+        if write_headers:
+            for file, header in zip(self.files, sink_headers(sink_class)):
+                file.write(compress(header, compression, compression_level))
+
+    def write_fragment(self, fragment: EncodedFragment) -> None:
+        for file, data in zip(self.files, fragment.data):
+            file.write(data)
+
+    def flush(self) -> None:
+        for file in self.files:
+            file.flush()
+
+
+def part_file_path(file_path: str, part_num: int) -> str:
+    """ `objects.csv.gz` -> `objects-00001.csv.gz` """
+    dir_path, file_name = os.path.split(file_path)
+    name, dot, extension = file_name.partition('.')
+    return os.path.join(
+        dir_path, f'{name}-{part_num:{PART_NUM_FORMAT}}{dot}{extension}',
+    )
+
+
+class PartFileWriter:
+    """
+    Пишет фрагменты в файлы-части
+
+    Новая часть начинается, если фрагмент не помещается в текущую по
+    `max_part_size` байт или `max_part_rows` строк. Фрагменты не
+    делятся, поэтому часть из одного большого фрагмента может превышать
+    ограничения. Каждая часть начинается с заголовка формата.
+    """
+    def __init__(
+        self, file_path: str, header: bytes, max_part_size: int = None,
+        max_part_rows: int = None,
+    ) -> None:
+        self.file_path = file_path
+        self.header = header
+        self.max_part_size = max_part_size
+        self.max_part_rows = max_part_rows
+        self.file_paths = []
+        self._file = None
+        self._part_size = self._part_rows = 0
+
+    def _is_full(self, size: int, rows: int) -> bool:
+        if not self._part_rows:
+            return False
+        return (
+            self.max_part_size is not None
+            and self._part_size + size > self.max_part_size
+        ) or (
+            self.max_part_rows is not None
+            and self._part_rows + rows > self.max_part_rows
+        )
+
+    def _next_part(self) -> None:
+        self.close()
+        if self.max_part_size is None and self.max_part_rows is None:
+            file_path = self.file_path
+        else:
+            file_path = part_file_path(
+                self.file_path, len(self.file_paths) + 1,
+            )
+        self.file_paths.append(file_path)
+        self._file = open(file_path, 'wb')
+        self._file.write(self.header)
+        self._part_size, self._part_rows = len(self.header), 0
+
+    def write(self, data: bytes, rows: int) -> None:
+        if self._file is None or self._is_full(len(data), rows):
+            self._next_part()
+        self._file.write(data)
+        self._part_size += len(data)
+        self._part_rows += rows
+
+    def flush(self) -> None:
+        if self._file is not None:
+            self._file.flush()
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class PartitionedSink(Sink):
+    """
+    Пишет формат `sink_class` (со сжатием) в файлы-части
+
+    Части файлов документов и объектов начинаются независимо друг от
+    друга. Без ограничений пишется по одному файлу с заданными путями.
+    Пути записанных файлов — `documents_file_paths` и
+    `objects_file_paths`.
+    """
+    def __init__(
+        self, documents_file_path: str, objects_file_path: str,
+        sink_class: Type[Sink] = CsvSink, compression: str = None,
+        compression_level: int = None, max_part_size: int = None,
+        max_part_rows: int = None,
+    ) -> None:
+        self.render = partial(
+            render_encoded, render=sink_class.render,
+            compression=compression, compression_level=compression_level,
+        )
+        self.writers = tuple(
+            PartFileWriter(
+                file_path, compress(header, compression, compression_level),
+                max_part_size, max_part_rows,
+            )
+            for file_path, header in zip(
+                (documents_file_path, objects_file_path),
+                sink_headers(sink_class),
+            )
+        )
+
+    @property
+    def documents_file_paths(self) -> List[str]:
+        return self.writers[0].file_paths
+
+    @property
+    def objects_file_paths(self) -> List[str]:
+        return self.writers[1].file_paths
+
+    def write_fragment(self, fragment: EncodedFragment) -> None:
+        for writer, data, rows in zip(
+            self.writers, fragment.data, fragment.rows,
+        ):
+            writer.write(data, rows)
+
+    def flush(self) -> None:
+        for writer in self.writers:
+            writer.flush()
+
+    def close(self) -> None:
+        for writer in self.writers:
+            # Пустой файл с заголовком, если записей не было
+            if not writer.file_paths:
+                writer.write(b'', 0)
+            writer.close()
+
+
+class DeduplicatingSink(Sink):
+    """
+    Пропускает повторы документов и передает остальные приемнику `sink`
+
+    Повтор — документ с id, который уже был записан: не пишутся ни его
+    строка, ни строки его объектов. Документы без id пишутся всегда.
+    Повторы отбираются в процессе сборщика, поэтому процессы-обработчики
+    передают пачки документов (`DocumentBatch`), а не фрагменты.
+
+    `duplicates` и `duplicate_objects` — сколько строк документов и
+    объектов пропущено. Переданный индекс `index` не закрывается, его
+    можно разделять между приемниками (например, между запусками сбора
+    в режиме отслеживания папки). Индекс сохраняет на диск сборщик
+    (`IdIndex.save`).
+    """
+    render = staticmethod(DocumentBatch.from_documents)
+
+    def __init__(self, sink: Sink, index: IdIndex = None) -> None:
+        self.sink = sink
+        self.extension = sink.extension
+        self._owns_index = index is None
+        self.index = IdIndex() if index is None else index
+        self.duplicates = self.duplicate_objects = 0
+
+    @classmethod
+    def create(
+        cls, sink_class: Type[Sink], *args, index: IdIndex = None, **kwargs,
+    ) -> 'DeduplicatingSink':
+        """
+        Приемник `sink_class(*args, **kwargs)` с отбором повторов
+
+        Через `partial` заменяет класс приемника в сборщиках, которые
+        создают приемник сами.
+        """
+        return cls(sink_class(*args, **kwargs), index)
+
+    def _is_new(self, id_: Optional[str], objects_quantity: int) -> bool:
+        if self.index.add_id(id_):
+            return True
+        self.duplicates += 1
+        self.duplicate_objects += objects_quantity
+        return False
+
+    def write_documents(self, documents: Iterable[Document]) -> None:
+        if not isinstance(documents, DocumentBatch):
+            self.sink.write_documents(
+                document for document in documents
+                if self._is_new(document.id, len(document.objects))
+            )
+            return
+
+        new_document_numbers = [
+            document_num
+            for document_num, (id_, objects_quantity) in enumerate(
+                zip(documents.ids, documents.object_counts()),
+            )
+            if self._is_new(id_, objects_quantity)
+        ]
+        if len(new_document_numbers) < len(documents):
+            documents = documents.take(new_document_numbers)
+        self.sink.write_documents(documents)
+
+    def write_fragment(self, fragment: DocumentBatch) -> None:
+        self.write_documents(fragment)
+
+    def flush(self) -> None:
+        self.sink.flush()
+
+    def close(self) -> None:
+        try:
+            self.sink.close()
+        finally:
+            if self._owns_index:
+                self.index.close()
+
+
+SINKS: Dict[str, Type[Sink]] = {
+    'csv': CsvSink,
+    'columnar': ColumnarSink,
+}
+DEFAULT_SINK = 'csv'
+
+
+def format_sink(
+    sink_format: str = DEFAULT_SINK, compression: str = None,
+) -> Tuple[Callable[..., Sink], str]:
+    """
+    Приемник формата `sink_format` (ключ `SINKS`) со сжатием и
+    расширение его файлов, например, `csv.gz`
+    """
+    sink_class = SINKS[sink_format]
+    if compression is None:
+        return sink_class, sink_class.extension
+    return (
+        partial(
+            CompressedSink, sink_class=sink_class, compression=compression,
+        ),
+        f'{sink_class.extension}.{COMPRESSION_EXTENSIONS[compression]}',
+    )
@@ -0,0 +1,58 @@
+import os
+import tempfile
+from unittest import TestCase
+
+from benchmark import (
+    Scale, compare_with_baseline, measure_mode, run_benchmark,
+)
+
+
+class ScaleTestCase(TestCase):
+    def test_parse(self):
+        self.assertEqual(Scale.parse('50x100'), Scale(50, 100, 10))
+        self.assertEqual(Scale.parse('5x10x2'), Scale(5, 10, 2))
+        self.assertEqual(str(Scale(5, 10, 2)), '5x10x2')
+
+
+class CompareWithBaselineTestCase(TestCase):
+    def test_compare_with_baseline(self):
+        baseline = {
+            'results': [
+                {'scale': '1x1x1', 'mode': 'a', 'duration': 1.0},
+                {'scale': '1x1x1', 'mode': 'b', 'duration': 1.0},
+            ],
+        }
+        report = {
+            'results': [
+                {'scale': '1x1x1', 'mode': 'a', 'duration': 1.05},
+                {'scale': '1x1x1', 'mode': 'b', 'duration': 1.5},
+                {'scale': '1x1x1', 'mode': 'c', 'duration': 9.0},
+            ],
+        }
+        regressions = compare_with_baseline(report, baseline, threshold=0.1)
+        self.assertListEqual(
+            [regression['mode'] for regression in regressions], ['b'],
+        )
+
+
+class RunBenchmarkTestCase(TestCase):
+    def test_run_benchmark(self):
+        report = run_benchmark(
+            [Scale(2, 3, 2)], modes=['single_core'], verbose=False,
+        )
+        result, = report['results']
+        self.assertEqual(result['scale'], '2x3x2')
+        self.assertEqual(result['documents'], 6)
+        self.assertGreater(result['documents_per_second'], 0)
+        self.assertGreater(result['output_size'], 0)
+        self.assertIn('collect', result['stages'])
+
+
+class MeasureModeTestCase(TestCase):
+    def test_failed_mode(self):
+        with tempfile.TemporaryDirectory() as dir_path:
+            with self.assertRaisesRegex(RuntimeError, 'exited with code 1'):
+                measure_mode(
+                    'single_core', os.path.join(dir_path, 'missing'),
+                    stages=False,
+                )
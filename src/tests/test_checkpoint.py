@@ -0,0 +1,22 @@
+import os
+import tempfile
+from unittest import TestCase
+
+from checkpoint import Checkpoint
+
+
+class CheckpointTestCase(TestCase):
+    def test_save_and_load(self):
+        with tempfile.TemporaryDirectory() as temp_dir_path:
+            checkpoint_path = os.path.join(temp_dir_path, 'checkpoint.json')
+            tasks = [('0.zip', 0, 2, 100), ('0.zip', 2, 3, 50)]
+            Checkpoint(checkpoint_path, tasks, {1}, [10, 20]).save()
+
+            checkpoint = Checkpoint.load(checkpoint_path)
+            self.assertListEqual(checkpoint.tasks, tasks)
+            self.assertSetEqual(checkpoint.completed, {1})
+            self.assertListEqual(checkpoint.offsets, [10, 20])
+            self.assertListEqual(checkpoint.pending, [0])
+
+            checkpoint.remove()
+            self.assertFalse(os.path.exists(checkpoint_path))
@@ -1,17 +1,300 @@
 import os
 import tempfile
+import threading
+import time
+from functools import partial
+from io import StringIO
+from multiprocessing.pool import ThreadPool
 from unittest import TestCase
-from zipfile import ZipFile
+from unittest.mock import patch
+from zipfile import ZIP_DEFLATED, ZIP_STORED, BadZipFile, ZipFile
 
+from lxml import etree
+
+from checkpoint import Checkpoint
+from entities import Document, DocumentObject
+from faults import FaultTolerance
+from instrumentation import COUNTER_DOCUMENTS, STAGE_PARSE, Instrumentation
 from generator import document_to_xml, generate_random_document
 from collector import (
+    MIN_POOL_INPUT_SIZE, XML_PARSER_STREAM, XML_PARSER_XPATH, XML_PARSERS,
     collect_documents_info_single_core, collect_documents_info_multiple_core,
+    collect_documents_info_incremental, collect_documents_info_resumable,
+    collect_documents_info_streaming, document_batch_from_zip_file_shard,
+    document_from_xml,
+    documents_from_zip_file, documents_from_zip_file_shard,
+    fragments_from_zip_file_shard, iter_document_batches_from_zip_file_shard,
+    collect_zip_files_multiple_core, main, parse_arguments,
+    plan_zip_file_shards,
+    prefetch_zip_file_shard, read_zip_members_range, split_zip_file,
+    watch_documents_info, _imap_isolated, _imap_prefetched,
+)
+from sinks import (
+    documents_to_csv_files, documents_to_csv_files_threaded,
+    documents_to_csv_fragments,
 )
+from utils import shared_pool
+
+
+class DocumentFromXmlTestCase(TestCase):
+    def assertParsersEqual(self, xml: str, expected_document: Document):
+        for parser in XML_PARSERS:
+            with self.subTest(parser=parser):
+                self.assertEqual(
+                    document_from_xml(xml, parser), expected_document,
+                )
+
+    def test_document_from_xml(self):
+        document = generate_random_document()
+        document.level = str(document.level)
+        self.assertParsersEqual(document_to_xml(document), document)
+
+    def test_document_from_xml_without_vars(self):
+        self.assertParsersEqual(
+            "<root><objects><object name='a'/></objects></root>",
+            Document(id_=None, level=None, objects=[DocumentObject('a')]),
+        )
+
+    def test_document_from_xml_first_var_wins(self):
+        self.assertParsersEqual(
+            "<root>"
+            "<var name='id'/><var name='id' value='2'/>"
+            "<var name='level' value='1'/><var name='level' value='2'/>"
+            "</root>",
+            Document(id_=None, level='1', objects=[]),
+        )
+
+    def test_document_from_xml_ignores_nested_elements(self):
+        self.assertParsersEqual(
+            "<root>"
+            "<objects><object name='a'><object name='b'/></object></objects>"
+            "<other><var name='id' value='1'/></other>"
+            "<objects><object/></objects>"
+            "</root>",
+            Document(
+                id_=None, level=None,
+                objects=[DocumentObject('a'), DocumentObject(None)],
+            ),
+        )
+
+    def test_document_from_xml_with_other_root(self):
+        self.assertParsersEqual(
+            "<document><var name='id' value='1'/></document>",
+            Document(id_=None, level=None, objects=[]),
+        )
+
+    def test_document_from_xml_after_syntax_error(self):
+        for parser in XML_PARSERS:
+            with self.subTest(parser=parser):
+                with self.assertRaises(etree.XMLSyntaxError):
+                    document_from_xml(
+                        "<root><var name='id' value='1'/>", parser,
+                    )
+                self.assertEqual(
+                    document_from_xml("<root><objects/></root>", parser),
+                    Document(id_=None, level=None, objects=[]),
+                )
+
+    def test_documents_from_zip_file(self):
+        documents = [generate_random_document() for _ in range(3)]
+        for document in documents:
+            document.level = str(document.level)
+
+        with tempfile.TemporaryDirectory() as temp_dir_path:
+            zip_file_path = os.path.join(temp_dir_path, 'documents.zip')
+            with ZipFile(zip_file_path, 'w') as zip_file:
+                for document_num, document in enumerate(documents):
+                    zip_file.writestr(
+                        f'{document_num}.xml', document_to_xml(document),
+                    )
+                zip_file.writestr('readme.txt', 'not a document')
+
+            for parser in (XML_PARSER_STREAM, XML_PARSER_XPATH):
+                with self.subTest(parser=parser):
+                    self.assertListEqual(
+                        documents_from_zip_file(
+                            zip_file_path, verbose=False, parser=parser,
+                        ),
+                        documents,
+                    )
+
+
+class DocumentsToCsvFragmentsTestCase(TestCase):
+    def test_documents_to_csv_fragments(self):
+        documents = [generate_random_document() for _ in range(3)]
+        documents_file, objects_file = StringIO(), StringIO()
+        documents_to_csv_files(
+            documents, documents_file, objects_file, write_headers=False,
+        )
+        self.assertTupleEqual(
+            documents_to_csv_fragments(documents),
+            (documents_file.getvalue(), objects_file.getvalue()),
+        )
+
+
+class DocumentsToCsvFilesThreadedTestCase(TestCase):
+    def test_documents_to_csv_files_threaded(self):
+        documents = [generate_random_document() for _ in range(5)]
+        documents_file, objects_file = StringIO(), StringIO()
+        documents_to_csv_files(documents, documents_file, objects_file)
+
+        threaded_documents_file, threaded_objects_file = StringIO(), StringIO()
+        documents_to_csv_files_threaded(
+            documents, threaded_documents_file, threaded_objects_file,
+            batch_size=2, max_in_flight_batches=1,
+        )
+        self.assertEqual(
+            threaded_documents_file.getvalue(), documents_file.getvalue(),
+        )
+        self.assertEqual(
+            threaded_objects_file.getvalue(), objects_file.getvalue(),
+        )
+
+
+class SplitZipFileTestCase(TestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.zip_file_path = os.path.join(temp_dir.name, 'documents.zip')
+        with ZipFile(self.zip_file_path, 'w') as zip_file:
+            for document_num in range(5):
+                zip_file.writestr(
+                    f'{document_num}.xml',
+                    document_to_xml(generate_random_document()),
+                )
+            zip_file.writestr('readme.txt', 'not a document')
+
+    def test_split_zip_file(self):
+        shards = split_zip_file(self.zip_file_path, shard_size=1)
+        self.assertListEqual(
+            [(shard.start, shard.stop) for shard in shards],
+            [(0, 1), (1, 2), (2, 3), (3, 4), (4, 5)],
+        )
+        self.assertListEqual(
+            [
+                document
+                for shard in shards
+                for document in documents_from_zip_file_shard(
+                    shard, verbose=False,
+                )
+            ],
+            documents_from_zip_file(self.zip_file_path, verbose=False),
+        )
+
+    def test_document_batch_from_zip_file_shard(self):
+        (shard, ) = split_zip_file(self.zip_file_path, shard_size=2 ** 30)
+        for parser in XML_PARSERS:
+            with self.subTest(parser=parser):
+                batch = document_batch_from_zip_file_shard(
+                    shard, verbose=False, parser=parser,
+                )
+                self.assertListEqual(
+                    list(batch),
+                    documents_from_zip_file(
+                        self.zip_file_path, verbose=False, parser=parser,
+                    ),
+                )
+                self.assertListEqual(
+                    [
+                        len(batch)
+                        for batch in iter_document_batches_from_zip_file_shard(
+                            shard, parser, batch_size=2,
+                        )
+                    ],
+                    [2, 2, 1],
+                )
+
+    def test_split_zip_file_into_single_shard(self):
+        shards = split_zip_file(self.zip_file_path, shard_size=2 ** 30)
+        self.assertListEqual(
+            [(shard.start, shard.stop) for shard in shards], [(0, 5)],
+        )
+
+    def test_plan_zip_file_shards(self):
+        shards = plan_zip_file_shards(
+            [self.zip_file_path, self.zip_file_path], processes=2,
+            shards_per_process=2, min_shard_size=1,
+        )
+        self.assertEqual(sum(shard.stop - shard.start for shard in shards), 10)
+        self.assertGreaterEqual(len(shards), 4)
+        self.assertListEqual(
+            [shard.compressed_size for shard in shards],
+            sorted(
+                (shard.compressed_size for shard in shards), reverse=True,
+            ),
+        )
+
+
+class PrefetchTestCase(TestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.zip_file_path = os.path.join(temp_dir.name, 'documents.zip')
+        with ZipFile(self.zip_file_path, 'w') as zip_file:
+            for document_num in range(8):
+                zip_file.writestr(
+                    f'{document_num}.xml',
+                    document_to_xml(generate_random_document()),
+                    # Несжатые и сжатые файлы
+                    ZIP_STORED if document_num % 2 else ZIP_DEFLATED,
+                )
+            zip_file.writestr('readme.txt', 'not a document')
+        self.shards = split_zip_file(self.zip_file_path, shard_size=1)
+
+    def test_prefetch_zip_file_shard(self):
+        for shard in self.shards:
+            prefetched_shard = prefetch_zip_file_shard(shard)
+            self.assertEqual(prefetched_shard.stop, shard.stop)
+            self.assertListEqual(
+                documents_from_zip_file_shard(prefetched_shard, False),
+                documents_from_zip_file_shard(shard, False),
+            )
+
+    def test_slow_storage(self):
+        read_delay = 0.1
+
+        def read_zip_members_range_slowly(*args):
+            time.sleep(read_delay)
+            return read_zip_members_range(*args)
+
+        # Процессы пула не читают архив: достаточно пула потоков
+        with ThreadPool(2) as pool, \
+             patch(
+                 'collector.read_zip_members_range',
+                 read_zip_members_range_slowly,
+             ):
+
+            started_at = time.perf_counter()
+            documents = [
+                document
+                for shard_documents in _imap_prefetched(
+                    pool,
+                    partial(documents_from_zip_file_shard, verbose=False),
+                    self.shards, Instrumentation(), readahead=4, io_threads=4,
+                )
+                for document in shard_documents
+            ]
+            duration = time.perf_counter() - started_at
+
+        self.assertCountEqual(
+            documents, documents_from_zip_file(self.zip_file_path, False),
+        )
+        # Чтение 8 диапазонов в 4 потоках
+        self.assertLess(duration, len(self.shards) * read_delay * 0.75)
 
 
 class CollectDocumentsInfoTestCaseMixin(object):
     # TODO: Добавить тесты краевых условий
     collector_callable = NotImplemented
+    # Небольшие архивы тестов собираются в процессах пула, как большие
+    min_pool_input_size = 0
+
+    def setUp(self):
+        patcher = patch(
+            'collector.MIN_POOL_INPUT_SIZE', self.min_pool_input_size,
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
 
     @property
     def collector(self):
@@ -44,7 +327,7 @@ class CollectDocumentsInfoTestCaseMixin(object):
                         )
 
             self.assertListEqual(
-                os.listdir(documents_dir_path), ['0.zip', '1.zip'],
+                sorted(os.listdir(documents_dir_path)), ['0.zip', '1.zip'],
             )
             documents_info_file_path = os.path.join(
                 temp_dir_path, 'documents.csv',
@@ -88,6 +371,29 @@ class CollectDocumentsInfoTestCaseMixin(object):
                     expected_objects_info | {'id,name'},
                 )
 
+    def test_instrumentation(self):
+        with tempfile.TemporaryDirectory() as documents_dir_path:
+            for zip_num in range(2):
+                with ZipFile(
+                         os.path.join(documents_dir_path, f'{zip_num}.zip'),
+                         'w',
+                     ) as zip_file:
+                    for document_num in range(2):
+                        zip_file.writestr(
+                            f'{document_num}.xml',
+                            document_to_xml(generate_random_document()),
+                        )
+
+            instrumentation = Instrumentation()
+            self.collector(
+                documents_dir_path, StringIO(), StringIO(),
+                instrumentation=instrumentation,
+            )
+
+        report = instrumentation.report()
+        self.assertEqual(report['counters'][COUNTER_DOCUMENTS], 4)
+        self.assertEqual(report['stages'][STAGE_PARSE]['count'], 4)
+
 
 class CollectDocumentsInfoSingleCoreTestCase(
     CollectDocumentsInfoTestCaseMixin, TestCase,
@@ -99,3 +405,525 @@ class CollectDocumentsInfoMultipleCoreTestCase(
     CollectDocumentsInfoTestCaseMixin, TestCase,
 ):
     collector_callable = collect_documents_info_multiple_core
+
+
+class CollectDocumentsInfoMultipleCoreInProcessTestCase(
+    CollectDocumentsInfoTestCaseMixin, TestCase,
+):
+    collector_callable = partial(
+        collect_documents_info_multiple_core, render_in_workers=True,
+        readahead=2,
+    )
+    min_pool_input_size = MIN_POOL_INPUT_SIZE
+
+    def setUp(self):
+        super().setUp()
+        # Пул процессов не запускается
+        patcher = patch('multiprocessing.Pool', side_effect=AssertionError)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+class CollectDocumentsInfoMultipleCoreRenderInWorkersTestCase(
+    CollectDocumentsInfoTestCaseMixin, TestCase,
+):
+    collector_callable = partial(
+        collect_documents_info_multiple_core, render_in_workers=True,
+    )
+
+
+class CollectDocumentsInfoMultipleCoreThreadedWritersTestCase(
+    CollectDocumentsInfoTestCaseMixin, TestCase,
+):
+    collector_callable = partial(
+        collect_documents_info_multiple_core,
+        render_in_workers=True, threaded_writers=True,
+    )
+
+
+class CollectDocumentsInfoMultipleCoreSharedPoolTestCase(
+    CollectDocumentsInfoTestCaseMixin, TestCase,
+):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # Пул запускается при запуске тестов, а не при импорте модуля
+        cls.collector_callable = partial(
+            collect_documents_info_multiple_core, pool=shared_pool(2),
+        )
+
+
+class CollectDocumentsInfoMultipleCorePrefetchedTestCase(
+    CollectDocumentsInfoTestCaseMixin, TestCase,
+):
+    collector_callable = partial(
+        collect_documents_info_multiple_core, readahead=2, io_threads=2,
+    )
+
+
+class CollectDocumentsInfoStreamingTestCase(
+    CollectDocumentsInfoTestCaseMixin, TestCase,
+):
+    collector_callable = partial(
+        collect_documents_info_streaming,
+        batch_size=1, max_in_flight_batches=1,
+    )
+
+
+class IncrementalTestCaseMixin(object):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.documents_dir_path = os.path.join(temp_dir.name, 'documents')
+        os.makedirs(self.documents_dir_path)
+        self.documents_file_path = os.path.join(temp_dir.name, 'documents.csv')
+        self.objects_file_path = os.path.join(temp_dir.name, 'objects.csv')
+
+    def write_zip_file(self, zip_file_name: str) -> Document:
+        document = generate_random_document()
+        with ZipFile(
+                 os.path.join(self.documents_dir_path, zip_file_name), 'w',
+             ) as zip_file:
+            zip_file.writestr('0.xml', document_to_xml(document))
+        return document
+
+    def collect(self):
+        return collect_documents_info_incremental(
+            self.documents_dir_path, self.documents_file_path,
+            self.objects_file_path,
+        )
+
+    def read_documents_file(self):
+        with open(self.documents_file_path, 'rt', encoding='utf-8') as fh:
+            return list(map(str.strip, fh))
+
+
+class CollectDocumentsInfoIncrementalTestCase(
+    IncrementalTestCaseMixin, TestCase,
+):
+    def test_collect_documents_info_incremental(self):
+        document_1 = self.write_zip_file('1.zip')
+        self.assertEqual(len(self.collect()), 1)
+        self.assertListEqual(
+            self.read_documents_file(),
+            ['id,level', f'{document_1.id},{document_1.level}'],
+        )
+
+        self.assertListEqual(self.collect(), [])
+
+        document_2 = self.write_zip_file('2.zip')
+        self.assertListEqual(
+            self.collect(), [os.path.join(self.documents_dir_path, '2.zip')],
+        )
+        self.assertListEqual(
+            self.read_documents_file(),
+            [
+                'id,level',
+                f'{document_1.id},{document_1.level}',
+                f'{document_2.id},{document_2.level}',
+            ],
+        )
+        with open(self.objects_file_path, 'rt', encoding='utf-8') as fh:
+            self.assertEqual(
+                len(fh.readlines()),
+                1 + len(document_1.objects) + len(document_2.objects),
+            )
+
+    def test_changed_zip_file(self):
+        zip_file_path = os.path.join(self.documents_dir_path, '1.zip')
+        documents = [generate_random_document() for _ in range(3)]
+        for documents_quantity in (2, 3):
+            with ZipFile(zip_file_path, 'w') as zip_file:
+                for document_num, document in enumerate(
+                    documents[:documents_quantity],
+                ):
+                    zip_file.writestr(
+                        f'{document_num}.xml', document_to_xml(document),
+                    )
+            self.assertListEqual(self.collect(), [zip_file_path])
+
+        self.assertListEqual(
+            sorted(self.read_documents_file()[1:]),
+            sorted(
+                f'{document.id},{document.level}' for document in documents
+            ),
+        )
+        with open(self.objects_file_path, 'rt', encoding='utf-8') as fh:
+            self.assertEqual(
+                len(fh.readlines()),
+                1 + sum(len(document.objects) for document in documents),
+            )
+
+    def test_failed_shard(self):
+        zip_file_path = os.path.join(self.documents_dir_path, '1.zip')
+        documents = [generate_random_document() for _ in range(2)]
+        with ZipFile(zip_file_path, 'w') as zip_file:
+            for document_num, document in enumerate(documents):
+                zip_file.writestr(
+                    f'{document_num}.xml', document_to_xml(document),
+                )
+
+        def fail_second_shard(shard, *args, **kwargs):
+            if shard.start == 1:
+                raise ValueError('Shard failed')
+            return document_batch_from_zip_file_shard(shard, *args, **kwargs)
+
+        fault_tolerance = FaultTolerance()
+        collect = partial(
+            collect_documents_info_incremental,
+            self.documents_dir_path, self.documents_file_path,
+            self.objects_file_path, fault_tolerance=fault_tolerance,
+        )
+        with patch(
+                 'collector.plan_zip_file_shards',
+                 partial(plan_zip_file_shards, min_shard_size=1),
+             ), \
+             patch(
+                 'collector.document_batch_from_zip_file_shard',
+                 fail_second_shard,
+             ):
+            self.assertListEqual(collect(), [])
+            self.assertEqual(len(self.read_documents_file()), 2)
+
+        # Выполненная задача не повторяется
+        self.assertListEqual(collect(), [zip_file_path])
+        self.assertListEqual(
+            sorted(self.read_documents_file()[1:]),
+            sorted(
+                f'{document.id},{document.level}' for document in documents
+            ),
+        )
+
+    def test_zip_file_appended_during_collection(self):
+        zip_file_path = os.path.join(self.documents_dir_path, '1.zip')
+        document_1 = self.write_zip_file('1.zip')
+        document_2 = generate_random_document()
+
+        def append_and_collect(*args, **kwargs):
+            with ZipFile(zip_file_path, 'a') as zip_file:
+                zip_file.writestr('1.xml', document_to_xml(document_2))
+            collect_zip_files_multiple_core(*args, **kwargs)
+
+        with patch(
+                 'collector.collect_zip_files_multiple_core',
+                 append_and_collect,
+             ):
+            self.assertListEqual(self.collect(), [zip_file_path])
+        # Архив изменился после снимка, но дописанный файл уже собран
+        self.assertListEqual(self.collect(), [zip_file_path])
+        self.assertListEqual(self.collect(), [])
+        self.assertListEqual(
+            sorted(self.read_documents_file()[1:]),
+            sorted(
+                f'{document.id},{document.level}'
+                for document in (document_1, document_2)
+            ),
+        )
+
+    def test_failed_zip_file_is_collected_later(self):
+        zip_file_path = os.path.join(self.documents_dir_path, '1.zip')
+        with open(zip_file_path, 'wb') as fh:
+            fh.write(b'not a zip file')
+        fault_tolerance = FaultTolerance()
+        collect = partial(
+            collect_documents_info_incremental,
+            self.documents_dir_path, self.documents_file_path,
+            self.objects_file_path, fault_tolerance=fault_tolerance,
+        )
+        self.assertListEqual(collect(), [])
+
+        # Ошибка прошлого сбора с тем же `fault_tolerance` не мешает
+        # записать архив в манифест
+        document = self.write_zip_file('1.zip')
+        self.assertListEqual(collect(), [zip_file_path])
+        self.assertListEqual(collect(), [])
+        self.assertListEqual(
+            self.read_documents_file(),
+            ['id,level', f'{document.id},{document.level}'],
+        )
+
+    def test_recursive(self):
+        os.makedirs(os.path.join(self.documents_dir_path, '2024', '01'))
+        self.write_zip_file('1.zip')
+        self.write_zip_file(os.path.join('2024', '01', '2.zip'))
+        self.assertEqual(
+            len(
+                collect_documents_info_incremental(
+                    self.documents_dir_path, self.documents_file_path,
+                    self.objects_file_path, recursive=True,
+                )
+            ),
+            2,
+        )
+        self.assertEqual(len(self.read_documents_file()), 3)
+
+
+class CommandLineTestCase(IncrementalTestCaseMixin, TestCase):
+    def main(self, *arguments: str) -> None:
+        main([
+            '--dir', self.documents_dir_path,
+            '--documents-file', self.documents_file_path,
+            '--objects-file', self.objects_file_path,
+            *arguments,
+        ])
+
+    def test_incremental_mode(self):
+        document_1 = self.write_zip_file('1.zip')
+        self.main('--mode', 'incremental')
+        document_2 = self.write_zip_file('2.zip')
+        self.main('--mode', 'incremental', '--processes', '1')
+        self.assertListEqual(
+            sorted(self.read_documents_file()[1:]),
+            sorted(
+                f'{document.id},{document.level}'
+                for document in (document_1, document_2)
+            ),
+        )
+
+    def test_readahead(self):
+        document = self.write_zip_file('1.zip')
+        with patch('collector.MIN_POOL_INPUT_SIZE', 0), patch(
+                 'collector._imap_isolated', wraps=_imap_isolated,
+             ) as imap_isolated:
+            self.main('--readahead', '2', '--processes', '2')
+        self.assertEqual(imap_isolated.call_args.kwargs['readahead'], 2)
+        self.assertListEqual(
+            self.read_documents_file(),
+            ['id,level', f'{document.id},{document.level}'],
+        )
+
+    def test_incremental_dedup(self):
+        document = self.write_zip_file('1.zip')
+        with patch('sys.stdout', new_callable=StringIO) as stdout:
+            self.main('--mode', 'incremental', '--dedup')
+            # Тот же документ в новом архиве (повторная доставка)
+            with ZipFile(
+                     os.path.join(self.documents_dir_path, '2.zip'), 'w',
+                 ) as zip_file:
+                zip_file.writestr('0.xml', document_to_xml(document))
+            self.main('--mode', 'incremental', '--dedup')
+        self.assertIn('Duplicate documents dropped: 1', stdout.getvalue())
+        self.assertListEqual(
+            self.read_documents_file(),
+            ['id,level', f'{document.id},{document.level}'],
+        )
+
+    def test_parse_arguments(self):
+        arguments = parse_arguments(['--format', 'columnar', '--watch'])
+        self.assertEqual(arguments.mode, 'watch')
+        self.assertEqual(arguments.dir, 'documents')
+        self.assertEqual(arguments.documents_file, 'documents.dcol')
+        self.assertEqual(arguments.objects_file, 'objects.dcol')
+
+
+class WatchDocumentsInfoTestCase(IncrementalTestCaseMixin, TestCase):
+    def test_watch_documents_info(self):
+        document_1 = self.write_zip_file('1.zip')
+        collected = []
+        stop = threading.Event()
+        watch_thread = threading.Thread(
+            target=watch_documents_info,
+            args=(
+                self.documents_dir_path, self.documents_file_path,
+                self.objects_file_path,
+            ),
+            kwargs={
+                'processes': 1, 'poll_interval': 0.1, 'stop': stop,
+                'on_collected': collected.extend,
+            },
+        )
+        watch_thread.start()
+        try:
+            # Архив дописывается под временным именем и переименовывается
+            document_2 = self.write_zip_file('2.zip.tmp')
+            os.rename(
+                os.path.join(self.documents_dir_path, '2.zip.tmp'),
+                os.path.join(self.documents_dir_path, '2.zip'),
+            )
+            deadline = time.monotonic() + 10
+            while len(collected) < 2 and time.monotonic() < deadline:
+                time.sleep(0.05)
+        finally:
+            stop.set()
+            watch_thread.join()
+
+        # Оба архива могли попасть в одну задачу
+        self.assertListEqual(
+            sorted(collected),
+            [
+                os.path.join(self.documents_dir_path, zip_file_name)
+                for zip_file_name in ('1.zip', '2.zip')
+            ],
+        )
+        header, *rows = self.read_documents_file()
+        self.assertEqual(header, 'id,level')
+        self.assertListEqual(
+            sorted(rows),
+            sorted(
+                f'{document.id},{document.level}'
+                for document in (document_1, document_2)
+            ),
+        )
+        # Обработанные архивы записаны в манифест
+        self.assertListEqual(self.collect(), [])
+
+    def test_broken_zip_file(self):
+        broken_zip_file_path = os.path.join(
+            self.documents_dir_path, 'broken.zip',
+        )
+        with open(broken_zip_file_path, 'wb') as fh:
+            fh.write(b'not a zip file')
+        watch = partial(
+            watch_documents_info,
+            self.documents_dir_path, self.documents_file_path,
+            self.objects_file_path, processes=1, poll_interval=0.1,
+            incomplete_timeout=0.2,
+        )
+        with self.assertRaises(BadZipFile):
+            watch()
+
+        fault_tolerance = FaultTolerance()
+        stop = threading.Event()
+        watch_thread = threading.Thread(
+            target=watch,
+            kwargs={'stop': stop, 'fault_tolerance': fault_tolerance},
+        )
+        watch_thread.start()
+        try:
+            deadline = time.monotonic() + 10
+            while (
+                not fault_tolerance.errors and time.monotonic() < deadline
+            ):
+                time.sleep(0.05)
+        finally:
+            stop.set()
+            watch_thread.join()
+        self.assertSetEqual(
+            fault_tolerance.failed_zip_file_paths, {broken_zip_file_path},
+        )
+
+    def test_pool_is_recreated_after_timeout(self):
+        self.write_zip_file('hang.zip')
+        fault_tolerance = FaultTolerance(max_attempts=1, task_timeout=0.5)
+        collected = []
+        stop = threading.Event()
+        watch_thread = threading.Thread(
+            target=watch_documents_info,
+            args=(
+                self.documents_dir_path, self.documents_file_path,
+                self.objects_file_path,
+            ),
+            kwargs={
+                'processes': 1, 'poll_interval': 0.1, 'stop': stop,
+                'on_collected': collected.extend,
+                'fault_tolerance': fault_tolerance,
+            },
+        )
+
+        def wait_for(condition):
+            deadline = time.monotonic() + 10
+            while not condition() and time.monotonic() < deadline:
+                time.sleep(0.05)
+
+        # Процесс пула, занятый задачей hang.zip, не освобождается
+        with patch(
+                 'collector.document_batch_from_zip_file_shard',
+                 hang_on_hang_zip_file,
+             ):
+            watch_thread.start()
+            try:
+                wait_for(lambda: fault_tolerance.timeouts)
+                # Две следующие обработки идут в новом пуле
+                for zip_file_num in (1, 2):
+                    self.write_zip_file(f'{zip_file_num}.zip')
+                    wait_for(lambda: len(collected) == zip_file_num)
+            finally:
+                stop.set()
+                watch_thread.join()
+
+        self.assertListEqual(
+            collected,
+            [
+                os.path.join(self.documents_dir_path, zip_file_name)
+                for zip_file_name in ('1.zip', '2.zip')
+            ],
+        )
+        self.assertEqual(fault_tolerance.timeouts, 1)
+
+
+def hang_on_hang_zip_file(shard, *args, **kwargs):
+    """ Задача, которая не укладывается в срок для архива hang.zip """
+    if shard.zip_file_path.endswith('hang.zip'):
+        time.sleep(60)
+    return document_batch_from_zip_file_shard(shard, *args, **kwargs)
+
+
+class CollectDocumentsInfoResumableTestCase(TestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.documents_dir_path = os.path.join(temp_dir.name, 'documents')
+        os.makedirs(self.documents_dir_path)
+        self.documents_file_path = os.path.join(temp_dir.name, 'documents.csv')
+        self.objects_file_path = os.path.join(temp_dir.name, 'objects.csv')
+        self.checkpoint_path = os.path.join(temp_dir.name, 'checkpoint.json')
+        # Небольшие архивы тестов собираются в процессах пула
+        patcher = patch('collector.MIN_POOL_INPUT_SIZE', 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.documents = []
+        for zip_num in range(3):
+            document = generate_random_document()
+            self.documents.append(document)
+            with ZipFile(
+                     os.path.join(self.documents_dir_path, f'{zip_num}.zip'),
+                     'w',
+                 ) as zip_file:
+                zip_file.writestr('0.xml', document_to_xml(document))
+
+    def collect(self, resume: bool = False) -> None:
+        collect_documents_info_resumable(
+            self.documents_dir_path, self.documents_file_path,
+            self.objects_file_path, self.checkpoint_path, resume,
+            verbose=False,
+        )
+
+    def assertDocumentsCollected(self):
+        with open(self.documents_file_path, 'rt', encoding='utf-8') as fh:
+            self.assertListEqual(
+                sorted(map(str.strip, fh)),
+                sorted(
+                    [f'{document.id},{document.level}'
+                     for document in self.documents] + ['id,level']
+                ),
+            )
+        self.assertFalse(os.path.exists(self.checkpoint_path))
+
+    def test_collect_documents_info_resumable(self):
+        self.collect()
+        self.assertDocumentsCollected()
+
+    def test_resume_after_interruption(self):
+        shards = plan_zip_file_shards(
+            os.path.join(self.documents_dir_path, f'{zip_num}.zip')
+            for zip_num in range(3)
+        )
+        # Первая задача попала в контрольную точку, вторая была записана
+        # только частично
+        with open(self.documents_file_path, 'wb') as docs_fh, \
+             open(self.objects_file_path, 'wb') as objs_fh:
+            for output_file, header, fragment in zip(
+                (docs_fh, objs_fh), ('id,level\r\n', 'id,name\r\n'),
+                fragments_from_zip_file_shard(
+                    shards[0], documents_to_csv_fragments, verbose=False,
+                ),
+            ):
+                output_file.write(f'{header}{fragment}'.encode('utf-8'))
+            offsets = [docs_fh.tell(), objs_fh.tell()]
+            docs_fh.write(b'partial,row')
+            objs_fh.write(b'partial,row')
+        Checkpoint(self.checkpoint_path, shards, {0}, offsets).save()
+
+        self.collect(resume=True)
+        self.assertDocumentsCollected()
@@ -0,0 +1,97 @@
+import os
+import tempfile
+import uuid
+from unittest import TestCase
+
+from dedup import BloomFilter, IdIndex, pack_id
+
+
+class PackIdTestCase(TestCase):
+    def test_uuid(self):
+        id_ = uuid.uuid4()
+        self.assertEqual(pack_id(str(id_)), id_.bytes)
+
+    def test_not_uuid(self):
+        id_ = str(uuid.uuid4())
+        packed_ids = {
+            pack_id(other_id)
+            for other_id in (id_, id_.upper(), 'документ', '')
+        }
+        self.assertEqual(len(packed_ids), 4)
+        self.assertSetEqual({len(packed_id) for packed_id in packed_ids}, {16})
+
+    def test_none(self):
+        self.assertIsNone(pack_id(None))
+
+
+class BloomFilterTestCase(TestCase):
+    def test_no_false_negatives(self):
+        bloom_filter = BloomFilter(1000, 0.01)
+        keys = [uuid.uuid4().bytes for _ in range(2000)]
+        for key in keys[:1000]:
+            bloom_filter.add(key)
+        self.assertTrue(all(key in bloom_filter for key in keys[:1000]))
+        false_positives = sum(key in bloom_filter for key in keys[1000:])
+        self.assertLess(false_positives, 50)
+
+
+class IdIndexTestCase(TestCase):
+    def check_index(self, index):
+        keys = [uuid.uuid4().bytes for _ in range(1000)]
+        self.assertTrue(all(map(index.add, keys)))
+        self.assertFalse(any(map(index.add, keys)))
+        self.assertEqual(len(index), 1000)
+        self.assertEqual(index.duplicates, 1000)
+        self.assertNotIn(uuid.uuid4().bytes, index)
+
+    def test_in_memory(self):
+        with IdIndex() as index:
+            self.check_index(index)
+
+    def test_runs(self):
+        with IdIndex(max_memory_ids=64, expected_ids=0) as index:
+            self.check_index(index)
+            # Прогоны сливаются как в двоичном счетчике
+            self.assertLessEqual(len(index._runs), 5)
+
+    def test_spill_dir(self):
+        with tempfile.TemporaryDirectory() as spill_dir, \
+             IdIndex(max_memory_ids=64, spill_dir=spill_dir) as index:
+
+            self.check_index(index)
+
+    def test_add_id(self):
+        with IdIndex() as index:
+            self.assertTrue(index.add_id('a'))
+            self.assertFalse(index.add_id('a'))
+            self.assertTrue(index.add_id(None))
+            self.assertTrue(index.add_id(None))
+
+    def check_save_load(self, **kwargs):
+        keys = [uuid.uuid4().bytes for _ in range(1000)]
+        with tempfile.TemporaryDirectory() as dir_path:
+            path = os.path.join(dir_path, 'index')
+            with IdIndex(max_memory_ids=64, **kwargs) as index:
+                for key in keys[:500]:
+                    index.add(key)
+                index.save(path)
+            self.assertEqual(os.path.getsize(path), 500 * 16)
+
+            with IdIndex.load(path, max_memory_ids=64, **kwargs) as index:
+                self.assertEqual(len(index), 500)
+                self.assertFalse(any(map(index.add, keys[:500])))
+                self.assertTrue(all(map(index.add, keys[500:])))
+
+    def test_save_load(self):
+        self.check_save_load()
+
+    def test_save_load_spill_dir(self):
+        with tempfile.TemporaryDirectory() as spill_dir:
+            self.check_save_load(spill_dir=spill_dir, expected_ids=0)
+
+    def test_load_missing(self):
+        with tempfile.TemporaryDirectory() as dir_path, \
+             IdIndex.load(os.path.join(dir_path, 'index')) as index:
+
+            self.assertEqual(len(index), 0)
+            self.assertTrue(index.add_id('a'))
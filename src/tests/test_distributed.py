@@ -0,0 +1,284 @@
+import gzip
+import json
+import os
+import tempfile
+import time
+from io import StringIO
+from unittest import TestCase
+from unittest.mock import patch
+from zipfile import ZipFile
+
+from collector import collect_documents_info_single_core
+from distributed import (
+    CLAIMED_DIR_NAME, PARTS_DIR_NAME, PENDING_DIR_NAME, claim_task,
+    collect_documents_distributed, complete_task, merge_distributed_outputs,
+    plan_distributed_collection, requeue_stale_tasks, run_task,
+    run_worker_node, _read_json, _write_json,
+)
+from generator import document_to_xml, generate_random_document
+
+
+class DistributedTestCase(TestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.temp_dir_path = temp_dir.name
+        self.documents_dir_path = os.path.join(temp_dir.name, 'documents')
+        self.work_dir_path = os.path.join(temp_dir.name, 'work')
+        os.makedirs(self.documents_dir_path)
+        for zip_num in range(5):
+            with ZipFile(
+                     os.path.join(self.documents_dir_path, f'{zip_num}.zip'),
+                     'w',
+                 ) as zip_file:
+                for document_num in range(zip_num + 1):
+                    zip_file.writestr(
+                        f'{document_num}.xml',
+                        document_to_xml(generate_random_document()),
+                    )
+
+        documents_file, objects_file = StringIO(), StringIO()
+        collect_documents_info_single_core(
+            self.documents_dir_path, documents_file, objects_file,
+        )
+        self.expected = [
+            self.sorted_rows(file.getvalue()) for file in (
+                documents_file, objects_file,
+            )
+        ]
+
+    @staticmethod
+    def sorted_rows(text: str):
+        header, *rows = text.splitlines()
+        return [header] + sorted(rows)
+
+    def read_outputs(self, documents_file_path, objects_file_path):
+        outputs = []
+        for file_path in (documents_file_path, objects_file_path):
+            with open(file_path, 'rt', encoding='utf-8', newline='') as file:
+                outputs.append(self.sorted_rows(file.read()))
+        return outputs
+
+    def test_collect_documents_distributed(self):
+        documents_file_path = os.path.join(self.temp_dir_path, 'd.csv')
+        objects_file_path = os.path.join(self.temp_dir_path, 'o.csv')
+        collect_documents_distributed(
+            self.documents_dir_path, documents_file_path, objects_file_path,
+            self.work_dir_path, nodes=2, tasks_quantity=3, verbose=False,
+        )
+        self.assertListEqual(
+            self.read_outputs(documents_file_path, objects_file_path),
+            self.expected,
+        )
+
+    def test_plan_balances_tasks(self):
+        self.assertEqual(
+            plan_distributed_collection(
+                self.documents_dir_path, self.work_dir_path, 10,
+            ),
+            5,
+        )
+        with self.assertRaises(FileExistsError):
+            plan_distributed_collection(
+                self.documents_dir_path, self.work_dir_path, 2,
+            )
+
+        work_dir_path = os.path.join(self.temp_dir_path, 'work_3')
+        plan_distributed_collection(
+            self.documents_dir_path, work_dir_path, 3,
+        )
+        zip_file_paths = []
+        for task_num in range(1, 4):
+            with open(
+                     os.path.join(
+                         work_dir_path, PENDING_DIR_NAME,
+                         f'task-{task_num:05d}.json',
+                     ),
+                 ) as task_file:
+                task_zip_file_paths = json.load(task_file)['zip_file_paths']
+            self.assertTrue(task_zip_file_paths)
+            zip_file_paths.extend(task_zip_file_paths)
+        self.assertListEqual(
+            sorted(zip_file_paths), [f'{num}.zip' for num in range(5)],
+        )
+
+    def test_claim_task_once(self):
+        plan_distributed_collection(
+            self.documents_dir_path, self.work_dir_path, 2,
+        )
+        claimed = [claim_task(self.work_dir_path) for _ in range(3)]
+        self.assertListEqual(
+            claimed, ['task-00001.json', 'task-00002.json', None],
+        )
+
+    def test_requeue_stale_tasks(self):
+        plan_distributed_collection(
+            self.documents_dir_path, self.work_dir_path, 2,
+        )
+        task_file_name = claim_task(self.work_dir_path)
+        self.assertListEqual(requeue_stale_tasks(self.work_dir_path, 60), [])
+
+        claimed_path = os.path.join(
+            self.work_dir_path, CLAIMED_DIR_NAME, task_file_name,
+        )
+        stale_time = time.time() - 120
+        os.utime(claimed_path, (stale_time, stale_time))
+        self.assertListEqual(
+            requeue_stale_tasks(self.work_dir_path, 60), [task_file_name],
+        )
+        self.assertIn(
+            task_file_name,
+            os.listdir(os.path.join(self.work_dir_path, PENDING_DIR_NAME)),
+        )
+
+    def test_expired_claim_race(self):
+        plan_distributed_collection(
+            self.documents_dir_path, self.work_dir_path, 1,
+        )
+        task_file_name = claim_task(self.work_dir_path, 'node-a')
+        claimed_path = os.path.join(
+            self.work_dir_path, CLAIMED_DIR_NAME, task_file_name,
+        )
+        stale_time = time.time() - 120
+        os.utime(claimed_path, (stale_time, stale_time))
+        requeue_stale_tasks(self.work_dir_path, 60)
+        self.assertEqual(
+            claim_task(self.work_dir_path, 'node-b'), task_file_name,
+        )
+
+        # Первый узел закончил после того, как задачу взял второй: его
+        # результаты отбрасываются, а задача остается за вторым узлом
+        self.assertFalse(
+            run_task(
+                self.work_dir_path, task_file_name, processes=1,
+                owner='node-a',
+            ),
+        )
+        self.assertListEqual(
+            os.listdir(os.path.join(self.work_dir_path, PARTS_DIR_NAME)), [],
+        )
+        self.assertFalse(
+            complete_task(self.work_dir_path, task_file_name, 'node-a'),
+        )
+        self.assertTrue(os.path.exists(claimed_path))
+
+        self.assertTrue(
+            run_task(
+                self.work_dir_path, task_file_name, processes=1,
+                owner='node-b',
+            ),
+        )
+        self.assertTrue(
+            complete_task(self.work_dir_path, task_file_name, 'node-b'),
+        )
+        documents_file_path = os.path.join(self.temp_dir_path, 'd.csv')
+        objects_file_path = os.path.join(self.temp_dir_path, 'o.csv')
+        merge_distributed_outputs(
+            self.work_dir_path, documents_file_path, objects_file_path,
+        )
+        self.assertListEqual(
+            self.read_outputs(documents_file_path, objects_file_path),
+            self.expected,
+        )
+
+    def test_stale_owner_during_claim(self):
+        plan_distributed_collection(
+            self.documents_dir_path, self.work_dir_path, 1,
+        )
+        task_file_name = claim_task(self.work_dir_path, 'node-a')
+        claimed_path = os.path.join(
+            self.work_dir_path, CLAIMED_DIR_NAME, task_file_name,
+        )
+        stale_time = time.time() - 120
+        os.utime(claimed_path, (stale_time, stale_time))
+        requeue_stale_tasks(self.work_dir_path, 60)
+
+        # Пока второй узел записывает свой токен, первый узел не может
+        # завершить задачу по токену, оставшемуся в файле
+        completed_by_stale_owner = []
+
+        def write_json(path, value, owner=None):
+            completed_by_stale_owner.append(
+                complete_task(self.work_dir_path, task_file_name, 'node-a'),
+            )
+            _write_json(path, value, owner)
+
+        with patch('distributed._write_json', write_json):
+            self.assertEqual(
+                claim_task(self.work_dir_path, 'node-b'), task_file_name,
+            )
+        self.assertListEqual(completed_by_stale_owner, [False])
+        self.assertFalse(
+            complete_task(self.work_dir_path, task_file_name, 'node-a'),
+        )
+        self.assertTrue(
+            complete_task(self.work_dir_path, task_file_name, 'node-b'),
+        )
+
+    def test_claim_requeued_while_claiming(self):
+        plan_distributed_collection(
+            self.documents_dir_path, self.work_dir_path, 1,
+        )
+
+        def read_json(path):
+            # Другой узел возвращает задачу в очередь, пока ее берут
+            requeue_stale_tasks(self.work_dir_path, 0)
+            return _read_json(path)
+
+        with patch('distributed._read_json', read_json):
+            self.assertIsNone(claim_task(self.work_dir_path, 'node-a'))
+        self.assertListEqual(
+            os.listdir(os.path.join(self.work_dir_path, CLAIMED_DIR_NAME)),
+            [],
+        )
+        task_file_name = claim_task(self.work_dir_path, 'node-b')
+        self.assertIsNotNone(task_file_name)
+        self.assertTrue(
+            complete_task(self.work_dir_path, task_file_name, 'node-b'),
+        )
+
+    def test_merge_requires_all_tasks(self):
+        plan_distributed_collection(
+            self.documents_dir_path, self.work_dir_path, 2,
+        )
+        documents_file_path = os.path.join(self.temp_dir_path, 'd.csv')
+        objects_file_path = os.path.join(self.temp_dir_path, 'o.csv')
+        with self.assertRaises(RuntimeError):
+            merge_distributed_outputs(
+                self.work_dir_path, documents_file_path, objects_file_path,
+            )
+
+        # Узел в этом процессе выполняет все задачи
+        self.assertEqual(
+            len(run_worker_node(
+                self.work_dir_path, processes=1, verbose=False,
+            )),
+            2,
+        )
+        merge_distributed_outputs(
+            self.work_dir_path, documents_file_path, objects_file_path,
+        )
+        self.assertListEqual(
+            self.read_outputs(documents_file_path, objects_file_path),
+            self.expected,
+        )
+
+    def test_compressed_outputs(self):
+        plan_distributed_collection(
+            self.documents_dir_path, self.work_dir_path, 2,
+            compression='gzip',
+        )
+        run_worker_node(self.work_dir_path, processes=1, verbose=False)
+        documents_file_path = os.path.join(self.temp_dir_path, 'd.csv.gz')
+        objects_file_path = os.path.join(self.temp_dir_path, 'o.csv.gz')
+        merge_distributed_outputs(
+            self.work_dir_path, documents_file_path, objects_file_path,
+        )
+
+        outputs = []
+        for file_path in (documents_file_path, objects_file_path):
+            with gzip.open(
+                     file_path, 'rt', encoding='utf-8', newline='',
+                 ) as file:
+                outputs.append(self.sorted_rows(file.read()))
+        self.assertListEqual(outputs, self.expected)
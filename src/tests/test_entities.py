@@ -0,0 +1,71 @@
+import pickle
+from unittest import TestCase
+
+from entities import Document, DocumentBatch, DocumentObject, StringColumn
+from generator import generate_random_document
+
+
+class StringColumnTestCase(TestCase):
+    def test_values(self):
+        values = ['a', None, '', 'документ']
+        column = StringColumn(values)
+        self.assertEqual(len(column), 4)
+        self.assertListEqual(list(column), values)
+        self.assertEqual(column[-1], 'документ')
+        self.assertListEqual(list(column.take([3, 1])), ['документ', None])
+
+
+class DocumentBatchTestCase(TestCase):
+    def setUp(self):
+        self.documents = [generate_random_document() for _ in range(5)]
+        for document in self.documents:
+            document.level = str(document.level)
+        self.documents.append(
+            Document(id_=None, level=None, objects=[DocumentObject(None)]),
+        )
+
+    def test_documents_view(self):
+        batch = DocumentBatch.from_documents(self.documents)
+        self.assertEqual(len(batch), len(self.documents))
+        self.assertListEqual(list(batch), self.documents)
+        self.assertEqual(batch[-1], self.documents[-1])
+        self.assertEqual(
+            len(batch.object_names),
+            sum(len(document.objects) for document in self.documents),
+        )
+
+    def test_levels_are_strings(self):
+        batch = DocumentBatch()
+        batch.append('id', 7, ['name'])
+        self.assertEqual(
+            batch[0], Document('id', '7', [DocumentObject('name')]),
+        )
+
+    def test_truncate(self):
+        batch = DocumentBatch.from_documents(self.documents)
+        batch.truncate(2)
+        self.assertListEqual(list(batch), self.documents[:2])
+        batch.append_document(self.documents[5])
+        self.assertListEqual(
+            list(batch), self.documents[:2] + self.documents[5:],
+        )
+
+    def test_take(self):
+        batch = DocumentBatch.from_documents(self.documents).take([4, 0])
+        self.assertListEqual(
+            list(batch), [self.documents[4], self.documents[0]],
+        )
+        self.assertListEqual(
+            list(batch.object_document_ids()),
+            [self.documents[4].id] * len(self.documents[4].objects)
+            + [self.documents[0].id] * len(self.documents[0].objects),
+        )
+
+    def test_pickle(self):
+        documents = [generate_random_document() for _ in range(100)]
+        for document in documents:
+            document.level = str(document.level)
+        batch = DocumentBatch.from_documents(documents)
+        data = pickle.dumps(batch)
+        self.assertListEqual(list(pickle.loads(data)), documents)
+        self.assertLess(len(data), len(pickle.dumps(documents)))
@@ -0,0 +1,266 @@
+import json
+import os
+import tempfile
+import time
+from io import BytesIO
+from unittest import TestCase
+from unittest.mock import patch
+from zipfile import ZipFile
+
+from collector import (
+    ZipFileShard, collect_documents_info_incremental,
+    collect_zip_files_multiple_core, _fault_tolerant_pool, _imap_isolated,
+)
+from faults import FaultTolerance, call_isolated
+from generator import document_to_xml, generate_random_document
+from instrumentation import NULL_INSTRUMENTATION
+from sinks import CsvSink
+
+
+def fail_once(marker_path: str) -> str:
+    """ Ошибка ввода-вывода при первой попытке """
+    if not os.path.exists(marker_path):
+        open(marker_path, 'w').close()
+        raise OSError('Temporary failure')
+    return marker_path
+
+
+def exit_worker(argument: str) -> str:
+    if argument == 'crash':
+        # Как завершение процесса из-за нехватки памяти
+        os._exit(1)
+    return argument
+
+
+def raise_value_error(argument: str) -> str:
+    raise ValueError(argument)
+
+
+def _shard(argument: str) -> ZipFileShard:
+    return ZipFileShard(argument, 0, 0, 0)
+
+
+class FaultToleranceTestCase(TestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.temp_dir_path = temp_dir.name
+        self.documents_dir_path = os.path.join(temp_dir.name, 'documents')
+        os.makedirs(self.documents_dir_path)
+
+        self.documents = []
+        for zip_file_num in range(3):
+            with ZipFile(
+                     os.path.join(
+                         self.documents_dir_path, f'{zip_file_num}.zip',
+                     ),
+                     'w',
+                 ) as zip_file:
+                for document_num in range(2):
+                    document = generate_random_document()
+                    self.documents.append(document)
+                    zip_file.writestr(
+                        f'{document_num}.xml', document_to_xml(document),
+                    )
+                if zip_file_num == 0:
+                    zip_file.writestr('bad.xml', '<root><objects>')
+
+        self.bad_zip_file_path = os.path.join(
+            self.documents_dir_path, 'bad.zip',
+        )
+        with open(self.bad_zip_file_path, 'wb') as bad_zip_file:
+            bad_zip_file.write(b'not a zip file')
+
+        self.zip_file_paths = sorted(
+            os.path.join(self.documents_dir_path, file_name)
+            for file_name in os.listdir(self.documents_dir_path)
+        )
+        self.report_path = os.path.join(self.temp_dir_path, 'errors.jsonl')
+        self.quarantine_dir_path = os.path.join(
+            self.temp_dir_path, 'quarantine',
+        )
+        # Небольшие архивы тестов собираются в процессах пула
+        patcher = patch('collector.MIN_POOL_INPUT_SIZE', 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def collect(self, fault_tolerance: FaultTolerance = None, **options):
+        documents_file, objects_file = BytesIO(), BytesIO()
+        with CsvSink(documents_file, objects_file) as sink:
+            collect_zip_files_multiple_core(
+                self.zip_file_paths, sink, processes=2,
+                fault_tolerance=fault_tolerance, **options,
+            )
+        return documents_file.getvalue().decode('utf-8').splitlines()[1:]
+
+    def test_bad_archives_do_not_stop_collection(self):
+        with FaultTolerance(
+            self.report_path, self.quarantine_dir_path,
+        ) as fault_tolerance:
+            rows = self.collect(fault_tolerance)
+
+        self.assertListEqual(
+            sorted(rows),
+            sorted(
+                f'{document.id},{document.level}'
+                for document in self.documents
+            ),
+        )
+        self.assertListEqual(
+            sorted(
+                (error.zip_file_path, error.member)
+                for error in fault_tolerance.errors
+            ),
+            [
+                (os.path.join(self.documents_dir_path, '0.zip'), 'bad.xml'),
+                (self.bad_zip_file_path, None),
+            ],
+        )
+        self.assertEqual(fault_tolerance.failed_tasks, 1)
+        self.assertSetEqual(
+            fault_tolerance.failed_zip_file_paths, {self.bad_zip_file_path},
+        )
+        with open(self.report_path, 'rt', encoding='utf-8') as report_file:
+            report = [json.loads(line) for line in report_file]
+        self.assertListEqual(
+            sorted(error['error'].split(':')[0] for error in report),
+            ['BadZipFile', 'XMLSyntaxError'],
+        )
+        self.assertListEqual(
+            sorted(os.listdir(self.quarantine_dir_path)), ['0.zip', 'bad.zip'],
+        )
+
+    def test_readahead(self):
+        with FaultTolerance() as fault_tolerance:
+            rows = self.collect(fault_tolerance, readahead=2, io_threads=2)
+
+        self.assertListEqual(
+            sorted(rows),
+            sorted(
+                f'{document.id},{document.level}'
+                for document in self.documents
+            ),
+        )
+        # Архив без каталога не читается уже в потоке чтения
+        self.assertListEqual(
+            sorted(
+                (error.zip_file_path, error.member)
+                for error in fault_tolerance.errors
+            ),
+            [
+                (os.path.join(self.documents_dir_path, '0.zip'), 'bad.xml'),
+                (self.bad_zip_file_path, None),
+            ],
+        )
+        self.assertEqual(fault_tolerance.failed_tasks, 1)
+
+    def test_fail_fast_without_fault_tolerance(self):
+        os.remove(self.bad_zip_file_path)
+        self.zip_file_paths.remove(self.bad_zip_file_path)
+        with self.assertRaises(Exception):
+            self.collect()
+
+    def test_incremental_skips_failed_archives(self):
+        with FaultTolerance() as fault_tolerance:
+            zip_file_paths = collect_documents_info_incremental(
+                self.documents_dir_path,
+                os.path.join(self.temp_dir_path, 'documents.csv'),
+                os.path.join(self.temp_dir_path, 'objects.csv'),
+                processes=1, fault_tolerance=fault_tolerance,
+            )
+        # Архив с ошибкой в файле собран, архив без каталога — нет
+        self.assertListEqual(
+            sorted(zip_file_paths),
+            [
+                os.path.join(self.documents_dir_path, f'{num}.zip')
+                for num in range(3)
+            ],
+        )
+
+
+class ImapIsolatedTestCase(TestCase):
+    def imap(
+        self, task, arguments, fault_tolerance, processes=2, **options,
+    ):
+        with _fault_tolerant_pool(None, processes, fault_tolerance) as pool:
+            return sorted(
+                _imap_isolated(
+                    pool, task, arguments, NULL_INSTRUMENTATION,
+                    fault_tolerance, processes, _shard, **options,
+                ),
+            )
+
+    def test_retry_transient_errors(self):
+        with tempfile.TemporaryDirectory() as temp_dir_path:
+            marker_paths = [
+                os.path.join(temp_dir_path, str(num)) for num in range(3)
+            ]
+            fault_tolerance = FaultTolerance(max_attempts=2)
+            self.assertListEqual(
+                self.imap(fail_once, marker_paths, fault_tolerance),
+                marker_paths,
+            )
+            self.assertListEqual(fault_tolerance.errors, [])
+
+            for marker_path in marker_paths:
+                os.remove(marker_path)
+            fault_tolerance = FaultTolerance(max_attempts=1)
+            self.assertListEqual(
+                self.imap(fail_once, marker_paths, fault_tolerance), [],
+            )
+            self.assertEqual(fault_tolerance.failed_tasks, 3)
+
+    def test_retry_read_errors(self):
+        with tempfile.TemporaryDirectory() as temp_dir_path:
+            marker_paths = [
+                os.path.join(temp_dir_path, str(num)) for num in range(3)
+            ]
+            fault_tolerance = FaultTolerance(max_attempts=2)
+            # Аргументы читаются в потоках родительского процесса
+            self.assertListEqual(
+                self.imap(
+                    exit_worker, marker_paths, fault_tolerance,
+                    readahead=2, read=fail_once,
+                ),
+                marker_paths,
+            )
+            self.assertListEqual(fault_tolerance.errors, [])
+
+    def test_permanent_errors_are_not_retried(self):
+        fault_tolerance = FaultTolerance(max_attempts=3)
+        self.assertListEqual(
+            self.imap(raise_value_error, ['a'], fault_tolerance), [],
+        )
+        self.assertListEqual(
+            [
+                (error.error, error.attempts)
+                for error in fault_tolerance.errors
+            ],
+            [('ValueError: a', 1)],
+        )
+
+    def test_worker_crash_times_out(self):
+        fault_tolerance = FaultTolerance(max_attempts=2, task_timeout=0.5)
+        started_at = time.monotonic()
+        self.assertListEqual(
+            self.imap(exit_worker, ['a', 'crash', 'b'], fault_tolerance),
+            ['a', 'b'],
+        )
+        self.assertLess(time.monotonic() - started_at, 10)
+        self.assertEqual(fault_tolerance.timeouts, 2)
+        self.assertListEqual(
+            [
+                (error.zip_file_path, error.attempts)
+                for error in fault_tolerance.errors
+            ],
+            [('crash', 2)],
+        )
+
+
+class CallIsolatedTestCase(TestCase):
+    def test_call_isolated(self):
+        outcome = call_isolated(raise_value_error, 'a')
+        self.assertIsNone(outcome.result)
+        self.assertEqual(outcome.error, 'ValueError: a')
+        self.assertFalse(outcome.transient)
+        self.assertEqual(call_isolated(exit_worker, 'a').result, 'a')
@@ -1,14 +1,18 @@
 import os
 import tempfile
+import uuid
 from unittest import TestCase, mock
-from zipfile import ZipFile
+from zipfile import ZIP_DEFLATED, ZIP_LZMA, ZIP_STORED, ZipFile
 
+from collector import document_from_xml
 from entities import Document, DocumentObject
 from generator import (
-    generate_random_document, document_to_xml,
-    # generate_zip_file_with_random_documents,
+    generate_random_document, generate_random_documents, document_to_xml,
+    document_to_xml_fast, random_uuid4_strings,
+    generate_zip_file_with_random_documents,
     generate_zip_files_with_random_documents,
 )
+from instrumentation import COUNTER_BYTES, COUNTER_DOCUMENTS, Instrumentation
 from utils import filter_file_names, filter_file_paths
 
 
@@ -64,7 +68,55 @@ class DocumentToXmlTestCase(TestCase):
         self.assertEqual(xml, expected_xml)
 
 
-# TODO: Дописать тесты для `generate_zip_file_with_random_documents`
+class RandomUuid4StringsTestCase(TestCase):
+    def test_random_uuid4_strings(self):
+        uuids = random_uuid4_strings(100)
+        self.assertEqual(len(set(uuids)), 100)
+        for uuid_string in uuids:
+            parsed_uuid = uuid.UUID(uuid_string)
+            self.assertEqual(str(parsed_uuid), uuid_string)
+            self.assertEqual(parsed_uuid.version, 4)
+            self.assertEqual(parsed_uuid.variant, uuid.RFC_4122)
+
+
+class GenerateRandomDocumentsTestCase(TestCase):
+    def test_generate_random_documents(self):
+        documents = generate_random_documents(
+            10, min_level=3, max_level=4,
+            min_objects_quantity=1, max_objects_quantity=2,
+        )
+        self.assertEqual(len(documents), 10)
+        for document in documents:
+            self.assertIn(document.level, (3, 4))
+            self.assertIn(len(document.objects), (1, 2))
+
+
+class DocumentToXmlFastTestCase(TestCase):
+    def test_document_to_xml_fast(self):
+        for objects_quantity in range(4):
+            document = generate_random_document(
+                min_objects_quantity=objects_quantity,
+                max_objects_quantity=objects_quantity,
+            )
+            self.assertEqual(
+                document_to_xml_fast(document), document_to_xml(document),
+            )
+
+
+class GenerateZipFileWithRandomDocumentsTestCase(TestCase):
+    def test_generate_zip_file_with_random_documents(self):
+        for template_name in (None, 'document.xml'):
+            with self.subTest(template_name=template_name), \
+                 tempfile.TemporaryDirectory() as temp_dir_path:
+                zip_file_path = os.path.join(temp_dir_path, 'documents.zip')
+                generate_zip_file_with_random_documents(
+                    zip_file_path, 3, verbose=False,
+                    template_name=template_name,
+                )
+                with ZipFile(zip_file_path, 'r') as zip_file:
+                    self.assertListEqual(
+                        zip_file.namelist(), ['0.xml', '1.xml', '2.xml'],
+                    )
 
 
 class GenerateZipFilesWithRandomDocumentsTestCase(TestCase):
@@ -100,3 +152,45 @@ class GenerateZipFilesWithRandomDocumentsTestCase(TestCase):
                         documents_per_zip_file,
                     )
 
+
+class GenerateCompressedZipFilesTestCase(TestCase):
+    def test_compression(self):
+        for compression in (ZIP_STORED, ZIP_DEFLATED, ZIP_LZMA):
+            with self.subTest(compression=compression), \
+                 tempfile.TemporaryDirectory() as temp_dir_path:
+                instrumentation = Instrumentation()
+                # Архивы из нескольких пачек и из неполной пачки
+                generate_zip_files_with_random_documents(
+                    temp_dir_path, 3, 5, verbose=False, processes=2,
+                    compression=compression, batch_size=2,
+                    max_pending_batches=3, instrumentation=instrumentation,
+                )
+                self.assertEqual(instrumentation.total(COUNTER_DOCUMENTS), 15)
+                self.assertEqual(
+                    instrumentation.total(COUNTER_BYTES),
+                    sum(
+                        os.path.getsize(zip_file_path)
+                        for zip_file_path in filter_file_paths(temp_dir_path)
+                    ),
+                )
+                for zip_file_path in filter_file_paths(temp_dir_path, 'zip'):
+                    with ZipFile(zip_file_path) as zip_file:
+                        self.assertIsNone(zip_file.testzip())
+                        self.assertListEqual(
+                            zip_file.namelist(),
+                            [f'{num}.xml' for num in range(5)],
+                        )
+                        for zip_info in zip_file.infolist():
+                            self.assertEqual(
+                                zip_info.compress_type, compression,
+                            )
+                            document_from_xml(zip_file.read(zip_info))
+
+    def test_error_removes_partial_zip_file(self):
+        with tempfile.TemporaryDirectory() as temp_dir_path:
+            with self.assertRaises(NotImplementedError):
+                generate_zip_files_with_random_documents(
+                    temp_dir_path, 2, 3, verbose=False, processes=1,
+                    compression=-1,
+                )
+            self.assertListEqual(os.listdir(temp_dir_path), [])
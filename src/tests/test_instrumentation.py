@@ -0,0 +1,69 @@
+from io import StringIO
+from unittest import TestCase
+
+from instrumentation import (
+    COUNTER_DOCUMENTS, MAIN_WORKER, NULL_INSTRUMENTATION, STAGE_TASK,
+    STAGE_WAIT, STAGE_WRITE, Instrumentation, StageStats, call_instrumented,
+    get_instrumentation,
+)
+
+
+def count_documents(quantity: int) -> int:
+    get_instrumentation().count(COUNTER_DOCUMENTS, quantity)
+    return quantity
+
+
+class StageStatsTestCase(TestCase):
+    def test_add_and_merge(self):
+        stats = StageStats()
+        stats.add(0.5)
+        other = StageStats()
+        other.add(2)
+        stats.merge(other)
+
+        self.assertEqual(stats.count, 2)
+        self.assertEqual(stats.total, 2.5)
+        self.assertEqual(stats.max, 2)
+        self.assertEqual(sum(stats.histogram), 2)
+
+
+class InstrumentationTestCase(TestCase):
+    def test_timed(self):
+        instrumentation = Instrumentation()
+        self.assertListEqual(list(instrumentation.timed(range(3))), [0, 1, 2])
+        # Три элемента и признак окончания
+        self.assertEqual(
+            instrumentation.stages[MAIN_WORKER][STAGE_WAIT].count, 4,
+        )
+
+    def test_stage_excluding(self):
+        instrumentation = Instrumentation()
+        with instrumentation.stage_excluding(STAGE_WRITE):
+            instrumentation.record(STAGE_WAIT, 10)
+        self.assertLess(
+            instrumentation.stages[MAIN_WORKER][STAGE_WRITE].total, 1,
+        )
+
+    def test_call_instrumented(self):
+        result, snapshot = call_instrumented(count_documents, 5)
+        self.assertEqual(result, 5)
+        self.assertIs(get_instrumentation(), NULL_INSTRUMENTATION)
+
+        instrumentation = Instrumentation()
+        instrumentation.merge(snapshot)
+        instrumentation.merge(snapshot)
+        report = instrumentation.report()
+        self.assertEqual(report['counters'][COUNTER_DOCUMENTS], 10)
+        self.assertEqual(report['stages'][STAGE_TASK]['count'], 2)
+
+    def test_progress(self):
+        progress_file = StringIO()
+        reports = []
+        instrumentation = Instrumentation(
+            progress_interval=0, progress_file=progress_file,
+            callback=reports.append,
+        )
+        instrumentation.count(COUNTER_DOCUMENTS, 3)
+        instrumentation.finish()
+        self.assertIn('3 documents', progress_file.getvalue())
+        self.assertEqual(len(reports), 1)
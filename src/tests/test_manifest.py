@@ -0,0 +1,78 @@
+import os
+import tempfile
+from unittest import TestCase
+from zipfile import ZipFile
+
+from manifest import ArchiveManifest, member_key
+
+
+class ArchiveManifestTestCase(TestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.dir_path = temp_dir.name
+        self.manifest_path = os.path.join(self.dir_path, 'manifest.json')
+        self.zip_file_path = os.path.join(self.dir_path, 'documents.zip')
+        self.write_zip_file('0.xml', '<root/>')
+
+    def write_zip_file(self, name: str, data: str) -> None:
+        with ZipFile(self.zip_file_path, 'w') as zip_file:
+            zip_file.writestr(name, data)
+
+    def test_new_archive_is_changed(self):
+        manifest = ArchiveManifest.load(self.manifest_path)
+        self.assertTrue(manifest.is_changed(self.dir_path, self.zip_file_path))
+
+    def test_added_archive_is_not_changed(self):
+        manifest = ArchiveManifest.load(self.manifest_path)
+        manifest.add(self.dir_path, self.zip_file_path)
+        manifest.save()
+
+        manifest = ArchiveManifest.load(self.manifest_path)
+        self.assertFalse(
+            manifest.is_changed(self.dir_path, self.zip_file_path),
+        )
+
+    def test_touched_archive_is_not_changed(self):
+        manifest = ArchiveManifest.load(self.manifest_path)
+        manifest.add(self.dir_path, self.zip_file_path)
+        stat = os.stat(self.zip_file_path)
+        os.utime(
+            self.zip_file_path,
+            ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9),
+        )
+        self.assertFalse(
+            manifest.is_changed(self.dir_path, self.zip_file_path),
+        )
+
+    def test_rewritten_archive_is_changed(self):
+        manifest = ArchiveManifest.load(self.manifest_path)
+        manifest.add(self.dir_path, self.zip_file_path)
+        self.write_zip_file('0.xml', '<root><objects/></root>')
+        self.assertTrue(manifest.is_changed(self.dir_path, self.zip_file_path))
+
+    def test_members(self):
+        manifest = ArchiveManifest.load(self.manifest_path)
+        self.assertSetEqual(
+            manifest.members(self.dir_path, self.zip_file_path), set(),
+        )
+        manifest.add(self.dir_path, self.zip_file_path)
+        manifest.save()
+
+        manifest = ArchiveManifest.load(self.manifest_path)
+        with ZipFile(self.zip_file_path, 'r') as zip_file:
+            self.assertSetEqual(
+                manifest.members(self.dir_path, self.zip_file_path),
+                {member_key(zip_file.getinfo('0.xml'))},
+            )
+
+    def test_incomplete_archive_is_changed(self):
+        manifest = ArchiveManifest.load(self.manifest_path)
+        manifest.add(
+            self.dir_path, self.zip_file_path,
+            ArchiveManifest.snapshot(self.zip_file_path), (), complete=False,
+        )
+        self.assertTrue(manifest.is_changed(self.dir_path, self.zip_file_path))
+        self.assertSetEqual(
+            manifest.members(self.dir_path, self.zip_file_path), set(),
+        )
@@ -0,0 +1,214 @@
+import os
+import pickle
+import sqlite3
+import tempfile
+from io import StringIO
+from unittest import TestCase
+from unittest.mock import patch
+from zipfile import ZipFile, ZipInfo
+
+from collector import (
+    collect_documents_info_multiple_core, collect_documents_info_single_core,
+    documents_from_zip_file,
+)
+from entities import DocumentBatch
+from generator import document_to_xml, generate_random_document
+from instrumentation import (
+    COUNTER_CACHED, COUNTER_DOCUMENTS, Instrumentation, set_instrumentation,
+)
+from parse_cache import (
+    ParseCache, _process_parse_caches, call_cached, set_parse_cache,
+)
+
+
+def _zip_info(name: str, crc: int, file_size: int = 100) -> ZipInfo:
+    zip_info = ZipInfo(name)
+    zip_info.CRC = crc
+    zip_info.file_size = file_size
+    return zip_info
+
+
+class ParseCacheTestCase(TestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.cache_path = os.path.join(temp_dir.name, 'cache.sqlite')
+
+    def test_put_and_get(self):
+        batch = DocumentBatch()
+        batch.append('1', '2', ['a', None, 'объект'])
+        batch.append(None, None, [])
+        zip_infos = [_zip_info('1.xml', 1), _zip_info('2.xml', 2)]
+
+        with ParseCache(self.cache_path) as parse_cache:
+            parse_cache.put_batch(zip_infos, batch)
+            # До `flush` записи не видны
+            self.assertIsNone(parse_cache.get(zip_infos[0]))
+
+        with ParseCache(self.cache_path) as parse_cache:
+            self.assertEqual(
+                parse_cache.get(zip_infos[0]),
+                ('1', '2', ['a', None, 'объект']),
+            )
+            self.assertEqual(parse_cache.get(zip_infos[1]), (None, None, []))
+            # Другое имя, размер или CRC — другой файл
+            for zip_info in (
+                _zip_info('3.xml', 1), _zip_info('1.xml', 1, 101),
+                _zip_info('1.xml', 3),
+            ):
+                self.assertIsNone(parse_cache.get(zip_info))
+
+    def test_evict_least_recently_used(self):
+        batch = DocumentBatch()
+        for num in range(3):
+            batch.append(str(num), None, [])
+        zip_infos = [_zip_info(f'{num}.xml', num) for num in range(3)]
+
+        with ParseCache(self.cache_path, max_entries=2) as parse_cache:
+            parse_cache.put_batch(zip_infos, batch)
+            parse_cache.flush()
+            with parse_cache._connect() as connection:
+                connection.execute('UPDATE members SET used = 0 WHERE crc = 1')
+
+        with ParseCache(self.cache_path) as parse_cache:
+            self.assertListEqual(
+                [parse_cache.get(zip_info) for zip_info in zip_infos],
+                [('0', None, []), None, ('2', None, [])],
+            )
+
+    def test_version_change_clears_cache(self):
+        batch = DocumentBatch()
+        batch.append('1', None, [])
+        zip_info = _zip_info('1.xml', 1)
+        with ParseCache(self.cache_path) as parse_cache:
+            parse_cache.put_batch([zip_info], batch)
+
+        connection = sqlite3.connect(self.cache_path)
+        connection.execute('PRAGMA user_version = 0')
+        connection.close()
+        with ParseCache(self.cache_path) as parse_cache:
+            self.assertIsNone(parse_cache.get(zip_info))
+
+    def test_call_cached_in_pickled_copy(self):
+        batch = DocumentBatch()
+        batch.append('1', None, [])
+        zip_info = _zip_info('1.xml', 1)
+
+        def put(parse_cache_copy: ParseCache) -> None:
+            parse_cache_copy.put_batch([zip_info], batch)
+
+        with ParseCache(self.cache_path) as parse_cache:
+            parse_cache_copy = pickle.loads(pickle.dumps(parse_cache))
+            # Записи копии сохраняются в конце задачи
+            call_cached(parse_cache_copy, put, parse_cache_copy)
+            self.assertEqual(parse_cache.get(zip_info), ('1', None, []))
+
+
+class CollectWithParseCacheTestCase(TestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.temp_dir_path = temp_dir.name
+        self.documents_dir_path = os.path.join(temp_dir.name, 'documents')
+        os.makedirs(self.documents_dir_path)
+        self.cache_path = os.path.join(temp_dir.name, 'cache.sqlite')
+        # Небольшие архивы тестов собираются в процессах пула
+        patcher = patch('collector.MIN_POOL_INPUT_SIZE', 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.zip_file_paths = []
+        for zip_file_num in range(2):
+            zip_file_path = os.path.join(
+                self.documents_dir_path, f'{zip_file_num}.zip',
+            )
+            with ZipFile(zip_file_path, 'w') as zip_file:
+                for document_num in range(3):
+                    zip_file.writestr(
+                        f'{document_num}.xml',
+                        document_to_xml(generate_random_document()),
+                    )
+            self.zip_file_paths.append(zip_file_path)
+
+    def collect(self, collector, parse_cache: ParseCache = None, **options):
+        instrumentation = Instrumentation()
+        documents_file, objects_file = StringIO(), StringIO()
+        collector(
+            self.documents_dir_path, documents_file, objects_file,
+            instrumentation=instrumentation, parse_cache=parse_cache,
+            **options,
+        )
+        return (
+            sorted(documents_file.getvalue().splitlines()),
+            sorted(objects_file.getvalue().splitlines()),
+            instrumentation.total(COUNTER_CACHED),
+        )
+
+    def test_collect_with_parse_cache(self):
+        expected = self.collect(collect_documents_info_single_core)[:2]
+        for collector, options in (
+            (collect_documents_info_single_core, {}),
+            (collect_documents_info_multiple_core, {'processes': 2}),
+        ):
+            with self.subTest(collector=collector.__name__):
+                with ParseCache(self.cache_path) as parse_cache:
+                    self.assertTupleEqual(
+                        self.collect(collector, parse_cache, **options),
+                        (*expected, 0),
+                    )
+                with ParseCache(self.cache_path) as parse_cache:
+                    self.assertTupleEqual(
+                        self.collect(collector, parse_cache, **options),
+                        (*expected, 6),
+                    )
+                os.remove(self.cache_path)
+
+    def test_in_process_collections_in_row(self):
+        expected = self.collect(collect_documents_info_single_core)[:2]
+        # Небольшой сбор идет без пула, в этом же процессе
+        with patch('collector.MIN_POOL_INPUT_SIZE', 1 << 30):
+            for cached_quantity in (0, 6):
+                with ParseCache(self.cache_path) as parse_cache:
+                    self.assertTupleEqual(
+                        self.collect(
+                            collect_documents_info_multiple_core,
+                            parse_cache, processes=2,
+                        ),
+                        (*expected, cached_quantity),
+                    )
+                    self.assertIs(
+                        _process_parse_caches[self.cache_path], parse_cache,
+                    )
+                self.assertNotIn(self.cache_path, _process_parse_caches)
+
+    def test_repacked_archive_is_not_parsed(self):
+        with ParseCache(self.cache_path) as parse_cache:
+            self.collect(collect_documents_info_single_core, parse_cache)
+
+        # Тот же файл в другом архиве берется из кэша
+        repacked_zip_file_path = os.path.join(self.temp_dir_path, 'new.zip')
+        with ZipFile(self.zip_file_paths[0], 'r') as zip_file, \
+             ZipFile(repacked_zip_file_path, 'w') as repacked_zip_file:
+            repacked_zip_file.writestr('1.xml', zip_file.read('1.xml'))
+            repacked_zip_file.writestr(
+                '3.xml', document_to_xml(generate_random_document()),
+            )
+
+        expected = documents_from_zip_file(
+            repacked_zip_file_path, verbose=False,
+        )
+        instrumentation = Instrumentation()
+        set_instrumentation(instrumentation)
+        try:
+            with ParseCache(self.cache_path) as parse_cache:
+                set_parse_cache(parse_cache)
+                documents = documents_from_zip_file(
+                    repacked_zip_file_path, verbose=False,
+                )
+        finally:
+            set_instrumentation(None)
+            set_parse_cache(None)
+
+        self.assertListEqual(documents, expected)
+        self.assertEqual(instrumentation.total(COUNTER_CACHED), 1)
+        self.assertEqual(instrumentation.total(COUNTER_DOCUMENTS), 2)
@@ -0,0 +1,449 @@
+import gzip
+import io
+import os
+import struct
+import tempfile
+from functools import partial
+from operator import attrgetter
+from unittest import TestCase, skipIf
+from unittest.mock import patch
+from zipfile import ZipFile
+
+from collector import (
+    collect_documents_info_resumable, collect_documents_multiple_core,
+    collect_documents_single_core, collect_documents_streaming,
+)
+from entities import Document, DocumentBatch, DocumentObject
+from generator import document_to_xml, generate_random_document
+from sinks import (
+    COMPRESSION_GZIP, COMPRESSION_ZSTD, ColumnarSink, CompressedSink, CsvSink,
+    DeduplicatingSink, PartitionedSink, decompress,
+    documents_to_columnar_fragments, documents_to_csv_fragments,
+    BackgroundWriter, iter_columnar_row_groups, part_file_path,
+    read_columnar_documents, zstandard,
+)
+
+
+def write_columnar_files(documents, **options):
+    documents_file, objects_file = io.BytesIO(), io.BytesIO()
+    with ColumnarSink(documents_file, objects_file, **options) as sink:
+        sink.write_documents(documents)
+    documents_file.seek(0)
+    objects_file.seek(0)
+    return documents_file, objects_file
+
+
+class ColumnarSinkTestCase(TestCase):
+    def test_read_columnar_documents(self):
+        documents = [generate_random_document() for _ in range(5)]
+        documents.append(Document(id_=documents[0].id, level=1, objects=[]))
+        self.assertListEqual(
+            list(
+                read_columnar_documents(
+                    *write_columnar_files(documents, row_group_size=2),
+                )
+            ),
+            documents,
+        )
+
+    def test_read_columnar_documents_not_uuid(self):
+        documents = [
+            Document(
+                id_='документ', level='high',
+                objects=[DocumentObject(name=None), DocumentObject('a,b')],
+            ),
+            Document(id_=None, level=None, objects=[]),
+            Document(
+                id_=str(generate_random_document().id).upper(), level='007',
+                objects=[DocumentObject(name='')],
+            ),
+        ]
+        self.assertListEqual(
+            list(read_columnar_documents(*write_columnar_files(documents))),
+            documents,
+        )
+
+    def test_levels_are_integers(self):
+        document = generate_random_document()
+        document.level = str(document.level)
+        documents_file, _ = write_columnar_files([document])
+        (row_group, ) = iter_columnar_row_groups(documents_file)
+        self.assertListEqual(row_group['level'], [int(document.level)])
+
+    def test_extreme_and_empty_levels(self):
+        documents = [
+            Document(id_=str(level), level=level, objects=[])
+            for level in (-2 ** 31, None, 2 ** 31 - 1, 0)
+        ]
+        documents_file, objects_file = write_columnar_files(documents)
+        (row_group, ) = iter_columnar_row_groups(documents_file)
+        self.assertListEqual(
+            row_group['level'], [-2 ** 31, None, 2 ** 31 - 1, 0],
+        )
+        documents_file.seek(0)
+        self.assertListEqual(
+            list(read_columnar_documents(documents_file, objects_file)),
+            documents,
+        )
+
+    def test_read_version_1_levels(self):
+        # Группа документов версии 1: id — строки, пустой уровень — -2**31
+        ids = b'\x00\x00\x00' + struct.pack('<3I', 0, 1, 2) + b'ab'
+        levels = b'\x01' + struct.pack('<2i', -2 ** 31, 5)
+        documents_file = io.BytesIO(
+            b'DCOL\x01D'
+            + struct.pack('<4sII', b'RGRP', 2, len(ids) + len(levels))
+            + ids + levels,
+        )
+        (row_group, ) = iter_columnar_row_groups(documents_file)
+        self.assertDictEqual(
+            row_group, {'id': ['a', 'b'], 'level': [None, 5]},
+        )
+
+    def test_write_batch(self):
+        documents = [generate_random_document() for _ in range(5)]
+        batch = DocumentBatch.from_documents(documents)
+        # Пачка пишется из колонок, без создания `Document`
+        with patch.object(
+                 DocumentBatch, '__iter__', side_effect=AssertionError,
+             ):
+            documents_file, objects_file = write_columnar_files(
+                batch, row_group_size=2,
+            )
+        self.assertTupleEqual(
+            (documents_file.getvalue(), objects_file.getvalue()),
+            tuple(
+                file.getvalue()
+                for file in write_columnar_files(documents, row_group_size=2)
+            ),
+        )
+
+    def test_objects_ids_are_dictionary_encoded(self):
+        document = generate_random_document()
+        document.objects = [DocumentObject(name='x')] * 100
+        _, objects_file = write_columnar_files([document])
+        (row_group, ) = iter_columnar_row_groups(objects_file)
+        self.assertListEqual(row_group['id'], [document.id])
+        self.assertListEqual(row_group['document'], [0] * 100)
+        self.assertLess(len(objects_file.getvalue()), 100 * 36)
+
+    def test_write_fragment(self):
+        documents = [generate_random_document() for _ in range(3)]
+        documents_file, objects_file = io.BytesIO(), io.BytesIO()
+        with ColumnarSink(documents_file, objects_file) as sink:
+            sink.write_fragment(sink.render(documents[:2]))
+            sink.write_fragment(sink.render(documents[2:]))
+        documents_file.seek(0)
+        objects_file.seek(0)
+        self.assertListEqual(
+            list(read_columnar_documents(documents_file, objects_file)),
+            documents,
+        )
+
+    def test_broken_file(self):
+        with self.assertRaises(ValueError):
+            list(iter_columnar_row_groups(io.BytesIO(b'PAR1\x01D')))
+
+
+class DocumentBatchFragmentsTestCase(TestCase):
+    def test_fragments_are_equal(self):
+        documents = [generate_random_document() for _ in range(5)]
+        documents[0].objects = [DocumentObject(name=None)]
+        documents[1].objects = [DocumentObject(name=str(documents[1].id))]
+        documents[2].objects = []
+        for document in documents:
+            document.level = str(document.level)
+        batch = DocumentBatch.from_documents(documents)
+        for render in (
+            partial(documents_to_csv_fragments, write_headers=True),
+            partial(documents_to_columnar_fragments, row_group_size=2),
+        ):
+            with self.subTest(render=render.func.__name__):
+                self.assertTupleEqual(render(batch), render(documents))
+
+
+class CsvSinkTestCase(TestCase):
+    def test_binary_files(self):
+        documents = [generate_random_document() for _ in range(3)]
+        expected_fragments = documents_to_csv_fragments(documents, True)
+        for threaded_writers in (False, True):
+            with self.subTest(threaded_writers=threaded_writers):
+                documents_file, objects_file = io.BytesIO(), io.BytesIO()
+                with CsvSink(
+                    documents_file, objects_file,
+                    threaded_writers=threaded_writers,
+                ) as sink:
+                    sink.write_fragment(sink.render(documents[:1]))
+                    sink.write_documents(documents[1:])
+
+                # Файлы остаются открытыми после закрытия приемника
+                self.assertTupleEqual(
+                    (
+                        documents_file.getvalue().decode('utf-8'),
+                        objects_file.getvalue().decode('utf-8'),
+                    ),
+                    expected_fragments,
+                )
+
+    def test_threaded_writers_are_reused(self):
+        documents = [generate_random_document() for _ in range(4)]
+        documents_file, objects_file = io.StringIO(), io.StringIO()
+        with patch(
+                 'sinks.BackgroundWriter', wraps=BackgroundWriter,
+             ) as background_writer:
+            with CsvSink(
+                     documents_file, objects_file, threaded_writers=True,
+                 ) as sink:
+                for document in documents:
+                    sink.write_documents([document])
+                sink.write_documents(DocumentBatch.from_documents(documents))
+            # Один поток на файл на все вызовы
+            self.assertEqual(background_writer.call_count, 2)
+
+        self.assertTupleEqual(
+            (documents_file.getvalue(), objects_file.getvalue()),
+            documents_to_csv_fragments(documents * 2, True),
+        )
+
+
+class CollectDocumentsToSinkTestCase(TestCase):
+    collectors = {
+        'single_core': collect_documents_single_core,
+        'multiple_core': collect_documents_multiple_core,
+        'multiple_core_render_in_workers': partial(
+            collect_documents_multiple_core, render_in_workers=True,
+        ),
+        'streaming': partial(collect_documents_streaming, batch_size=1),
+    }
+
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.temp_dir_path = temp_dir.name
+        self.dir_path = os.path.join(temp_dir.name, 'documents')
+        os.makedirs(self.dir_path)
+        self.documents = []
+        for zip_num in range(2):
+            with ZipFile(
+                os.path.join(self.dir_path, f'{zip_num}.zip'), 'w',
+            ) as zip_file:
+                for document_num in range(3):
+                    document = generate_random_document()
+                    zip_file.writestr(
+                        f'{document_num}.xml', document_to_xml(document),
+                    )
+                    document.level = int(document.level)
+                    self.documents.append(document)
+
+    def assertDocumentsEqual(self, documents):
+        self.assertListEqual(
+            sorted(documents, key=attrgetter('id')),
+            sorted(self.documents, key=attrgetter('id')),
+        )
+
+    def test_collect_documents_to_columnar_sink(self):
+        for mode, collector in self.collectors.items():
+            with self.subTest(mode=mode):
+                documents_file, objects_file = io.BytesIO(), io.BytesIO()
+                with ColumnarSink(documents_file, objects_file) as sink:
+                    collector(self.dir_path, sink)
+                documents_file.seek(0)
+                objects_file.seek(0)
+                self.assertDocumentsEqual(
+                    list(read_columnar_documents(documents_file, objects_file))
+                )
+
+    def test_collect_documents_info_resumable_to_columnar_sink(self):
+        documents_file_path, objects_file_path = (
+            os.path.join(self.temp_dir_path, file_name)
+            for file_name in ('documents.dcol', 'objects.dcol')
+        )
+        collect_documents_info_resumable(
+            self.dir_path, documents_file_path, objects_file_path,
+            verbose=False, sink_class=ColumnarSink,
+        )
+        with open(documents_file_path, 'rb') as documents_file, \
+             open(objects_file_path, 'rb') as objects_file:
+
+            self.assertDocumentsEqual(
+                list(read_columnar_documents(documents_file, objects_file))
+            )
+
+    def test_documents_to_columnar_fragments_row_groups(self):
+        documents_fragment, _ = documents_to_columnar_fragments(
+            self.documents, row_group_size=4,
+        )
+        documents_file, _ = write_columnar_files(())
+        documents_file.seek(0, os.SEEK_END)
+        documents_file.write(documents_fragment)
+        documents_file.seek(0)
+        self.assertListEqual(
+            [
+                len(row_group['id'])
+                for row_group in iter_columnar_row_groups(documents_file)
+            ],
+            [4, 2],
+        )
+
+    def test_collect_documents_to_deduplicating_sink(self):
+        # Тот же архив доставлен повторно под другим именем
+        with open(os.path.join(self.dir_path, '0.zip'), 'rb') as zip_file, \
+             open(os.path.join(self.dir_path, '2.zip'), 'wb') as copy_file:
+            copy_file.write(zip_file.read())
+
+        for mode, collector in self.collectors.items():
+            with self.subTest(mode=mode):
+                documents_file, objects_file = io.BytesIO(), io.BytesIO()
+                with DeduplicatingSink(
+                    ColumnarSink(documents_file, objects_file),
+                ) as sink:
+                    collector(self.dir_path, sink)
+                documents_file.seek(0)
+                objects_file.seek(0)
+                self.assertDocumentsEqual(
+                    list(read_columnar_documents(documents_file, objects_file))
+                )
+                self.assertEqual(sink.duplicates, 3)
+                self.assertEqual(
+                    sink.duplicate_objects,
+                    sum(
+                        len(document.objects)
+                        for document in self.documents[:3]
+                    ),
+                )
+
+
+class CompressedSinkTestCase(TestCase):
+    def setUp(self):
+        self.documents = [generate_random_document() for _ in range(5)]
+
+    def write_files(self, **options):
+        documents_file, objects_file = io.BytesIO(), io.BytesIO()
+        with CompressedSink(documents_file, objects_file, **options) as sink:
+            # Фрагмент из процесса-обработчика и документы по одному
+            sink.write_fragment(sink.render(self.documents[:2]))
+            sink.write_documents(self.documents[2:])
+        return documents_file.getvalue(), objects_file.getvalue()
+
+    def test_gzip_csv(self):
+        self.assertTupleEqual(
+            tuple(map(gzip.decompress, self.write_files())),
+            tuple(
+                fragment.encode('utf-8')
+                for fragment in documents_to_csv_fragments(
+                    self.documents, True,
+                )
+            ),
+        )
+
+    @skipIf(zstandard is None, 'zstandard is not installed')
+    def test_zstd_columnar(self):
+        documents_data, objects_data = self.write_files(
+            sink_class=ColumnarSink, compression=COMPRESSION_ZSTD,
+        )
+        self.assertListEqual(
+            list(
+                read_columnar_documents(
+                    io.BytesIO(decompress(documents_data, COMPRESSION_ZSTD)),
+                    io.BytesIO(decompress(objects_data, COMPRESSION_ZSTD)),
+                )
+            ),
+            self.documents,
+        )
+
+    def test_collect_documents_info_resumable(self):
+        with tempfile.TemporaryDirectory() as temp_dir_path:
+            dir_path = os.path.join(temp_dir_path, 'documents')
+            os.makedirs(dir_path)
+            with ZipFile(os.path.join(dir_path, '0.zip'), 'w') as zip_file:
+                for document_num, document in enumerate(self.documents):
+                    zip_file.writestr(
+                        f'{document_num}.xml', document_to_xml(document),
+                    )
+            documents_file_path = os.path.join(temp_dir_path, 'docs.csv.gz')
+            objects_file_path = os.path.join(temp_dir_path, 'objs.csv.gz')
+            collect_documents_info_resumable(
+                dir_path, documents_file_path, objects_file_path,
+                verbose=False, sink_class=CompressedSink,
+            )
+            with gzip.open(documents_file_path, 'rt') as documents_file:
+                self.assertEqual(
+                    len(documents_file.readlines()), len(self.documents) + 1,
+                )
+
+
+class PartitionedSinkTestCase(TestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.documents_file_path = os.path.join(temp_dir.name, 'docs.csv.gz')
+        self.objects_file_path = os.path.join(temp_dir.name, 'objs.csv.gz')
+        self.documents = [generate_random_document() for _ in range(5)]
+
+    def test_part_file_path(self):
+        self.assertEqual(
+            part_file_path(os.path.join('out', 'objects.csv.gz'), 1),
+            os.path.join('out', 'objects-00001.csv.gz'),
+        )
+
+    def test_max_part_rows(self):
+        with PartitionedSink(
+            self.documents_file_path, self.objects_file_path,
+            compression=COMPRESSION_GZIP, max_part_rows=2,
+        ) as sink:
+            for document in self.documents:
+                sink.write_fragment(sink.render([document]))
+
+        self.assertListEqual(
+            sink.documents_file_paths,
+            [
+                part_file_path(self.documents_file_path, part_num)
+                for part_num in (1, 2, 3)
+            ],
+        )
+        rows = []
+        for file_path in sink.documents_file_paths:
+            with gzip.open(file_path, 'rt', newline='') as part_file:
+                header, *part_rows = part_file.readlines()
+            self.assertEqual(header, 'id,level\r\n')
+            self.assertLessEqual(len(part_rows), 2)
+            rows.extend(part_rows)
+        self.assertListEqual(
+            rows,
+            [
+                f'{document.id},{document.level}\r\n'
+                for document in self.documents
+            ],
+        )
+
+    def test_max_part_size(self):
+        with PartitionedSink(
+            self.documents_file_path, self.objects_file_path,
+            sink_class=ColumnarSink, max_part_size=1,
+        ) as sink:
+            sink.write_documents(self.documents[:1])
+            sink.write_documents(self.documents[1:])
+
+        self.assertEqual(len(sink.objects_file_paths), 2)
+        documents = []
+        for documents_file_path, objects_file_path in zip(
+            sink.documents_file_paths, sink.objects_file_paths,
+        ):
+            with open(documents_file_path, 'rb') as documents_file, \
+                 open(objects_file_path, 'rb') as objects_file:
+
+                documents.extend(
+                    read_columnar_documents(documents_file, objects_file)
+                )
+        self.assertListEqual(documents, self.documents)
+
+    def test_without_limits(self):
+        with PartitionedSink(
+            self.documents_file_path, self.objects_file_path,
+        ) as sink:
+            pass
+        self.assertListEqual(
+            sink.documents_file_paths, [self.documents_file_path],
+        )
+        with open(self.objects_file_path, 'rt') as objects_file:
+            self.assertEqual(objects_file.read(), 'id,name\n')
@@ -1,7 +1,11 @@
 import os
 import tempfile
 from unittest import TestCase
-from utils import clear_directory, filter_file_names
+from utils import (
+    BackgroundWriter, InProcessPool, batched, calculate_chunksize,
+    clear_directory, filter_file_names, filter_file_paths, filter_file_sizes,
+    plan_chunksize, shared_pool,
+)
 
 
 class OsShortcutsTestCaseMixin:
@@ -102,3 +106,144 @@ class FilterFileNamesTestCase(OsShortcutsTestCaseMixin, TestCase):
             self.assertSetEqual(set(filter_file_names(temp_dir_path)), set())
 
         self.assertFalse(os.path.exists(temp_dir_path))
+
+
+class ScanFilesTestCase(TestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.dir_path = temp_dir.name
+        for relative_path, data in (
+            ('root.zip', b'1'),
+            ('2024/01/a.zip', b'22'),
+            ('2024/02/b.zip', b'333'),
+            ('2024/02/b.txt', b''),
+            ('tmp/c.zip', b''),
+        ):
+            file_path = os.path.join(self.dir_path, relative_path)
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            with open(file_path, 'wb') as fh:
+                fh.write(data)
+
+    def names(self, **options):
+        return {
+            file_name.replace(os.sep, '/')
+            for file_name in filter_file_names(self.dir_path, **options)
+        }
+
+    def test_flat(self):
+        self.assertSetEqual(self.names(extension='zip'), {'root.zip'})
+
+    def test_recursive(self):
+        self.assertSetEqual(
+            self.names(extension='zip', recursive=True),
+            {'root.zip', '2024/01/a.zip', '2024/02/b.zip', 'tmp/c.zip'},
+        )
+
+    def test_include_exclude(self):
+        self.assertSetEqual(
+            self.names(
+                recursive=True, include=('2024/*/*', ), exclude=('*.txt', ),
+            ),
+            {'2024/01/a.zip', '2024/02/b.zip'},
+        )
+        # Исключенная папка не обходится
+        self.assertSetEqual(
+            self.names(recursive=True, exclude=('tmp', '2024/01')),
+            {'root.zip', '2024/02/b.zip', '2024/02/b.txt'},
+        )
+
+    def test_lazy(self):
+        file_paths = filter_file_paths(self.dir_path, recursive=True)
+        self.assertTrue(os.path.isfile(next(file_paths)))
+
+    def test_filter_file_sizes(self):
+        self.assertDictEqual(
+            dict(filter_file_sizes(self.dir_path, 'zip', recursive=True)),
+            {
+                os.path.join(self.dir_path, relative_path): size
+                for relative_path, size in (
+                    ('root.zip', 1),
+                    (os.path.join('2024', '01', 'a.zip'), 2),
+                    (os.path.join('2024', '02', 'b.zip'), 3),
+                    (os.path.join('tmp', 'c.zip'), 0),
+                )
+            },
+        )
+
+
+class BatchedTestCase(TestCase):
+    def test_batched(self):
+        self.assertListEqual(
+            list(batched(range(5), 2)), [[0, 1], [2, 3], [4]],
+        )
+
+    def test_batched_empty(self):
+        self.assertListEqual(list(batched([], 2)), [])
+
+
+class BackgroundWriterTestCase(TestCase):
+    def test_background_writer(self):
+        written = []
+        with BackgroundWriter(written.append, max_in_flight=1) as writer:
+            for data in range(10):
+                writer.write(data)
+        self.assertListEqual(written, list(range(10)))
+
+    def test_background_writer_error(self):
+        def write(data):
+            raise OSError(data)
+
+        writer = BackgroundWriter(write, max_in_flight=1)
+        writer.write(1)
+        writer.write(2)
+        with self.assertRaises(OSError):
+            writer.close()
+
+
+class ChunksizeTestCase(TestCase):
+    def test_calculate_chunksize(self):
+        self.assertEqual(calculate_chunksize(0, 2), 1)
+        self.assertEqual(calculate_chunksize(8, 2), 1)
+        self.assertEqual(calculate_chunksize(9, 2), 2)
+        self.assertEqual(calculate_chunksize(80, 2), 10)
+
+    def test_plan_chunksize(self):
+        # Крупные задачи передаются по одной
+        self.assertEqual(plan_chunksize([100] * 80, 2, target_size=100), 1)
+        # Мелкие — пачками, но не больше, чем по `calculate_chunksize`
+        self.assertEqual(plan_chunksize([10] * 80, 2, target_size=100), 10)
+        self.assertEqual(plan_chunksize([1] * 80, 2, target_size=100), 10)
+        self.assertEqual(plan_chunksize([], 2, target_size=100), 1)
+
+
+class SharedPoolTestCase(TestCase):
+    def test_shared_pool(self):
+        pool = shared_pool(1)
+        self.assertIs(shared_pool(1), pool)
+        self.assertListEqual(pool.map(abs, [-1, -2]), [1, 2])
+
+
+class InProcessPoolTestCase(TestCase):
+    def test_in_process_pool(self):
+        with InProcessPool() as pool:
+            self.assertListEqual(pool.map(abs, [-1, -2]), [1, 2])
+            self.assertListEqual(
+                sorted(pool.imap_unordered(abs, [-2, -1])), [1, 2],
+            )
+
+            results, errors = [], []
+            self.assertEqual(
+                pool.apply_async(
+                    abs, (-1, ), callback=results.append,
+                ).get(),
+                1,
+            )
+            async_result = pool.apply_async(
+                abs, ('a', ), error_callback=errors.append,
+            )
+            self.assertListEqual(results, [1])
+            self.assertIsInstance(errors[0], TypeError)
+            self.assertFalse(async_result.successful())
+            with self.assertRaises(TypeError):
+                async_result.get()
@@ -0,0 +1,118 @@
+import os
+import tempfile
+import time
+from unittest import TestCase
+
+from watcher import (
+    InotifyWatcher, PollingWatcher, ReadyFiles, create_watcher,
+)
+
+
+class WatcherTestCaseMixin(object):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.dir_path = temp_dir.name
+        self.write_file('old.zip', b'old')
+        self.watcher = self.create_watcher()
+        self.addCleanup(self.watcher.close)
+
+    def create_watcher(self):
+        raise NotImplementedError
+
+    def write_file(self, file_name: str, data: bytes) -> str:
+        file_path = os.path.join(self.dir_path, file_name)
+        with open(file_path, 'wb') as fh:
+            fh.write(data)
+        return file_path
+
+    def wait(self):
+        deadline = time.monotonic() + 5
+        changed = []
+        while not changed and time.monotonic() < deadline:
+            changed = self.watcher.wait(0.1)
+        return changed
+
+    def test_new_file(self):
+        self.write_file('skipped.txt', b'text')
+        file_path = self.write_file('new.zip', b'new')
+        self.assertListEqual(self.wait(), [file_path])
+
+    def test_moved_file(self):
+        temp_file_path = self.write_file('new.tmp', b'new')
+        file_path = os.path.join(self.dir_path, 'new.zip')
+        os.rename(temp_file_path, file_path)
+        self.assertListEqual(self.wait(), [file_path])
+
+    def test_timeout(self):
+        self.assertListEqual(self.watcher.wait(0.05), [])
+
+
+class PollingWatcherTestCase(WatcherTestCaseMixin, TestCase):
+    def create_watcher(self):
+        return PollingWatcher(self.dir_path, 'zip', poll_interval=0.05)
+
+
+class InotifyWatcherTestCase(WatcherTestCaseMixin, TestCase):
+    def create_watcher(self):
+        watcher = create_watcher(self.dir_path, 'zip')
+        if not isinstance(watcher, InotifyWatcher):
+            self.skipTest('inotify is not available')
+        return watcher
+
+
+class ReadyFilesTestCase(TestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.file_path = os.path.join(temp_dir.name, 'new.zip')
+        with open(self.file_path, 'wb') as fh:
+            fh.write(b'part')
+
+    def test_settle_time(self):
+        ready_files = ReadyFiles(settle_time=0.1)
+        ready_files.add([self.file_path])
+        self.assertListEqual(ready_files.pop_ready(), [])
+
+        # Запись продолжилась: время отсчитывается заново
+        time.sleep(0.06)
+        with open(self.file_path, 'ab') as fh:
+            fh.write(b'more')
+        time.sleep(0.06)
+        self.assertListEqual(ready_files.pop_ready(), [])
+
+        time.sleep(0.12)
+        self.assertListEqual(ready_files.pop_ready(), [self.file_path])
+        self.assertListEqual(ready_files.pop_ready(), [])
+
+    def test_is_complete(self):
+        complete = set()
+        ready_files = ReadyFiles(
+            settle_time=0, is_complete=complete.__contains__,
+        )
+        ready_files.add([self.file_path])
+        self.assertListEqual(ready_files.pop_ready(), [])
+        complete.add(self.file_path)
+        self.assertListEqual(ready_files.pop_ready(), [self.file_path])
+
+    def test_incomplete_timeout(self):
+        ready_files = ReadyFiles(
+            settle_time=0, is_complete=lambda _: False,
+            incomplete_timeout=0.1,
+        )
+        ready_files.add([self.file_path])
+        self.assertListEqual(ready_files.pop_ready(), [])
+        self.assertListEqual(ready_files.pop_failed(), [])
+
+        time.sleep(0.12)
+        self.assertListEqual(ready_files.pop_ready(), [])
+        self.assertListEqual(ready_files.pop_failed(), [self.file_path])
+        self.assertDictEqual(ready_files.pending, {})
+        self.assertListEqual(ready_files.pop_failed(), [])
+
+    def test_removed_file(self):
+        ready_files = ReadyFiles(settle_time=0)
+        ready_files.add([self.file_path])
+        os.remove(self.file_path)
+        self.assertListEqual(ready_files.pop_ready(), [])
+        self.assertDictEqual(ready_files.pending, {})
@@ -0,0 +1,69 @@
+import os
+import tempfile
+from unittest import TestCase
+from zipfile import (
+    ZIP_BZIP2, ZIP_DEFLATED, ZIP_STORED, BadZipFile, ZipFile,
+)
+
+from zip_reader import MmapZipReader
+
+
+class MmapZipReaderTestCase(TestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.zip_file_path = os.path.join(temp_dir.name, 'documents.zip')
+        self.data = {
+            'stored.xml': b'<root>stored</root>',
+            'deflated.xml': b'<root>' + b'deflated' * 1000 + b'</root>',
+            'bzip2.xml': b'<root>bzip2</root>',
+            'empty.xml': b'',
+        }
+        compress_types = (ZIP_STORED, ZIP_DEFLATED, ZIP_BZIP2, ZIP_DEFLATED)
+        with ZipFile(self.zip_file_path, 'w') as zip_file:
+            for (file_name, data), compress_type in zip(
+                self.data.items(), compress_types,
+            ):
+                zip_file.writestr(file_name, data, compress_type)
+
+    def test_read(self):
+        with MmapZipReader(self.zip_file_path) as zip_reader:
+            for zip_info in zip_reader.infolist():
+                with self.subTest(file_name=zip_info.filename):
+                    data = zip_reader.read(zip_info)
+                    self.assertEqual(
+                        bytes(data), self.data[zip_info.filename],
+                    )
+                    if zip_info.compress_type == ZIP_STORED:
+                        self.assertIsInstance(data, memoryview)
+                        data.release()
+
+    def test_iter_read(self):
+        with MmapZipReader(self.zip_file_path) as zip_reader:
+            self.assertListEqual(
+                [
+                    bytes(data)
+                    for data in zip_reader.iter_read(zip_reader.infolist())
+                ],
+                list(self.data.values()),
+            )
+
+    def test_close_with_unreleased_buffer(self):
+        with MmapZipReader(self.zip_file_path) as zip_reader:
+            data = zip_reader.read(zip_reader.infolist()[0])
+        self.assertEqual(bytes(data), self.data['stored.xml'])
+
+    def test_bad_crc(self):
+        with open(self.zip_file_path, 'r+b') as zip_file:
+            content = zip_file.read()
+            zip_file.seek(content.index(b'>stored<'))
+            zip_file.write(b'>STORED<')
+
+        with MmapZipReader(self.zip_file_path) as zip_reader:
+            with self.assertRaises(BadZipFile):
+                zip_reader.read(zip_reader.infolist()[0])
+
+    def test_empty_file(self):
+        open(self.zip_file_path, 'wb').close()
+        with self.assertRaises(BadZipFile):
+            MmapZipReader(self.zip_file_path)
@@ -0,0 +1,123 @@
+import os
+import tempfile
+from io import BytesIO
+from unittest import TestCase
+from zipfile import ZIP_BZIP2, ZIP_DEFLATED, ZIP_LZMA, ZIP_STORED, ZipFile
+
+from generator import document_to_xml, generate_random_document
+from zip_reader import MmapZipReader
+from zip_writer import ZipStreamWriter, compress_member
+
+
+class ZipStreamWriterTestCase(TestCase):
+    def test_compress_types(self):
+        data = {
+            'stored.xml': b'<root>stored</root>',
+            'deflated.xml': b'<root>' + b'deflated' * 1000 + b'</root>',
+            'bzip2.xml': b'<root>bzip2</root>',
+            'lzma.xml': b'<root>' + b'lzma' * 1000 + b'</root>',
+            'empty.xml': b'',
+            'имя.xml': b'<root/>',
+        }
+        compress_types = (
+            ZIP_STORED, ZIP_DEFLATED, ZIP_BZIP2, ZIP_LZMA, ZIP_DEFLATED,
+            ZIP_STORED,
+        )
+        with tempfile.TemporaryDirectory() as temp_dir_path:
+            zip_file_path = os.path.join(temp_dir_path, 'documents.zip')
+            with open(zip_file_path, 'wb') as file, \
+                 ZipStreamWriter(file) as zip_writer:
+                for (file_name, file_data), compress_type in zip(
+                    data.items(), compress_types,
+                ):
+                    zip_writer.write(
+                        compress_member(file_name, file_data, compress_type),
+                    )
+
+            with ZipFile(zip_file_path) as zip_file:
+                self.assertIsNone(zip_file.testzip())
+                self.assertListEqual(zip_file.namelist(), list(data))
+                self.assertListEqual(
+                    [
+                        zip_info.compress_type
+                        for zip_info in zip_file.infolist()
+                    ],
+                    list(compress_types),
+                )
+                for file_name, file_data in data.items():
+                    self.assertEqual(zip_file.read(file_name), file_data)
+
+            with MmapZipReader(zip_file_path) as zip_reader:
+                self.assertListEqual(
+                    [
+                        bytes(file_data) for file_data in zip_reader.iter_read(
+                            zip_reader.infolist(),
+                        )
+                    ],
+                    list(data.values()),
+                )
+
+    def test_compression_level(self):
+        data = b'<root>' + os.urandom(1000).hex().encode() * 10 + b'</root>'
+        self.assertLess(
+            len(compress_member('a.xml', data, ZIP_DEFLATED, 9).data),
+            len(compress_member('a.xml', data, ZIP_DEFLATED, 0).data),
+        )
+
+    def test_lzma_compression_level(self):
+        # Повтор дальше словаря пресета 0 (256 КБ), но в пределах
+        # словаря пресета 1 (1 МБ)
+        data = os.urandom(512 * 1024) * 2
+        members = [
+            compress_member(f'{level}.xml', data, ZIP_LZMA, level)
+            for level in (0, 1)
+        ]
+        self.assertLess(len(members[1].data), len(members[0].data))
+
+        file = BytesIO()
+        with ZipStreamWriter(file) as zip_writer:
+            for member in members:
+                zip_writer.write(member)
+        with ZipFile(file) as zip_file:
+            for member in members:
+                self.assertEqual(zip_file.read(member.name), data)
+
+    def test_lzma_compression_level_options(self):
+        # Данные меньше словарей обоих пресетов: размер зависит от поиска
+        # совпадений и режима сжатия пресета
+        data = ''.join(
+            document_to_xml(generate_random_document()) for _ in range(300)
+        ).encode('utf-8')
+        members = [
+            compress_member(f'{level}.xml', data, ZIP_LZMA, level)
+            for level in (1, 6)
+        ]
+        self.assertLess(len(members[1].data), len(members[0].data))
+
+        file = BytesIO()
+        with ZipStreamWriter(file) as zip_writer:
+            for member in members:
+                zip_writer.write(member)
+        with ZipFile(file) as zip_file:
+            for member in members:
+                self.assertEqual(zip_file.read(member.name), data)
+
+    def test_zip64_file_count(self):
+        file = BytesIO()
+        with ZipStreamWriter(file) as zip_writer:
+            for file_num in range(70000):
+                zip_writer.write(
+                    compress_member(f'{file_num}.xml', b'', ZIP_STORED),
+                )
+        self.assertEqual(zip_writer.size, len(file.getvalue()))
+        with ZipFile(file) as zip_file:
+            self.assertEqual(len(zip_file.infolist()), 70000)
+            self.assertEqual(zip_file.infolist()[-1].filename, '69999.xml')
+
+    def test_no_central_directory_on_error(self):
+        file = BytesIO()
+        with self.assertRaises(ValueError):
+            with ZipStreamWriter(file) as zip_writer:
+                zip_writer.write(compress_member('a.xml', b'<root/>'))
+                raise ValueError
+        self.assertNotIn(b'PK\005\006', file.getvalue())
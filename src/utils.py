@@ -1,33 +1,323 @@
+import atexit
+import fnmatch
+import itertools
+import multiprocessing
 import os
+import queue
 import shutil
-from typing import Generator
+import threading
+from contextlib import contextmanager
+from typing import (
+    Any, Callable, Dict, Generator, Iterable, Iterator, List, Sequence, Tuple,
+)
+
+
+def _match_any(
+    relative_path: str, name: str, patterns: Sequence[str],
+) -> bool:
+    return any(
+        fnmatch.fnmatchcase(relative_path if '/' in pattern else name, pattern)
+        for pattern in patterns
+    )
+
+
+def scan_files(
+    dir_path: str, extension: str = None, recursive: bool = False,
+    include: Sequence[str] = (), exclude: Sequence[str] = (),
+) -> Generator[Tuple[str, os.DirEntry], None, None]:
+    """
+    Находит файлы папки через `os.scandir`
+
+    Пути отдаются по мере чтения папки, без загрузки списка целиком. Тип
+    записи берется из `os.DirEntry` (d_type), поэтому отдельный `stat` на
+    каждый файл не нужен. С `recursive` обходятся вложенные папки
+    (ссылки на папки не обходятся).
+
+    Шаблоны `include` и `exclude` (`fnmatch`) с `/` сравниваются с путем
+    относительно `dir_path` (`2024/*/*.zip`), без `/` — с именем. Если
+    `include` задан, отдаются только подходящие под него файлы; папки,
+    подходящие под `exclude`, не обходятся.
+
+    Отдает пары: путь относительно `dir_path` и `os.DirEntry` файла.
+    """
+    extension_with_dot = f'.{extension}' if extension else None
+    # Вложенные папки читаются после текущей, чтобы не держать открытыми
+    # дескрипторы всех папок пути
+    dir_paths = [('', dir_path)]
+    while dir_paths:
+        prefix, current_dir_path = dir_paths.pop()
+        with os.scandir(current_dir_path) as entries:
+            for entry in entries:
+                relative_path = f'{prefix}{entry.name}'
+                if recursive and entry.is_dir(follow_symlinks=False):
+                    if not _match_any(relative_path, entry.name, exclude):
+                        dir_paths.append((f'{relative_path}/', entry.path))
+                    continue
+                if not entry.is_file():
+                    continue
+                if extension_with_dot and not entry.name.endswith(
+                    extension_with_dot,
+                ):
+                    continue
+                if include and not _match_any(
+                    relative_path, entry.name, include,
+                ):
+                    continue
+                if _match_any(relative_path, entry.name, exclude):
+                    continue
+                yield relative_path.replace('/', os.sep), entry
 
 
 def filter_file_names(
-    dir_path: str, extension: str = None,
+    dir_path: str, extension: str = None, recursive: bool = False,
+    include: Sequence[str] = (), exclude: Sequence[str] = (),
 ) -> Generator[str, None, None]:
-    file_names = (
-        name for name in os.listdir(dir_path)
-        if os.path.isfile(os.path.join(dir_path, name))
-    )
-    if extension:
-        extension_with_dot = f'.{extension}'
-        file_names = (
-            name for name in file_names if name.endswith(extension_with_dot)
+    """ Пути файлов относительно `dir_path`, см. `scan_files` """
+    return (
+        relative_path
+        for relative_path, _ in scan_files(
+            dir_path, extension, recursive, include, exclude,
         )
-
-    return file_names
+    )
 
 
 def filter_file_paths(
-    dir_path: str, extension: str = None,
+    dir_path: str, extension: str = None, recursive: bool = False,
+    include: Sequence[str] = (), exclude: Sequence[str] = (),
 ) -> Generator[str, None, None]:
     return (
-        os.path.join(dir_path, file_name)
-        for file_name in filter_file_names(dir_path, extension)
+        entry.path
+        for _, entry in scan_files(
+            dir_path, extension, recursive, include, exclude,
+        )
     )
 
 
+def filter_file_sizes(
+    dir_path: str, extension: str = None, recursive: bool = False,
+    include: Sequence[str] = (), exclude: Sequence[str] = (),
+) -> Generator[Tuple[str, int], None, None]:
+    """
+    Пути файлов с размерами для планирования задач
+
+    `stat` выполняется только здесь и кэшируется в `os.DirEntry`.
+    """
+    return (
+        (entry.path, entry.stat().st_size)
+        for _, entry in scan_files(
+            dir_path, extension, recursive, include, exclude,
+        )
+    )
+
+
+def batched(iterable: Iterable, size: int) -> Iterator[List]:
+    iterator = iter(iterable)
+    batch = list(itertools.islice(iterator, size))
+    while batch:
+        yield batch
+        batch = list(itertools.islice(iterator, size))
+
+
+def calculate_chunksize(tasks_quantity: int, processes: int = None) -> int:
+    """ Размер пачки задач пула, как в `Pool.map`: 4 пачки на процесс """
+    processes = processes or os.cpu_count() or 1
+    chunksize, extra = divmod(tasks_quantity, processes * 4)
+    return max(1, chunksize + bool(extra))
+
+
+def plan_chunksize(
+    task_sizes: Sequence[int], processes: int = None, target_size: int = 0,
+) -> int:
+    """
+    Размер пачки задач с учетом их размеров
+
+    Мелкие задачи объединяются в пачки примерно по `target_size`, чтобы
+    не платить за передачу каждой; задачи размером с `target_size` и
+    больше передаются по одной, чтобы пул не простаивал в конце.
+    """
+    if not task_sizes:
+        return 1
+    average_size = max(1, sum(task_sizes) // len(task_sizes))
+    return max(
+        1,
+        min(
+            calculate_chunksize(len(task_sizes), processes),
+            target_size // average_size,
+        ),
+    )
+
+
+_shared_pools: Dict[int, multiprocessing.Pool] = {}
+
+
+def shared_pool(processes: int = None) -> multiprocessing.Pool:
+    """
+    Пул процессов, общий для вызовов в текущем процессе
+
+    Позволяет не запускать процессы заново для каждого вызова генератора
+    и сборщика. Пулы останавливаются при завершении программы.
+    """
+    processes = processes or os.cpu_count() or 1
+    pool = _shared_pools.get(processes)
+    if pool is None:
+        pool = _shared_pools[processes] = multiprocessing.Pool(processes)
+    return pool
+
+
+@atexit.register
+def close_shared_pools() -> None:
+    while _shared_pools:
+        _, pool = _shared_pools.popitem()
+        pool.terminate()
+        pool.join()
+
+
+@contextmanager
+def pool_or_new(
+    pool: multiprocessing.Pool = None, processes: int = None,
+    maxtasksperchild: int = None,
+) -> Iterator[multiprocessing.Pool]:
+    """ Переданный пул (он не закрывается) или новый пул на время блока """
+    if pool is not None:
+        yield pool
+        return
+
+    with multiprocessing.Pool(
+        processes, maxtasksperchild=maxtasksperchild,
+    ) as new_pool:
+        yield new_pool
+        new_pool.close()
+        new_pool.join()
+
+
+class _CompletedResult:
+    """ Результат `InProcessPool.apply_async`, как `AsyncResult` """
+    def __init__(self, value: Any = None, error: BaseException = None):
+        self._value = value
+        self._error = error
+
+    def ready(self) -> bool:
+        return True
+
+    def successful(self) -> bool:
+        return self._error is None
+
+    def wait(self, timeout: float = None) -> None:
+        pass
+
+    def get(self, timeout: float = None) -> Any:
+        if self._error is not None:
+            raise self._error
+        return self._value
+
+
+class InProcessPool:
+    """
+    Пул с интерфейсом `multiprocessing.Pool`, который выполняет задачи в
+    текущем процессе
+
+    Для небольших входных данных: запуск процессов пула и передача им
+    задач занимают больше времени, чем сами задачи. `apply_async`
+    выполняет задачу сразу, поэтому срок задачи не соблюдается, а
+    задачи потоков (например, чтения архивов) не выполняются
+    параллельно.
+    """
+    def map(
+        self, func: Callable, iterable: Iterable, chunksize: int = None,
+    ) -> List:
+        return list(map(func, iterable))
+
+    def imap(
+        self, func: Callable, iterable: Iterable, chunksize: int = 1,
+    ) -> Iterator:
+        return map(func, iterable)
+
+    imap_unordered = imap
+
+    def apply_async(
+        self, func: Callable, args: Sequence = (), kwds: dict = None,
+        callback: Callable[[Any], None] = None,
+        error_callback: Callable[[BaseException], None] = None,
+    ) -> _CompletedResult:
+        try:
+            value = func(*args, **(kwds or {}))
+        except Exception as error:
+            if error_callback is not None:
+                error_callback(error)
+            return _CompletedResult(error=error)
+        if callback is not None:
+            callback(value)
+        return _CompletedResult(value)
+
+    def close(self) -> None:
+        pass
+
+    def terminate(self) -> None:
+        pass
+
+    def join(self) -> None:
+        pass
+
+    def __enter__(self) -> 'InProcessPool':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        pass
+
+
+class BackgroundWriter:
+    """
+    Передает данные в `write` в отдельном потоке
+
+    Очередь ограничена `max_in_flight` элементами: если запись не
+    успевает, `write` блокируется. Ошибка записи выбрасывается из
+    следующего вызова `write` или из `close`.
+    """
+    def __init__(
+        self, write: Callable[[Any], Any], max_in_flight: int = 16,
+    ) -> None:
+        self._write = write
+        self._queue = queue.Queue(max_in_flight)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        for data in iter(self._queue.get, None):
+            # После ошибки очередь продолжает разбираться, чтобы не
+            # заблокировать пишущий поток
+            if self._error is None:
+                try:
+                    self._write(data)
+                except BaseException as error:
+                    self._error = error
+
+    def write(self, data: Any) -> None:
+        if self._error is not None:
+            raise self._error
+        self._queue.put(data)
+
+    def close(self) -> None:
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+    def __enter__(self) -> 'BackgroundWriter':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            # Исходная ошибка важнее ошибки записи
+            try:
+                self.close()
+            except BaseException:
+                pass
+
+
 def clear_directory(dir_path: str) -> None:
     """ 
     Удаляет папку и создает заново
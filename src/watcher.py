@@ -0,0 +1,232 @@
+"""
+Отслеживание новых файлов в папке
+
+`InotifyWatcher` получает события ядра Linux (inotify) о закрытых после
+записи и перемещенных в папку файлах. Где inotify нет, `PollingWatcher`
+периодически сравнивает размеры и время изменения файлов.
+`create_watcher` выбирает доступный способ.
+
+Событие не гарантирует, что файл дописан: запись могла продолжиться в
+другом открытии файла, поэтому готовность файла проверяет `ReadyFiles`.
+"""
+
+
+import os
+import select
+import struct
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from utils import filter_file_paths
+
+
+DEFAULT_POLL_INTERVAL = 1.0
+# Сколько секунд неизменный файл может оставаться неполным, прежде чем
+# считается испорченным (`ReadyFiles`)
+DEFAULT_INCOMPLETE_TIMEOUT = 60.0
+
+# Флаги inotify (linux/inotify.h)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+_INOTIFY_EVENT = struct.Struct('iIII')
+_INOTIFY_READ_SIZE = 64 * 1024
+
+
+class PollingWatcher:
+    """
+    Находит новые и измененные файлы, сравнивая `os.stat` файлов папки
+
+    `settle_time` — сколько размер и время изменения файла должны не
+    меняться, чтобы считать его дописанным: хотя бы между двумя опросами.
+    """
+    def __init__(
+        self, dir_path: str, extension: str = None,
+        poll_interval: float = DEFAULT_POLL_INTERVAL,
+    ) -> None:
+        self.dir_path = dir_path
+        self.extension = extension
+        self.poll_interval = self.settle_time = poll_interval
+        self._stats = self._scan()
+        self._polled_at = time.monotonic()
+
+    def _scan(self) -> Dict[str, Tuple[int, int]]:
+        stats = {}
+        for file_path in filter_file_paths(self.dir_path, self.extension):
+            try:
+                stat = os.stat(file_path)
+            except FileNotFoundError:
+                continue
+            stats[file_path] = (stat.st_size, stat.st_mtime_ns)
+        return stats
+
+    def wait(self, timeout: float) -> List[str]:
+        """ Возвращает новые и измененные файлы или [] через `timeout` """
+        delay = self._polled_at + self.poll_interval - time.monotonic()
+        if delay > timeout:
+            time.sleep(timeout)
+            return []
+        time.sleep(max(0.0, delay))
+
+        stats = self._scan()
+        self._polled_at = time.monotonic()
+        changed = [
+            file_path for file_path, stat in stats.items()
+            if self._stats.get(file_path) != stat
+        ]
+        self._stats = stats
+        return changed
+
+    def close(self) -> None:
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+
+class InotifyWatcher(PollingWatcher):
+    """
+    Получает события inotify о файлах, закрытых после записи или
+    перемещенных в папку
+
+    Если очередь событий ядра переполнилась, папка просматривается
+    заново, как в `PollingWatcher`. Закрытый после записи файл считается
+    дописанным сразу (`settle_time` 0).
+    """
+    def __init__(self, dir_path: str, extension: str = None) -> None:
+        # ctypes нужен только здесь, а импортируется дольше остального
+        # модуля
+        import ctypes
+        import ctypes.util
+
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        # AttributeError, если в libc нет inotify
+        inotify_init1, inotify_add_watch = (
+            libc.inotify_init1, libc.inotify_add_watch,
+        )
+        self._fd = inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        if inotify_add_watch(
+            self._fd, os.fsencode(dir_path), IN_CLOSE_WRITE | IN_MOVED_TO,
+        ) < 0:
+            error = OSError(ctypes.get_errno(), 'inotify_add_watch failed')
+            os.close(self._fd)
+            raise error
+        # Подписка оформлена до просмотра папки: файл, появившийся между
+        # ними, не будет пропущен
+        super().__init__(dir_path, extension, poll_interval=0.0)
+
+    def _read_events(self) -> Set[str]:
+        file_paths = set()
+        while True:
+            try:
+                data = os.read(self._fd, _INOTIFY_READ_SIZE)
+            except BlockingIOError:
+                return file_paths
+            offset = 0
+            while offset < len(data):
+                _, mask, _, name_size = _INOTIFY_EVENT.unpack_from(
+                    data, offset,
+                )
+                offset += _INOTIFY_EVENT.size
+                name = data[offset:offset + name_size].rstrip(b'\0')
+                offset += name_size
+                if mask & IN_Q_OVERFLOW:
+                    file_paths.update(self._scan())
+                elif name:
+                    file_path = os.path.join(self.dir_path, os.fsdecode(name))
+                    if self.extension is None or file_path.endswith(
+                        f'.{self.extension}',
+                    ):
+                        file_paths.add(file_path)
+
+    def wait(self, timeout: float) -> List[str]:
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return []
+        return sorted(self._read_events())
+
+    def close(self) -> None:
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+def create_watcher(
+    dir_path: str, extension: str = None,
+    poll_interval: float = DEFAULT_POLL_INTERVAL,
+) -> PollingWatcher:
+    """ `InotifyWatcher`, если inotify доступен, иначе `PollingWatcher` """
+    try:
+        return InotifyWatcher(dir_path, extension)
+    except (AttributeError, OSError, TypeError):
+        return PollingWatcher(dir_path, extension, poll_interval)
+
+
+class ReadyFiles:
+    """
+    Файлы, дописанные до конца
+
+    Файл готов, если его размер и время изменения не меняются
+    `settle_time` секунд и `is_complete` (например, `zipfile.is_zipfile`)
+    подтверждает, что файл целый. Иначе файл остается в ожидании.
+
+    Файл, который не меняется `incomplete_timeout` секунд, но так и не
+    стал целым, больше не ожидается и возвращается `pop_failed`. Если
+    файл потом изменится, он снова будет добавлен в ожидание через `add`.
+    """
+    def __init__(
+        self, settle_time: float,
+        is_complete: Callable[[str], bool] = os.path.isfile,
+        incomplete_timeout: float = DEFAULT_INCOMPLETE_TIMEOUT,
+    ) -> None:
+        self.settle_time = settle_time
+        self.is_complete = is_complete
+        self.incomplete_timeout = incomplete_timeout
+        self.pending: Dict[str, Tuple[Tuple[int, int], float]] = {}
+        self.failed: List[str] = []
+
+    @staticmethod
+    def _signature(file_path: str) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(file_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_size, stat.st_mtime_ns
+
+    def add(self, file_paths: Iterable[str]) -> None:
+        # Время отсчитывается заново при каждом изменении
+        now = time.monotonic()
+        for file_path in file_paths:
+            self.pending[file_path] = (self._signature(file_path), now)
+
+    def pop_ready(self) -> List[str]:
+        now = time.monotonic()
+        ready = []
+        for file_path, (signature, since) in list(self.pending.items()):
+            current_signature = self._signature(file_path)
+            if current_signature is None:
+                # Файл удален или перемещен
+                del self.pending[file_path]
+            elif current_signature != signature:
+                self.pending[file_path] = (current_signature, now)
+            elif now - since >= self.settle_time:
+                if self.is_complete(file_path):
+                    del self.pending[file_path]
+                    ready.append(file_path)
+                elif now - since >= self.incomplete_timeout:
+                    del self.pending[file_path]
+                    self.failed.append(file_path)
+        return sorted(ready)
+
+    def pop_failed(self) -> List[str]:
+        """ Файлы, которые перестали ожидаться, так и не став целыми """
+        failed, self.failed = sorted(self.failed), []
+        return failed
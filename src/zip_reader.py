@@ -0,0 +1,184 @@
+"""
+Чтение файлов zip-архива через mmap
+
+`ZipFile.open()` читает файл архива буферами и копирует данные на каждом
+шаге. `MmapZipReader` отображает архив в память, читает центральный
+каталог один раз и возвращает данные файла без копирования
+(`memoryview` на отображение) для несжатых файлов и одним выделением
+памяти (`zlib.decompress` с известным размером) для сжатых deflate.
+Остальные методы сжатия и зашифрованные файлы читаются через `ZipFile`.
+
+`ZipBufferReader` так же читает файлы из заранее прочитанного диапазона
+байт архива (`read_zip_members_range`), например, прочитанного заранее в
+отдельном потоке на медленном хранилище.
+"""
+
+
+import mmap
+import struct
+import zlib
+from typing import Iterable, Iterator, List, Sequence, Tuple, Union
+from zipfile import ZIP_DEFLATED, ZIP_STORED, BadZipFile, ZipFile, ZipInfo
+
+
+_LOCAL_FILE_HEADER = struct.Struct('<4s2B4HL2L2H')
+_LOCAL_FILE_HEADER_SIGNATURE = b'PK\003\004'
+_LOCAL_FILE_NAME_LENGTH = 10
+_LOCAL_EXTRA_FIELD_LENGTH = 11
+_FLAG_ENCRYPTED = 0x1
+
+
+class ZipBufferReader:
+    """
+    Читает файлы архива из буфера с байтами архива
+
+    `buffer` содержит байты архива, начиная со смещения `offset`, например,
+    отображение всего архива или заранее прочитанный диапазон файлов
+    (`read_zip_members_range`). Файлы, которые нельзя прочитать из
+    буфера, читаются из архива через `ZipFile`.
+
+    Возвращаемые `memoryview` ссылаются на буфер: их нужно освободить до
+    закрытия читателя, поэтому удобнее читать файлы через `iter_read`,
+    который освобождает каждый буфер при переходе к следующему.
+    """
+    def __init__(
+        self, zip_file_path: str, buffer, offset: int = 0,
+        zip_file: ZipFile = None,
+    ) -> None:
+        self.zip_file_path = zip_file_path
+        self.zip_file = zip_file
+        self._buffer = buffer
+        self._offset = offset
+
+    def _data_offset(self, zip_info: ZipInfo) -> int:
+        header_offset = zip_info.header_offset - self._offset
+        header = _LOCAL_FILE_HEADER.unpack_from(self._buffer, header_offset)
+        if header[0] != _LOCAL_FILE_HEADER_SIGNATURE:
+            raise BadZipFile(f'Bad magic number for file {zip_info.filename}')
+        return (
+            header_offset + _LOCAL_FILE_HEADER.size
+            + header[_LOCAL_FILE_NAME_LENGTH]
+            + header[_LOCAL_EXTRA_FIELD_LENGTH]
+        )
+
+    def _read_from_zip_file(self, zip_info: ZipInfo) -> bytes:
+        if self.zip_file is None:
+            self.zip_file = ZipFile(self.zip_file_path, 'r')
+        return self.zip_file.read(zip_info)
+
+    def read(self, zip_info: ZipInfo) -> Union[memoryview, bytes]:
+        """
+        Возвращает данные файла архива
+
+        Для несжатых файлов — `memoryview` на буфер, для остальных —
+        `bytes`. Контрольная сумма проверяется, как в `ZipFile`.
+        """
+        if (
+            self._buffer is None
+            or zip_info.flag_bits & _FLAG_ENCRYPTED
+            or zip_info.compress_type not in (ZIP_STORED, ZIP_DEFLATED)
+        ):
+            return self._read_from_zip_file(zip_info)
+
+        start = self._data_offset(zip_info)
+        compressed = memoryview(self._buffer)[
+            start:start + zip_info.compress_size
+        ]
+        if zip_info.compress_type == ZIP_STORED:
+            data = compressed
+        else:
+            try:
+                data = zlib.decompress(
+                    compressed, -zlib.MAX_WBITS, zip_info.file_size,
+                )
+            finally:
+                compressed.release()
+
+        if zlib.crc32(data) != zip_info.CRC:
+            if isinstance(data, memoryview):
+                data.release()
+            raise BadZipFile(f'Bad CRC-32 for file {zip_info.filename}')
+        return data
+
+    def iter_read(
+        self, zip_infos: Iterable[ZipInfo],
+    ) -> Iterator[Union[memoryview, bytes]]:
+        for zip_info in zip_infos:
+            data = self.read(zip_info)
+            try:
+                yield data
+            finally:
+                if isinstance(data, memoryview):
+                    data.release()
+
+    def close(self) -> None:
+        if self.zip_file is not None:
+            self.zip_file.close()
+
+    def __enter__(self) -> 'ZipBufferReader':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+
+class MmapZipReader(ZipBufferReader):
+    """
+    Читает файлы архива из отображенной в память копии
+
+    Если файл нельзя отобразить в память (например, пустой), архив
+    читается через `ZipFile` как обычно.
+    """
+    def __init__(self, zip_file_path: str) -> None:
+        self._file = open(zip_file_path, 'rb')
+        try:
+            mapping = mmap.mmap(
+                self._file.fileno(), 0, access=mmap.ACCESS_READ,
+            )
+        except (ValueError, OSError):
+            mapping = None
+        super().__init__(zip_file_path, mapping)
+        try:
+            self.zip_file = ZipFile(self._file, 'r')
+        except BaseException:
+            self.close()
+            raise
+
+    def infolist(self) -> List[ZipInfo]:
+        return self.zip_file.infolist()
+
+    def close(self) -> None:
+        super().close()
+        if self._buffer is not None:
+            try:
+                self._buffer.close()
+            except BufferError:
+                # Буфер еще не освобожден (например, разбор прерван):
+                # отображение закроется, когда буфер будет удален
+                pass
+        self._file.close()
+
+
+def read_zip_members_range(
+    zip_file: ZipFile, zip_infos: Sequence[ZipInfo],
+) -> Tuple[int, bytes]:
+    """
+    Читает одним запросом непрерывный диапазон байт с файлами `zip_infos`
+
+    Возвращает смещение диапазона в архиве и его байты для
+    `ZipBufferReader`. Диапазон заканчивается там, где начинается
+    следующий файл архива или центральный каталог.
+    """
+    if not zip_infos:
+        return 0, b''
+    start = min(zip_info.header_offset for zip_info in zip_infos)
+    last_header_offset = max(zip_info.header_offset for zip_info in zip_infos)
+    stop = min(
+        (
+            zip_info.header_offset for zip_info in zip_file.infolist()
+            if zip_info.header_offset > last_header_offset
+        ),
+        default=zip_file.start_dir,
+    )
+    zip_file.fp.seek(start)
+    return start, zip_file.fp.read(stop - start)
@@ -0,0 +1,261 @@
+"""
+Запись zip-архива из заранее сжатых файлов
+
+`ZipFile.writestr` сжимает файл в том же процессе, который пишет архив.
+`compress_member` сжимает файл отдельно, например, в процессе пула, а
+`ZipStreamWriter` дописывает в архив уже сжатые данные с известными CRC и
+размерами и в конце пишет центральный каталог (в формате Zip64, если
+файлов больше 65535 или архив больше 4 ГБ). После записи данные файла
+в памяти не хранятся: до конца архива хранится только его заголовок в
+центральном каталоге, около 60 байт.
+
+Поддерживаются методы сжатия `ZipFile`: ZIP_STORED, ZIP_DEFLATED,
+ZIP_BZIP2 и ZIP_LZMA. В отличие от `ZipFile`, уровень сжатия ZIP_LZMA —
+пресет LZMA (0-9).
+"""
+
+
+import bz2
+import lzma
+import struct
+import time
+import zlib
+from typing import BinaryIO, NamedTuple, Tuple
+from zipfile import (
+    ZIP_BZIP2, ZIP_DEFLATED, ZIP_LZMA, ZIP_STORED, LargeZipFile,
+)
+
+
+# Форматы записей (APPNOTE.TXT, как в `zipfile`)
+_LOCAL_FILE_HEADER = struct.Struct('<4s2B4HL2L2H')
+_CENTRAL_DIRECTORY_HEADER = struct.Struct('<4s4B4HL2L5H2L')
+_END_OF_CENTRAL_DIRECTORY = struct.Struct('<4s4H2LH')
+_ZIP64_END_OF_CENTRAL_DIRECTORY = struct.Struct('<4sQ2H2L4Q')
+_ZIP64_END_OF_CENTRAL_DIRECTORY_LOCATOR = struct.Struct('<4sLQL')
+_ZIP64_EXTRA_OFFSET = struct.Struct('<2HQ')
+
+_LOCAL_FILE_HEADER_SIGNATURE = b'PK\003\004'
+_CENTRAL_DIRECTORY_SIGNATURE = b'PK\001\002'
+_END_OF_CENTRAL_DIRECTORY_SIGNATURE = b'PK\005\006'
+_ZIP64_END_OF_CENTRAL_DIRECTORY_SIGNATURE = b'PK\006\006'
+_ZIP64_END_OF_CENTRAL_DIRECTORY_LOCATOR_SIGNATURE = b'PK\006\007'
+_ZIP64_EXTRA_TAG = 0x0001
+
+_ZIP64_LIMIT = 0xffffffff
+_ZIP_FILE_COUNT_LIMIT = 0xffff
+
+_FLAG_LZMA_EOS = 0x02
+# Заголовок данных LZMA: версия SDK (9.4) и размер свойств фильтра
+_LZMA_HEADER = struct.Struct('<BBH')
+_LZMA_SDK_VERSION = (9, 4)
+_FLAG_UTF8 = 0x800
+_SYSTEM_UNIX = 3
+_EXTERNAL_ATTR = 0o600 << 16
+
+_DEFAULT_VERSION = 20
+_ZIP64_VERSION = 45
+_EXTRACT_VERSIONS = {
+    ZIP_STORED: _DEFAULT_VERSION,
+    ZIP_DEFLATED: _DEFAULT_VERSION,
+    ZIP_BZIP2: 46,
+    ZIP_LZMA: 63,
+}
+
+
+class CompressedMember(NamedTuple):
+    """ Сжатый файл архива """
+    name: str
+    compress_type: int
+    crc: int
+    file_size: int
+    data: bytes
+
+
+def _compress_lzma(data: bytes, preset: int = None) -> bytes:
+    # Как `zipfile.LZMACompressor`, но с пресетом: свойства фильтра
+    # записываются перед сжатыми данными. В свойства попадают только
+    # lc/lp/pb и размер словаря, поэтому сжатие идет по исходному фильтру
+    # (с поиском совпадений и режимом пресета), а не по разобранным
+    # свойствам
+    filter_ = {'id': lzma.FILTER_LZMA1}
+    if preset is not None:
+        filter_['preset'] = preset
+    properties = lzma._encode_filter_properties(filter_)
+    compressor = lzma.LZMACompressor(lzma.FORMAT_RAW, filters=[filter_])
+    return b''.join(
+        (
+            _LZMA_HEADER.pack(*_LZMA_SDK_VERSION, len(properties)),
+            properties, compressor.compress(data), compressor.flush(),
+        )
+    )
+
+
+def compress_member(
+    name: str, data: bytes, compress_type: int = ZIP_STORED,
+    compression_level: int = None,
+) -> CompressedMember:
+    """ Сжимает данные файла архива так же, как `ZipFile` """
+    if compress_type == ZIP_STORED:
+        compressed_data = data
+    elif compress_type == ZIP_DEFLATED:
+        compressor = zlib.compressobj(
+            zlib.Z_DEFAULT_COMPRESSION
+            if compression_level is None else compression_level,
+            zlib.DEFLATED, -15,
+        )
+        compressed_data = compressor.compress(data) + compressor.flush()
+    elif compress_type == ZIP_BZIP2:
+        compressed_data = bz2.compress(
+            data, 9 if compression_level is None else compression_level,
+        )
+    elif compress_type == ZIP_LZMA:
+        compressed_data = _compress_lzma(data, compression_level)
+    else:
+        raise NotImplementedError(
+            f'Compression method {compress_type} is not supported',
+        )
+    return CompressedMember(
+        name, compress_type, zlib.crc32(data), len(data), compressed_data,
+    )
+
+
+def _dos_date_time(timestamp: float) -> Tuple[int, int]:
+    year, month, day, hour, minute, second = time.localtime(timestamp)[:6]
+    return (
+        (max(year, 1980) - 1980) << 9 | month << 5 | day,
+        hour << 11 | minute << 5 | second // 2,
+    )
+
+
+class ZipStreamWriter:
+    """
+    Пишет сжатые `compress_member` файлы в zip-архив
+
+    Архив пишется последовательно с начала файла `file`, поэтому подходят
+    и файлы без `seek`. Время изменения всех файлов — время создания
+    объекта (или `timestamp`).
+    """
+    def __init__(self, file: BinaryIO, timestamp: float = None) -> None:
+        self.file = file
+        self._date, self._time = _dos_date_time(
+            time.time() if timestamp is None else timestamp,
+        )
+        self._offset = 0
+        self._central_directory = bytearray()
+        self._entries_quantity = 0
+        self._closed = False
+
+    def _write(self, data: bytes) -> None:
+        self.file.write(data)
+        self._offset += len(data)
+
+    def write(self, member: CompressedMember) -> None:
+        if max(member.file_size, len(member.data)) >= _ZIP64_LIMIT:
+            raise LargeZipFile(f'File {member.name} is too large')
+        try:
+            name = member.name.encode('ascii')
+            flags = 0
+        except UnicodeEncodeError:
+            name = member.name.encode('utf-8')
+            flags = _FLAG_UTF8
+        if member.compress_type == ZIP_LZMA:
+            flags |= _FLAG_LZMA_EOS
+
+        self._central_directory += self._central_directory_header(
+            member, name, flags,
+        )
+        self._entries_quantity += 1
+        self._write(
+            _LOCAL_FILE_HEADER.pack(
+                _LOCAL_FILE_HEADER_SIGNATURE,
+                _EXTRACT_VERSIONS[member.compress_type], 0, flags,
+                member.compress_type, self._time, self._date, member.crc,
+                len(member.data), member.file_size, len(name), 0,
+            ),
+        )
+        self._write(name)
+        self._write(member.data)
+
+    def _central_directory_header(
+        self, member: CompressedMember, name: bytes, flags: int,
+    ) -> bytes:
+        extract_version = _EXTRACT_VERSIONS[member.compress_type]
+        extra = b''
+        header_offset = self._offset
+        if header_offset >= _ZIP64_LIMIT:
+            extra = _ZIP64_EXTRA_OFFSET.pack(
+                _ZIP64_EXTRA_TAG, _ZIP64_EXTRA_OFFSET.size - 4,
+                header_offset,
+            )
+            header_offset = _ZIP64_LIMIT
+            extract_version = max(extract_version, _ZIP64_VERSION)
+        return b''.join((
+            _CENTRAL_DIRECTORY_HEADER.pack(
+                _CENTRAL_DIRECTORY_SIGNATURE, extract_version, _SYSTEM_UNIX,
+                extract_version, 0, flags, member.compress_type,
+                self._time, self._date, member.crc, len(member.data),
+                member.file_size, len(name), len(extra), 0, 0, 0,
+                _EXTERNAL_ATTR, header_offset,
+            ),
+            name,
+            extra,
+        ))
+
+    def close(self) -> None:
+        """ Пишет центральный каталог; файл `file` не закрывается """
+        if self._closed:
+            return
+        self._closed = True
+
+        directory_offset = self._offset
+        self._write(self._central_directory)
+        self._central_directory = bytearray()
+        directory_size = self._offset - directory_offset
+        entries_quantity = self._entries_quantity
+
+        if (
+            entries_quantity >= _ZIP_FILE_COUNT_LIMIT
+            or directory_offset >= _ZIP64_LIMIT
+            or directory_size >= _ZIP64_LIMIT
+        ):
+            zip64_offset = self._offset
+            self._write(
+                _ZIP64_END_OF_CENTRAL_DIRECTORY.pack(
+                    _ZIP64_END_OF_CENTRAL_DIRECTORY_SIGNATURE,
+                    _ZIP64_END_OF_CENTRAL_DIRECTORY.size - 12,
+                    _ZIP64_VERSION, _ZIP64_VERSION, 0, 0,
+                    entries_quantity, entries_quantity, directory_size,
+                    directory_offset,
+                ),
+            )
+            self._write(
+                _ZIP64_END_OF_CENTRAL_DIRECTORY_LOCATOR.pack(
+                    _ZIP64_END_OF_CENTRAL_DIRECTORY_LOCATOR_SIGNATURE, 0,
+                    zip64_offset, 1,
+                ),
+            )
+            entries_quantity = min(entries_quantity, _ZIP_FILE_COUNT_LIMIT)
+            directory_offset = min(directory_offset, _ZIP64_LIMIT)
+            directory_size = min(directory_size, _ZIP64_LIMIT)
+
+        self._write(
+            _END_OF_CENTRAL_DIRECTORY.pack(
+                _END_OF_CENTRAL_DIRECTORY_SIGNATURE, 0, 0, entries_quantity,
+                entries_quantity, directory_size, directory_offset, 0,
+            ),
+        )
+        self.file.flush()
+
+    @property
+    def size(self) -> int:
+        """ Сколько байт записано """
+        return self._offset
+
+    def __enter__(self) -> 'ZipStreamWriter':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        # При ошибке архив остается незаконченным: центральный каталог
+        # не пишется, и такой архив не откроется как целый
+        if exc_type is None:
+            self.close()